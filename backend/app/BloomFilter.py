@@ -4,6 +4,18 @@ import math
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import hashlib
+import struct
+from redis.exceptions import NoScriptError, RedisError
+from app.metrics import POSITIONS_SECONDS, REDIS_PIPELINE_SECONDS, REDIS_ERRORS
+from app.bitmap import bitmap_bytes
+from app.stats import stats_key, filter_stats, RECONCILE_CHUNK_BYTES
+
+# numpy is only needed for the batched position math, without it we fall back to
+# the scalar path one item at a time
+try:
+  import numpy as np
+except ImportError:
+  np = None
 
 # Connect to Redis
 # redis_client = redis.Redis(
@@ -12,20 +24,93 @@ import hashlib
 #     decode_responses=False
 # )
 
+# server side versions of check/add, one EVALSHA instead of k GETBIT/SETBIT commands
+# KEYS[1] = bitmap key, ARGV = bit positions
+# check stops at the first unset bit and only sends back a single 0/1
+CHECK_SCRIPT = """
+for i = 1, #ARGV do
+  if redis.call('GETBIT', KEYS[1], ARGV[i]) == 0 then
+    return 0
+  end
+end
+return 1
+"""
+
+# add returns how many bits were 0 before, SETBIT already hands back the old value
+ADD_SCRIPT = """
+local newly_set = 0
+for i = 1, #ARGV do
+  if redis.call('SETBIT', KEYS[1], ARGV[i], 1) == 0 then
+    newly_set = newly_set + 1
+  end
+end
+return newly_set
+"""
+
+
+# how item -> bit positions works. stored with the filter (snapshots, redis metadata)
+# because a filter can only be read back with the scheme it was written with
+#   1: mmh3 seeds 0 and 1 over the hex digest string, the original scheme
+#   2: h1/h2 read straight out of the digest bytes. a sha-1/sha-256 digest is already
+#      uniformly distributed, so hashing it a second time buys nothing
+HASH_SCHEME_MMH3 = 1
+HASH_SCHEME_DIGEST = 2
+HASH_SCHEMES = (HASH_SCHEME_MMH3, HASH_SCHEME_DIGEST)
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+def _digest_bytes(item):
+  """
+  raw digest bytes from either raw bytes or a hex string
+  """
+  return item if isinstance(item, bytes) else bytes.fromhex(item)
+
+
+def _script_sha(script):
+  return hashlib.sha1(script.encode()).hexdigest()
+
+
+def _chunks(items, chunk_size):
+  for start in range(0, len(items), chunk_size):
+    yield items[start:start + chunk_size]
+
+
+def _decode(value):
+  return value.decode() if isinstance(value, bytes) else str(value)
+
 
 class BloomFilter:
 
-  def __init__(self, redis_client, expected_items=1_000_000, fp_rate =0.001, ):
+  LAYOUT = "standard"
+
+  def __init__(self, redis_client, expected_items=1_000_000, fp_rate =0.001, use_scripts=False, hash_scheme=HASH_SCHEME_MMH3):
     """
     Calcaulte the optimal size & number of hash functions
+
+    use_scripts=True runs check/add as Lua scripts inside redis (one EVALSHA each)
+    hash_scheme picks how positions are derived, see HASH_SCHEMES
     """
+    if hash_scheme not in HASH_SCHEMES:
+      raise ValueError(f"Unknown hash scheme {hash_scheme}, expected one of {HASH_SCHEMES}")
+
     self.expected_items = expected_items
     self.fp_rate = fp_rate
+    self.hash_scheme = hash_scheme
 
     self.bit_size = self._calculate_bit_size()
     self.num_hashes = self._calculate_hash_count()
     self.redis_key = "bloom:passwords"
     self.redis_client = redis_client
+
+    # when set, every add also appends its positions to this redis stream so local
+    # replicas of the bitmap (app.replica) can catch up without re-reading it all
+    self.changelog_key = None
+    self.changelog_maxlen = 1_000_000
+
+    self.use_scripts = use_scripts
+    self._check_sha = _script_sha(CHECK_SCRIPT)
+    self._add_sha = _script_sha(ADD_SCRIPT)
   
   def _calculate_bit_size(self):
     """
@@ -44,12 +129,25 @@ class BloomFilter:
   
 
 
+  def _hash_input(self, item):
+    """
+    items are sha digests, as a hex string or raw bytes. scheme 1 always hashed the
+    hex string so bytes get hex encoded, scheme 2 wants the raw digest
+    """
+    if self.hash_scheme == HASH_SCHEME_DIGEST:
+      return _digest_bytes(item)
+    return item.hex() if isinstance(item, bytes) else item
+
   def _get_bit_positions(self, item:str):
     """
     so instead of k hash functions, we'll use 2 base hashes to generate k positions
 
     following paper describes using 2 hash functions to simulate additional hash functions g(x) = h1(x) + i*h2(x)
     """
+    item = self._hash_input(item)
+    if self.hash_scheme == HASH_SCHEME_DIGEST:
+      return self._get_digest_positions(item)
+
     # two independent hash vals
 
     hash1 = mmh3.hash(item, seed=0)
@@ -61,34 +159,556 @@ class BloomFilter:
       positions.append(position)
     return positions
 
-  def add(self, password_hash):
+  def _get_digest_positions(self, digest):
     """
-    calculating and adding bits to Redis to persist
+    scheme 2: h1 and h2 are the first two little endian 64 bit words of the digest,
+    g(x) = (h1 + i*h2) mod 2^64 mod m. the 2^64 wrap is part of the scheme so numpy's
+    uint64 math gives the same answer
+    """
+    hash1, hash2 = struct.unpack_from("<QQ", digest)
+    positions = []
+    for _ in range(self.num_hashes):
+      positions.append(hash1 % self.bit_size)
+      hash1 = (hash1 + hash2) & MASK64
+    return positions
+
+  def _get_bit_positions_array(self, items):
+    """
+    _get_bit_positions for a whole batch at once, returns a (len(items), k) int64 array
+
+    the two mmh3 hashes still run per item (seeds 0 and 1, so positions match the
+    scalar function bit for bit and existing filters stay valid), but h1 + i*h2 mod m
+    is done as one numpy expression over the whole matrix instead of a python loop.
+    |h1 + i*h2| < 2^31 * (k + 1) so int64 can't overflow
+    """
+    if self.hash_scheme == HASH_SCHEME_DIGEST:
+      words = np.frombuffer(b"".join(_digest_bytes(item)[:16] for item in items), dtype="<u8").reshape(-1, 2)
+      i = np.arange(self.num_hashes, dtype=np.uint64)
+      return ((words[:, :1] + i * words[:, 1:2]) % np.uint64(self.bit_size)).astype(np.int64)
+
+    items = [self._hash_input(item) for item in items]
+    hash1 = np.fromiter((mmh3.hash(item, seed=0) for item in items), dtype=np.int64, count=len(items))
+    hash2 = np.fromiter((mmh3.hash(item, seed=1) for item in items), dtype=np.int64, count=len(items))
+    i = np.arange(self.num_hashes, dtype=np.int64)
+    return np.abs(hash1[:, None] + i * hash2[:, None]) % self.bit_size
+
+  def _get_bit_positions_many(self, items):
+    """
+    positions for a batch as plain lists of ints (redis-py won't encode numpy ints)
+    """
+    if np is None or not items:
+      return [self._get_bit_positions(item) for item in items]
+    return self._get_bit_positions_array(items).tolist()
+
+  def _queue_add(self, pipe, positions):
+    """
+    queue the SETBITs for one item on a pipeline, returns how many replies that adds
 
     SETBIT key offset value
     """
-    positions = self._get_bit_positions(password_hash)
+    if self.use_scripts:
+      pipe.evalsha(self._add_sha, 1, self.redis_key, *positions)
+      replies = 1
+    else:
+      for pos in positions:
+        pipe.setbit(self.redis_key, pos, 1)
+      replies = len(positions)
 
-    #set bits in redis using Redis pipeline
-    pipe = self.redis_client.pipeline()
-    for pos in positions:
-      pipe.setbit(self.redis_key, pos, 1)
-    pipe.execute()
-  
+    return replies + self._queue_changelog(pipe, positions)
 
-  def check(self, password_hash):
+  def _queue_changelog(self, pipe, positions):
     """
-    check if all k bits are set to 1
+    XADD the positions an add just set, in the same MULTI/EXEC as the bits themselves
     """
+    if not self.changelog_key:
+      return 0
+    pipe.xadd(
+      self.changelog_key,
+      {"positions": ",".join(map(str, positions))},
+      maxlen=self.changelog_maxlen,
+      approximate=True
+    )
+    return 1
 
-    positions = self._get_bit_positions(password_hash)
+  def _newly_set(self, replies):
+    """
+    how many bits one add flipped from 0, from its SETBIT replies (the old bits)
+    or the add script's count
+    """
+    if self.use_scripts:
+      return int(replies[0])
+    return sum(1 for bit in replies if bit == 0)
 
-    pipe = self.redis_client.pipeline()
+  def _split_added(self, replies, reply_counts):
+    """
+    newly set bits per item, reply_counts is whatever _queue_add returned for each
+    """
+    changelog_replies = 1 if self.changelog_key else 0
+    newly_set = []
+    offset = 0
+    for count in reply_counts:
+      newly_set.append(self._newly_set(replies[offset:offset + count - changelog_replies]))
+      offset += count
+    return newly_set
+
+  @property
+  def stats_key(self):
+    return stats_key(self.redis_key)
+
+  def _queue_stats(self, pipe, newly_set):
+    """
+    HINCRBY the totals /stats serves, an add that flipped no bits doesn't count as an item
+    """
+    pipe.hincrby(self.stats_key, "bits_set", sum(newly_set))
+    pipe.hincrby(self.stats_key, "items", sum(1 for bits in newly_set if bits))
+
+  def _queue_check(self, pipe, positions):
+    """
+    queue the GETBITs for one item on a pipeline, returns how many replies that adds
+
+    in script mode it's a single EVALSHA and a single 0/1 reply
+    """
+    if self.use_scripts:
+      pipe.evalsha(self._check_sha, 1, self.redis_key, *positions)
+      return 1
     for pos in positions:
       pipe.getbit(self.redis_key, pos)
-      
-    redis_bits = pipe.execute()
+    return len(positions)
+
+  def _is_member(self, redis_bits):
+    """
+    an item is (probably) in the set only if every one of its bits is 1
+    """
     for bit in redis_bits:
       if bit == 0:
         return False
-    return True
\ No newline at end of file
+    return True
+
+  def _split_results(self, redis_bits, reply_counts):
+    """
+    cut one pipeline's replies back into per-item results, in queue order
+
+    reply_counts is whatever _queue_check returned for each item
+    """
+    results = []
+    offset = 0
+    for count in reply_counts:
+      results.append(self._is_member(redis_bits[offset:offset + count]))
+      offset += count
+    return results
+
+  @property
+  def params_key(self):
+    return f"{self.redis_key}:params"
+
+  def params(self):
+    """
+    everything that decides which bits an item lands on. bits written under one
+    set of params are noise to a filter with any other
+    """
+    return {"layout": self.LAYOUT, "bit_size": self.bit_size, "num_hashes": self.num_hashes, "hash_scheme": self.hash_scheme}
+
+  def _queue_inspect(self, pipe):
+    pipe.hgetall(self.params_key)
+    pipe.strlen(self.redis_key)
+
+  def _queue_record_params(self, pipe):
+    """
+    HSETNX every param then read them all back, so two workers starting with
+    different settings can't both think they wrote the hash
+    """
+    for field, value in self.params().items():
+      pipe.hsetnx(self.params_key, field, value)
+    pipe.hgetall(self.params_key)
+
+  def _queue_presize(self, pipe):
+    """
+    BITFIELD INCRBY u1 <last bit> 0: redis grows the string to the last bit in
+    one allocation, zero filled, and adding 0 leaves every bit as it was (a SETBIT
+    0 there could clear an item's bit). on a full size key it changes nothing
+    """
+    pipe.bitfield(self.redis_key).incrby("u1", self.bit_size - 1, 0).execute()
+
+  def _check_params(self, stored):
+    stored = {_decode(field): _decode(value) for field, value in stored.items()}
+    expected = {field: str(value) for field, value in self.params().items()}
+    if stored != expected:
+      raise ValueError(
+        f"{self.redis_key} was written as {stored}, the configured filter is {expected}. "
+        f"its items would be read from the wrong bits, use a fresh key or rebuild it with python -m app.build"
+      )
+
+  def _check_length(self, length):
+    # a key from before params were recorded, it can still be too big to be ours
+    if length > bitmap_bytes(self.bit_size):
+      raise ValueError(
+        f"{self.redis_key} holds {length:,} bytes of bits, more than the {bitmap_bytes(self.bit_size):,} "
+        f"of the configured filter, it was written with other params"
+      )
+
+  def allocate(self):
+    """
+    startup: check the key was written with this filter's params (recording them
+    if it's new) and size the string to bit_size once
+
+    without it redis grows the string as SETBIT reaches higher offsets, every
+    growth a realloc and copy of a string that can be hundreds of MB, which
+    shows up as latency spikes on a freshly created filter
+    """
+    (stored, length), _ = self._execute(self._queue_inspect, transaction=False)
+    if not stored:
+      self._check_length(length)
+      replies, _ = self._execute(self._queue_record_params)
+      stored = replies[-1]
+    self._check_params(stored)
+    self._execute(self._queue_presize, transaction=False)
+
+  def load_scripts(self):
+    """
+    SCRIPT LOAD both scripts, the shas are computed locally so this only has to
+    happen once per redis server (or again after it restarts)
+    """
+    self._check_sha = self.redis_client.script_load(CHECK_SCRIPT)
+    self._add_sha = self.redis_client.script_load(ADD_SCRIPT)
+
+  def _execute(self, queue, transaction=True):
+    """
+    queue(pipe) fills a fresh pipeline which then goes to redis in one round-trip,
+    returns the replies along with whatever queue() returned
+
+    if redis doesn't know our scripts (restart, failover) they get loaded and the
+    pipeline is replayed once, everything we queue is idempotent so that's safe
+    """
+    for attempt in range(2):
+      pipe = self.redis_client.pipeline(transaction=transaction)
+      queued = queue(pipe)
+      try:
+        with REDIS_PIPELINE_SECONDS.time():
+          return pipe.execute(), queued
+      except NoScriptError:
+        if attempt:
+          REDIS_ERRORS.inc()
+          raise
+        self.load_scripts()
+      except RedisError:
+        REDIS_ERRORS.inc()
+        raise
+
+  def count_bits(self):
+    """
+    BITCOUNT over the whole bitmap, O(size) on the redis side
+    """
+    return self.redis_client.bitcount(self.redis_key)
+
+  def stats(self):
+    """
+    bits set, items added and what they say about the filter, from the running
+    totals in <redis_key>:stats rather than a BITCOUNT
+    """
+    bits_set, items = self.redis_client.hmget(self.stats_key, ["bits_set", "items"])
+    return filter_stats(self.bit_size, self.num_hashes, int(bits_set or 0), int(items) if items is not None else None)
+
+  def reconcile_stats(self, chunk_bytes=RECONCILE_CHUNK_BYTES):
+    """
+    recount bits_set with BITCOUNT over chunk_bytes byte ranges, so redis never
+    spends one command on the whole bitmap, and HSET the counter to the recount.
+    an add landing in a range already counted is lost until the next pass (a small
+    undercount). adding the difference instead would count an add in a range not
+    yet scanned twice, once by BITCOUNT and once by its own HINCRBY
+    """
+    bits_set = 0
+    for start in range(0, bitmap_bytes(self.bit_size), chunk_bytes):
+      bits_set += self.redis_client.bitcount(self.redis_key, start, start + chunk_bytes - 1)
+    self.redis_client.hset(self.stats_key, "bits_set", bits_set)
+    return bits_set
+
+  def _record_added(self, newly_set):
+    # a second round-trip, only for adds that actually changed the bitmap
+    if any(newly_set):
+      self._execute(lambda pipe: self._queue_stats(pipe, newly_set), transaction=False)
+
+  def add(self, password_hash):
+    """
+    calculating and adding bits to Redis to persist
+    """
+    with POSITIONS_SECONDS.time():
+      positions = self._get_bit_positions(password_hash)
+
+    #set bits in redis using Redis pipeline
+    replies, reply_counts = self._execute(lambda pipe: [self._queue_add(pipe, positions)])
+    self._record_added(self._split_added(replies, reply_counts))
+
+  def add_many(self, password_hashes, chunk_size=5000):
+    """
+    bulk version of add, one pipeline per chunk and positions computed per chunk
+
+    no MULTI/EXEC, a bulk load doesn't need every chunk to land atomically
+    """
+    for chunk in _chunks(password_hashes, chunk_size):
+      with POSITIONS_SECONDS.time():
+        positions = self._get_bit_positions_many(chunk)
+      replies, reply_counts = self._execute(lambda pipe: [self._queue_add(pipe, p) for p in positions], transaction=False)
+      self._record_added(self._split_added(replies, reply_counts))
+  
+
+  def check(self, password_hash):
+    """
+    check if all k bits are set to 1
+
+    plain reads, so no MULTI/EXEC around them
+    """
+    with POSITIONS_SECONDS.time():
+      positions = self._get_bit_positions(password_hash)
+    redis_bits, reply_counts = self._execute(lambda pipe: [self._queue_check(pipe, positions)], transaction=False)
+    return self._split_results(redis_bits, reply_counts)[0]
+
+  def check_many(self, password_hashes, chunk_size=5000):
+    """
+    check a batch of items, results come back in the same order as the input
+
+    every GETBIT for a chunk of items goes into one pipeline, so 50k items with
+    chunk_size=5000 is 10 round-trips instead of 50k. no MULTI/EXEC here, these
+    are plain reads and we don't want to hold up redis for the whole chunk
+    """
+    results = []
+    for chunk in _chunks(password_hashes, chunk_size):
+      with POSITIONS_SECONDS.time():
+        positions = self._get_bit_positions_many(chunk)
+      redis_bits, reply_counts = self._execute(
+        lambda pipe: [self._queue_check(pipe, p) for p in positions],
+        transaction=False
+      )
+      results.extend(self._split_results(redis_bits, reply_counts))
+    return results
+
+
+class AsyncBloomFilter(BloomFilter):
+  """
+  same filter on top of a redis.asyncio client, so the FastAPI handlers don't block the event loop
+
+  positions and queued commands are shared with BloomFilter, the only difference is
+  that pipeline.execute() is awaited
+  """
+
+  async def load_scripts(self):
+    self._check_sha = await self.redis_client.script_load(CHECK_SCRIPT)
+    self._add_sha = await self.redis_client.script_load(ADD_SCRIPT)
+
+  async def _execute(self, queue, transaction=True):
+    for attempt in range(2):
+      pipe = self.redis_client.pipeline(transaction=transaction)
+      queued = queue(pipe)
+      try:
+        with REDIS_PIPELINE_SECONDS.time():
+          return await pipe.execute(), queued
+      except NoScriptError:
+        if attempt:
+          REDIS_ERRORS.inc()
+          raise
+        await self.load_scripts()
+      except RedisError:
+        REDIS_ERRORS.inc()
+        raise
+
+  async def allocate(self):
+    (stored, length), _ = await self._execute(self._queue_inspect, transaction=False)
+    if not stored:
+      self._check_length(length)
+      replies, _ = await self._execute(self._queue_record_params)
+      stored = replies[-1]
+    self._check_params(stored)
+    await self._execute(self._queue_presize, transaction=False)
+
+  async def count_bits(self):
+    return await self.redis_client.bitcount(self.redis_key)
+
+  async def stats(self):
+    bits_set, items = await self.redis_client.hmget(self.stats_key, ["bits_set", "items"])
+    return filter_stats(self.bit_size, self.num_hashes, int(bits_set or 0), int(items) if items is not None else None)
+
+  async def reconcile_stats(self, chunk_bytes=RECONCILE_CHUNK_BYTES):
+    # one range per round-trip, checks get their turn in between
+    bits_set = 0
+    for start in range(0, bitmap_bytes(self.bit_size), chunk_bytes):
+      bits_set += await self.redis_client.bitcount(self.redis_key, start, start + chunk_bytes - 1)
+    await self.redis_client.hset(self.stats_key, "bits_set", bits_set)
+    return bits_set
+
+  async def _record_added(self, newly_set):
+    if any(newly_set):
+      await self._execute(lambda pipe: self._queue_stats(pipe, newly_set), transaction=False)
+
+  async def add(self, password_hash):
+    with POSITIONS_SECONDS.time():
+      positions = self._get_bit_positions(password_hash)
+    replies, reply_counts = await self._execute(lambda pipe: [self._queue_add(pipe, positions)])
+    await self._record_added(self._split_added(replies, reply_counts))
+
+  async def add_many(self, password_hashes, chunk_size=5000):
+    for chunk in _chunks(password_hashes, chunk_size):
+      with POSITIONS_SECONDS.time():
+        positions = self._get_bit_positions_many(chunk)
+      replies, reply_counts = await self._execute(lambda pipe: [self._queue_add(pipe, p) for p in positions], transaction=False)
+      await self._record_added(self._split_added(replies, reply_counts))
+
+  async def check(self, password_hash):
+    with POSITIONS_SECONDS.time():
+      positions = self._get_bit_positions(password_hash)
+    redis_bits, reply_counts = await self._execute(lambda pipe: [self._queue_check(pipe, positions)], transaction=False)
+    return self._split_results(redis_bits, reply_counts)[0]
+
+  async def check_many(self, password_hashes, chunk_size=5000):
+    results = []
+    for chunk in _chunks(password_hashes, chunk_size):
+      with POSITIONS_SECONDS.time():
+        positions = self._get_bit_positions_many(chunk)
+      redis_bits, reply_counts = await self._execute(
+        lambda pipe: [self._queue_check(pipe, p) for p in positions],
+        transaction=False
+      )
+      results.extend(self._split_results(redis_bits, reply_counts))
+    return results
+
+
+class BlockedBloomFilter(BloomFilter):
+  """
+  blocked layout: all k bits of an item land inside one 512 bit (64 byte) block
+
+  a check is a single GETRANGE of that block tested here in python, and an add is a
+  single BITFIELD SET over the block, so redis only ever touches one cache line per item.
+  the price is a higher false positive rate for the same size (blocks don't fill evenly)
+  which _calculate_bit_size makes up for
+  """
+
+  LAYOUT = "blocked"
+  BLOCK_BITS = 512
+  BLOCK_BYTES = BLOCK_BITS // 8
+
+  def __init__(self, *args, use_scripts=False, **kwargs):
+    # the lua scripts test and set single bits, _queue_add/_queue_check here never call them
+    if use_scripts:
+      raise ValueError("Lua scripts are only supported with the standard layout, a blocked check is already one GETRANGE")
+    super().__init__(*args, **kwargs)
+
+  def _calculate_bit_size(self):
+    """
+    start from the standard m and grow it until the blocked false positive rate meets fp_rate
+
+    with m bits there are m/512 blocks and each one gets Poisson(lam = 512*n/m) items,
+    a block holding j items has a false positive rate of (1 - (1 - 1/512)^(j*k))^k,
+    so the whole filter is the sum of those weighted by the Poisson probabilities
+    """
+    bit_size = super()._calculate_bit_size()
+    while self._blocked_fp_rate(bit_size, self._hash_count_for(bit_size)) > self.fp_rate:
+      bit_size = int(bit_size * 1.01) + self.BLOCK_BITS
+    # round up to a whole number of blocks
+    return -(-bit_size // self.BLOCK_BITS) * self.BLOCK_BITS
+
+  def _calculate_hash_count(self):
+    return self._hash_count_for(self.bit_size)
+
+  def _hash_count_for(self, bit_size):
+    """
+    same k = (m/n) * ln(2) as the standard layout
+    """
+    return max(1, int((bit_size / self.expected_items) * math.log(2)))
+
+  def _blocked_fp_rate(self, bit_size, num_hashes):
+    lam = self.expected_items * self.BLOCK_BITS / bit_size
+    miss = 1 - 1 / self.BLOCK_BITS
+
+    fp_rate = 0.0
+    # the Poisson tail past lam + 10 std devs doesn't change the answer
+    for j in range(int(lam + 10 * math.sqrt(lam) + 10)):
+      p_j = math.exp(j * math.log(lam) - lam - math.lgamma(j + 1))
+      fp_rate += p_j * (1 - miss ** (j * num_hashes)) ** num_hashes
+    return fp_rate
+
+  def _hash128(self, item):
+    """
+    scheme 1 runs mmh3's 128 bit hash over the hex digest, scheme 2 just takes the
+    first 16 bytes of the digest
+    """
+    item = self._hash_input(item)
+    if self.hash_scheme == HASH_SCHEME_DIGEST:
+      return int.from_bytes(item[:16], "little")
+    return mmh3.hash128(item, seed=0, signed=False)
+
+  def _get_block_offsets(self, item:str):
+    """
+    one 128 bit hash: the low half picks the block, the high half gives h1/h2 for the
+    positions inside it
+
+    plain h1 + i*h2 inside a 512 bit block repeats patterns often enough to push the
+    false positive rate ~15% over the model, so this uses enhanced double hashing
+    (h2 also grows by i each step) which measures within a few % of truly random bits
+    """
+    h = self._hash128(item)
+    block = (h & 0xFFFFFFFFFFFFFFFF) % (self.bit_size // self.BLOCK_BITS)
+    hash1 = (h >> 64) & 0xFFFFFFFF
+    hash2 = h >> 96
+
+    offsets = []
+    for i in range(self.num_hashes):
+      offsets.append(hash1 % self.BLOCK_BITS)
+      hash1 = (hash1 + hash2) & 0xFFFFFFFF
+      hash2 = (hash2 + i) & 0xFFFFFFFF
+    return block, offsets
+
+  def _get_bit_positions(self, item:str):
+    block, offsets = self._get_block_offsets(item)
+    return [block * self.BLOCK_BITS + offset for offset in offsets]
+
+  def _get_bit_positions_array(self, items):
+    """
+    same enhanced double hashing as _get_block_offsets, stepped once per hash over the whole batch
+    """
+    hashes = [self._hash128(item) for item in items]
+    num_blocks = self.bit_size // self.BLOCK_BITS
+    blocks = np.fromiter(((h & 0xFFFFFFFFFFFFFFFF) % num_blocks for h in hashes), dtype=np.int64, count=len(items))
+    hash1 = np.fromiter(((h >> 64) & 0xFFFFFFFF for h in hashes), dtype=np.int64, count=len(items))
+    hash2 = np.fromiter((h >> 96 for h in hashes), dtype=np.int64, count=len(items))
+
+    positions = np.empty((len(items), self.num_hashes), dtype=np.int64)
+    for i in range(self.num_hashes):
+      positions[:, i] = blocks * self.BLOCK_BITS + hash1 % self.BLOCK_BITS
+      hash1 = (hash1 + hash2) & 0xFFFFFFFF
+      hash2 = (hash2 + i) & 0xFFFFFFFF
+    return positions
+
+  def _queue_add(self, pipe, positions):
+    """
+    BITFIELD key SET u1 <pos> 1 [SET u1 <pos> 1 ...], one command for all k bits
+    """
+    bitfield = pipe.bitfield(self.redis_key)
+    for pos in positions:
+      bitfield.set("u1", pos, 1)
+    bitfield.execute()
+    return 1 + self._queue_changelog(pipe, positions)
+
+  def _newly_set(self, replies):
+    # BITFIELD answers with the old value of every field it set
+    return sum(1 for bit in replies[0] if bit == 0)
+
+  def _queue_check(self, pipe, positions):
+    """
+    GETRANGE of the item's 64 byte block, returns the in-block offsets to test the reply against
+    """
+    block = positions[0] // self.BLOCK_BITS
+    start = block * self.BLOCK_BYTES
+    pipe.getrange(self.redis_key, start, start + self.BLOCK_BYTES - 1)
+    return [pos - block * self.BLOCK_BITS for pos in positions]
+
+  def _split_results(self, blocks, item_offsets):
+    results = []
+    for block, offsets in zip(blocks, item_offsets):
+      # redis returns a short (or empty) string when the key ends before this block
+      block = block.ljust(self.BLOCK_BYTES, b"\x00")
+      results.append(all(block[offset >> 3] & (0x80 >> (offset & 7)) for offset in offsets))
+    return results
+
+
+class AsyncBlockedBloomFilter(AsyncBloomFilter, BlockedBloomFilter):
+  """
+  blocked layout on a redis.asyncio client
+  """
@@ -0,0 +1,56 @@
+"""
+the binary batch protocol behind POST /check/binary, for service-to-service calls
+that don't want to pay for JSON and model validation
+
+  request   4 byte big-endian count n, then n raw digests back to back (32 bytes
+            each for sha256, 20 for sha1, whatever BLOOM_PASSWORD_HASH is)
+  response  ceil(n / 8) bytes, bit i set if digest i is in the filter. bits are
+            numbered from the most significant bit of byte 0, like the redis bitmap
+
+both sides are here so internal callers can import them
+"""
+import struct
+
+from app.bitmap import bitmap_bytes, get_bit, set_bit
+
+COUNT = struct.Struct(">I")
+CONTENT_TYPE = "application/octet-stream"
+
+
+def encode_batch(digests):
+  """
+  request body for a list of raw digests, all the same length
+  """
+  return COUNT.pack(len(digests)) + b"".join(digests)
+
+
+def decode_batch(body, digest_size):
+  """
+  the digests in a request body, raises ValueError if it isn't count digests long
+  """
+  if len(body) < COUNT.size:
+    raise ValueError(f"Body is {len(body)} bytes, shorter than the {COUNT.size} byte count")
+  count, = COUNT.unpack_from(body)
+  if len(body) != COUNT.size + count * digest_size:
+    raise ValueError(
+      f"Body is {len(body)} bytes, {count} digests of {digest_size} bytes need {COUNT.size + count * digest_size}"
+    )
+  return [body[start:start + digest_size] for start in range(COUNT.size, len(body), digest_size)]
+
+
+def encode_results(results):
+  """
+  pack check results into a bitset
+  """
+  packed = bytearray(bitmap_bytes(len(results)))
+  for i, result in enumerate(results):
+    if result:
+      set_bit(packed, i)
+  return bytes(packed)
+
+
+def decode_results(packed, count):
+  """
+  the first count results of a response body, as bools
+  """
+  return [bool(get_bit(packed, i)) for i in range(count)]
@@ -0,0 +1,42 @@
+"""
+helpers for working with a copy of the redis bitmap in process memory
+
+redis numbers bits from the most significant bit of byte 0, so SETBIT key 0 1
+sets 0x80 in the first byte. everything here uses that same layout so a local
+buffer can be compared byte for byte with GET/GETRANGE on the key
+"""
+
+
+def bitmap_bytes(bit_size):
+  """
+  number of bytes needed to hold bit_size bits
+  """
+  return (bit_size + 7) // 8
+
+
+def get_bit(bitmap, pos):
+  return (bitmap[pos >> 3] >> (7 - (pos & 7))) & 1
+
+
+def set_bit(bitmap, pos):
+  bitmap[pos >> 3] |= 0x80 >> (pos & 7)
+
+
+def all_bits_set(bitmap, positions):
+  """
+  same answer as BloomFilter._is_member, without going to redis
+  """
+  for pos in positions:
+    if not bitmap[pos >> 3] & (0x80 >> (pos & 7)):
+      return False
+  return True
+
+
+def count_set_bits(bitmap, chunk_bytes=1024 * 1024):
+  """
+  same answer as BITCOUNT on the key, a chunk at a time so a mapped file isn't copied whole
+  """
+  count = 0
+  for start in range(0, len(bitmap), chunk_bytes):
+    count += int.from_bytes(bitmap[start:start + chunk_bytes], "big").bit_count()
+  return count
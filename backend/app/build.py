@@ -0,0 +1,276 @@
+"""
+Rebuild the Bloom filter offline on every core, then swap it in atomically.
+
+    python -m app.build rockyou.txt.gz --expected-items 20000000 --fp-rate 0.0001
+
+Unlike app.ingest, nothing here touches the live key while the corpus is read.
+The corpus is split across worker processes. Each worker fills its own
+in-memory bitmap with the same position math the API uses and writes it to a
+temporary file. The partial bitmaps are then OR-merged a chunk at a time and
+uploaded with SETRANGE to a staging key. Finally the staging key is RENAMEd
+over the live one. Checks keep hitting the old bitmap until that RENAME, and
+RENAME is atomic.
+
+Plain files are split into byte ranges. A gzip stream can't be entered at an
+arbitrary byte, so for gzip every worker decompresses the whole file and
+hashes every Nth block of lines instead.
+
+Sharded filters get one bitmap (and one swap) per shard. Scalable filters grow
+by adding items, so they can't be built offline.
+
+After the swap, restart the API with the same BLOOM_EXPECTED_ITEMS and
+BLOOM_FALSE_POSITIVE_RATE, because a differently sized filter puts its bits in
+different places.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+from app.bitmap import bitmap_bytes, set_bit, count_set_bits
+from app.sharded import ShardedBloomFilter
+from app.scalable import ScalableBloomFilter
+from app.ingest import GZIP_MAGIC, open_corpus, hash_line, make_filter, connect
+from app.cache import publish_invalidation
+from app.config import settings
+
+# numpy ORs whole arrays at once, without it the merge and bit setting fall back to pure python
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+GZIP_BLOCK_LINES = 10_000
+
+
+def filter_targets(bloom_filter):
+    """Every (filter, bitmap) pair the build has to produce, one per shard for sharded filters"""
+    if isinstance(bloom_filter, ScalableBloomFilter):
+        raise Exception("Scalable filters can't be built offline, use python -m app.ingest instead")
+    if isinstance(bloom_filter, ShardedBloomFilter):
+        return bloom_filter.shards
+    return [bloom_filter]
+
+
+def split_ranges(size, workers):
+    """Split [0, size) into `workers` contiguous byte ranges"""
+    step = -(-size // workers)
+    return [(start, min(start + step, size)) for start in range(0, size, step)] or [(0, 0)]
+
+
+def read_range(path, start, end):
+    """
+    Lines of a plain file that begin in [start, end).
+
+    A range that starts mid-line skips to the next line, which the previous range owns.
+    """
+    with open(path, "rb") as f:
+        offset = start
+        if start:
+            f.seek(start - 1)
+            offset = start - 1 + len(f.readline())
+        while offset < end:
+            line = f.readline()
+            if not line:
+                break
+            offset += len(line)
+            yield line
+
+
+def read_stride(path, worker, workers):
+    """Every workers-th block of GZIP_BLOCK_LINES lines, starting at block `worker`"""
+    with open_corpus(path) as corpus:
+        for index, line in enumerate(corpus):
+            if (index // GZIP_BLOCK_LINES) % workers == worker:
+                yield line
+
+
+def set_positions(bitmap, positions):
+    """Set a batch of bit positions in a local bitmap, MSB-first like Redis"""
+    if np is not None:
+        positions = np.asarray(positions, dtype=np.int64).ravel()
+        masks = np.right_shift(0x80, positions & 7).astype(np.uint8)
+        np.bitwise_or.at(np.frombuffer(bitmap, dtype=np.uint8), positions >> 3, masks)
+        return
+    for item_positions in positions:
+        for pos in item_positions:
+            set_bit(bitmap, pos)
+
+
+def build_part(path, fmt, worker, workers, gzipped, part_dir, expected_items, fp_rate, chunk_size=50_000):
+    """
+    Worker process: fill one partial bitmap per target from this worker's share of
+    the corpus and write each to part_dir. Returns (part paths, items, skipped).
+    """
+    bloom_filter = make_filter(None, expected_items, fp_rate)
+    targets = filter_targets(bloom_filter)
+    bitmaps = [bytearray(bitmap_bytes(target.bit_size)) for target in targets]
+
+    if gzipped:
+        lines = read_stride(path, worker, workers)
+    else:
+        start, end = split_ranges(os.path.getsize(path), workers)[worker]
+        lines = read_range(path, start, end)
+
+    items = 0
+    skipped = 0
+    chunk = []
+
+    def flush():
+        if len(targets) == 1:
+            groups = {0: ([], chunk)}
+        else:
+            groups = bloom_filter._group_by_shard(chunk)
+        for shard, (_, shard_items) in groups.items():
+            target = targets[shard]
+            positions = target._get_bit_positions_array(shard_items) if np is not None else target._get_bit_positions_many(shard_items)
+            set_positions(bitmaps[shard], positions)
+
+    for line in lines:
+        item = hash_line(line, fmt, settings.bloom_password_hash, settings.bloom_hash_scheme)
+        if item is None:
+            skipped += 1
+            continue
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            flush()
+            items += len(chunk)
+            chunk = []
+    if chunk:
+        flush()
+        items += len(chunk)
+
+    part_paths = []
+    for i, bitmap in enumerate(bitmaps):
+        part_path = os.path.join(part_dir, f"part-{worker}-{i}")
+        with open(part_path, "wb") as f:
+            f.write(bitmap)
+        part_paths.append(part_path)
+    return part_paths, items, skipped
+
+
+def _build_part(args):
+    return build_part(*args)
+
+
+def merge_chunks(part_paths, size, chunk_bytes):
+    """OR the partial bitmap files together, yielding (offset, bytes) a chunk at a time"""
+    files = [open(part_path, "rb") for part_path in part_paths]
+    try:
+        for offset in range(0, size, chunk_bytes):
+            parts = [f.read(chunk_bytes) for f in files]
+            if np is not None:
+                merged = np.bitwise_or.reduce([np.frombuffer(part, dtype=np.uint8) for part in parts]).tobytes()
+            else:
+                merged = 0
+                for part in parts:
+                    merged |= int.from_bytes(part, "big")
+                merged = merged.to_bytes(len(parts[0]), "big")
+            yield offset, merged
+    finally:
+        for f in files:
+            f.close()
+
+
+def upload_and_swap(target, chunks, size):
+    """
+    SETRANGE the merged bitmap into <key>:staging, then RENAME it over the live key.
+
+    All-zero chunks are skipped, SETRANGE zero-fills any gap it writes past. The
+    staging key keeps the live key's {i} hash tag, so RENAME stays within one
+    cluster slot for sharded filters.
+    """
+    staging_key = f"{target.redis_key}:staging"
+    redis_client = target.redis_client
+    redis_client.delete(staging_key)
+
+    bits_set = 0
+    for offset, chunk in chunks:
+        bits_set += count_set_bits(chunk)
+        # the last chunk always goes up so the string ends up its full length
+        if chunk.count(0) != len(chunk) or offset + len(chunk) >= size:
+            redis_client.setrange(staging_key, offset, chunk)
+
+    # One MULTI/EXEC, the new bitmap never sits next to the old stats or params
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.rename(staging_key, target.redis_key)
+    # /stats counts on from the new bitmap. Its item count isn't known, the estimate takes over
+    pipe.hset(target.stats_key, "bits_set", bits_set)
+    pipe.hdel(target.stats_key, "items")
+    # The build may have resized the filter, what's in the key now is what startup checks against
+    pipe.hset(target.params_key, mapping=target.params())
+    pipe.execute()
+    return staging_key
+
+
+def build(path, fmt="plain", workers=None, expected_items=None, fp_rate=None, upload_chunk_bytes=4 * 1024 * 1024, redis_client=None):
+    """
+    Build the filter for path on `workers` processes and swap it into place.
+    Returns (items, skipped).
+    """
+    workers = workers or os.cpu_count() or 1
+    with open(path, "rb") as f:
+        gzipped = f.read(2) == GZIP_MAGIC
+
+    bloom_filter = make_filter(redis_client, expected_items, fp_rate)
+    targets = filter_targets(bloom_filter)
+    logger.info(
+        f"Building {bloom_filter.bit_size:,} bits ({bloom_filter.num_hashes} hashes) "
+        f"for {bloom_filter.redis_key} on {workers} worker(s)"
+    )
+
+    started = time.monotonic()
+    with tempfile.TemporaryDirectory(prefix="bloom-build-") as part_dir:
+        jobs = [(path, fmt, worker, workers, gzipped, part_dir, expected_items, fp_rate) for worker in range(workers)]
+        if workers == 1:
+            results = [build_part(*jobs[0])]
+        else:
+            with multiprocessing.Pool(workers) as pool:
+                results = pool.map(_build_part, jobs)
+
+        items = sum(result[1] for result in results)
+        skipped = sum(result[2] for result in results)
+        logger.info(f"Hashed {items:,} items in {time.monotonic() - started:.1f}s ({skipped:,} lines skipped)")
+
+        for i, target in enumerate(targets):
+            size = bitmap_bytes(target.bit_size)
+            chunks = merge_chunks([result[0][i] for result in results], size, upload_chunk_bytes)
+            upload_and_swap(target, chunks, size)
+            logger.info(f"Swapped {size:,} bytes into {target.redis_key}")
+
+    logger.info(f"Done in {time.monotonic() - started:.1f}s")
+    return items, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.build", description="Rebuild the Bloom filter offline and swap it in atomically")
+    parser.add_argument("path", help="corpus file, one entry per line, plain or gzip")
+    parser.add_argument("--format", choices=["plain", "hash"], default="plain",
+                        help="plain: plaintext passwords, hash: hex digests of BLOOM_PASSWORD_HASH (':count' suffixes are ignored)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: all cores)")
+    parser.add_argument("--expected-items", type=int, help="size the new filter for this many items (default: BLOOM_EXPECTED_ITEMS)")
+    parser.add_argument("--fp-rate", type=float, help="false positive rate of the new filter (default: BLOOM_FALSE_POSITIVE_RATE)")
+    parser.add_argument("--upload-chunk-bytes", type=int, default=4 * 1024 * 1024, help="bytes per SETRANGE")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    redis_client = connect()
+    build(
+        args.path,
+        fmt=args.format,
+        workers=args.workers,
+        expected_items=args.expected_items,
+        fp_rate=args.fp_rate,
+        upload_chunk_bytes=args.upload_chunk_bytes,
+        redis_client=redis_client,
+    )
+    publish_invalidation(redis_client, settings.bloom_redis_key)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def version_key(redis_key):
+  return f"{redis_key}:version"
+
+
+def invalidation_channel(redis_key):
+  return f"{redis_key}:invalidate"
+
+
+def page_channel(redis_key):
+  return f"{redis_key}:pages"
+
+
+# a message on the pages channel that drops every page, for writers that don't track them
+ALL_PAGES = "*"
+
+
+def publish_invalidation(redis_client, redis_key):
+  """
+  bump the filter's version and tell every worker, sync client version for the CLIs
+  that write to the filter behind the API's back (ingest, build, snapshot import).
+  cached bitmap pages (app.pages) are all dropped too
+  """
+  redis_client.publish(invalidation_channel(redis_key), redis_client.incr(version_key(redis_key)))
+  redis_client.publish(page_channel(redis_key), ALL_PAGES)
+
+
+class CheckCache:
+  """
+  LRU of check results keyed by password hash
+
+  bits are never cleared, so a positive stays true forever and is only ever evicted
+  for space. a negative turns stale as soon as anything is added, so negatives carry
+  the generation they were looked up in plus a ttl. invalidating every negative is
+  just generation += 1, stale entries are dropped when they're next looked at
+  """
+
+  def __init__(self, max_size=10_000, ttl=60.0):
+    self.max_size = max_size
+    self.ttl = ttl
+    self.generation = 0
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key):
+    """
+    cached result, or None on a miss
+    """
+    entry = self._entries.get(key)
+    if entry is not None:
+      result, expires, generation = entry
+      if result or (generation == self.generation and time.monotonic() < expires):
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return result
+      del self._entries[key]
+    self.misses += 1
+    return None
+
+  def put(self, key, result, generation):
+    """
+    generation is self.generation from before the lookup went out. a negative from an
+    older generation may have raced an add, so it isn't stored
+    """
+    if not result and generation != self.generation:
+      return
+    self._entries[key] = (result, None if result else time.monotonic() + self.ttl, generation)
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.max_size:
+      self._entries.popitem(last=False)
+
+  def invalidate_negatives(self):
+    self.generation += 1
+
+
+class CachedBloomFilter:
+  """
+  a CheckCache in front of any async filter, so the hot head of the password
+  distribution never leaves the worker
+
+  adds drop this worker's negatives straight away, then INCR <key>:version and
+  PUBLISH it on <key>:invalidate. every worker runs run_invalidation_listener and
+  drops its negatives when the version moves. pub/sub isn't guaranteed delivery,
+  so the listener re-reads the version after (re)subscribing and the ttl puts a
+  bound on anything that still slips through
+
+  everything other than check/add (sizing, count_bits, redis_key ...) is the wrapped filter's
+  """
+
+  def __init__(self, bloom_filter, redis_client, max_size=10_000, ttl=60.0):
+    self.bloom_filter = bloom_filter
+    self.redis_client = redis_client
+    self.cache = CheckCache(max_size, ttl)
+    self.version_key = version_key(bloom_filter.redis_key)
+    self.channel = invalidation_channel(bloom_filter.redis_key)
+    self._version = None
+
+  def __getattr__(self, name):
+    return getattr(self.bloom_filter, name)
+
+  def _seen_version(self, version):
+    """
+    invalidate unless version is the one we already know about
+    """
+    version = int(version or 0)
+    if version != self._version:
+      self.cache.invalidate_negatives()
+      self._version = version
+
+  async def _publish_invalidation(self):
+    self.cache.invalidate_negatives()
+    self._version = await self.redis_client.incr(self.version_key)
+    await self.redis_client.publish(self.channel, self._version)
+
+  async def run_invalidation_listener(self, retry_interval=1.0):
+    """
+    background loop for lifespan, resubscribes if the connection drops
+    """
+    while True:
+      try:
+        async with self.redis_client.pubsub() as pubsub:
+          await pubsub.subscribe(self.channel)
+          # anything published before the subscribe went through is only visible in the key
+          self._seen_version(await self.redis_client.get(self.version_key))
+          async for message in pubsub.listen():
+            if message["type"] == "message":
+              self._seen_version(message["data"])
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        logger.warning(f"Cache invalidation listener failed, dropping cached negatives: {e}")
+        self.cache.invalidate_negatives()
+      await asyncio.sleep(retry_interval)
+
+  async def add(self, password_hash):
+    await self.bloom_filter.add(password_hash)
+    await self._publish_invalidation()
+    self.cache.put(password_hash, True, self.cache.generation)
+
+  async def add_many(self, password_hashes, chunk_size=5000):
+    await self.bloom_filter.add_many(password_hashes, chunk_size)
+    await self._publish_invalidation()
+
+  async def check(self, password_hash):
+    result = self.cache.get(password_hash)
+    if result is None:
+      generation = self.cache.generation
+      result = await self.bloom_filter.check(password_hash)
+      self.cache.put(password_hash, result, generation)
+    return result
+
+  async def check_many(self, password_hashes, chunk_size=5000):
+    """
+    only the cache misses go to the wrapped filter, in one check_many
+    """
+    results = [self.cache.get(password_hash) for password_hash in password_hashes]
+    misses = [i for i, result in enumerate(results) if result is None]
+    if misses:
+      generation = self.cache.generation
+      found = await self.bloom_filter.check_many([password_hashes[i] for i in misses], chunk_size)
+      for i, result in zip(misses, found):
+        results[i] = result
+        self.cache.put(password_hashes[i], result, generation)
+    return results
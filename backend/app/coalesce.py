@@ -0,0 +1,67 @@
+import asyncio
+
+
+class CoalescingBloomFilter:
+  """
+  merges check() calls that arrive close together into one check_many on the wrapped
+  filter, so N concurrent /check requests cost one pipeline instead of N
+
+  the first check in a batch starts a window timer. the batch goes out when the
+  timer fires or when max_batch checks are waiting, whichever comes first, so no
+  check waits more than window seconds before it is sent. each caller awaits its
+  own future and gets its own result (or the batch's exception) back
+
+  everything other than check (check_many, adds, sizing ...) goes straight to the wrapped filter
+  """
+
+  def __init__(self, bloom_filter, window=0.002, max_batch=256, chunk_size=5000):
+    self.bloom_filter = bloom_filter
+    self.window = window
+    self.max_batch = max_batch
+    self.chunk_size = chunk_size
+    self._pending = []
+    self._timer = None
+    # the event loop only keeps weak references to tasks
+    self._tasks = set()
+
+  def __getattr__(self, name):
+    return getattr(self.bloom_filter, name)
+
+  async def check(self, password_hash):
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    self._pending.append((password_hash, future))
+
+    if len(self._pending) >= self.max_batch:
+      self._flush()
+    elif self._timer is None:
+      self._timer = loop.call_later(self.window, self._flush)
+    return await future
+
+  def _flush(self):
+    """
+    hand everything waiting to a task of its own, new checks start the next batch
+    """
+    if self._timer is not None:
+      self._timer.cancel()
+      self._timer = None
+
+    batch, self._pending = self._pending, []
+    if batch:
+      task = asyncio.create_task(self._run(batch))
+      self._tasks.add(task)
+      task.add_done_callback(self._tasks.discard)
+
+  async def _run(self, batch):
+    try:
+      results = await self.bloom_filter.check_many([password_hash for password_hash, _ in batch], self.chunk_size)
+    except Exception as e:
+      for _, future in batch:
+        if not future.done():
+          future.set_exception(e)
+      return
+
+    # a caller that gave up (client disconnect, timeout) has a cancelled future
+    for (_, future), result in zip(batch, results):
+      if not future.done():
+        future.set_result(result)
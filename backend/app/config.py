@@ -1,5 +1,5 @@
 import os
-from typing import Optional, List
+from typing import Optional, List, Literal
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -24,16 +24,52 @@ class Settings(BaseSettings):
     redis_ssl: bool = Field(default=False, alias="REDIS_SSL")
     redis_connection_timeout: int = Field(default=5, alias="REDIS_CONNECTION_TIMEOUT")
     redis_max_retries: int = Field(default=3, alias="REDIS_MAX_RETRIES")
+    redis_max_connections: int = Field(default=50, alias="REDIS_MAX_CONNECTIONS")
+    redis_pool_timeout: float = Field(default=5.0, alias="REDIS_POOL_TIMEOUT")
+    redis_replicas: List[str] = Field(default=[], alias="REDIS_REPLICAS")
+    redis_replica_check_interval: float = Field(default=5.0, alias="REDIS_REPLICA_CHECK_INTERVAL")
     
     # Bloom Filter Configuration
     bloom_expected_items: int = Field(default=1_000_000, alias="BLOOM_EXPECTED_ITEMS")
     bloom_false_positive_rate: float = Field(default=0.001, alias="BLOOM_FALSE_POSITIVE_RATE")
     bloom_redis_key: str = Field(default="bloom:passwords", alias="BLOOM_REDIS_KEY")
+    bloom_layout: Literal["standard", "blocked"] = Field(default="standard", alias="BLOOM_LAYOUT")
+    bloom_hash_scheme: int = Field(default=1, alias="BLOOM_HASH_SCHEME")
+    bloom_password_hash: Literal["sha256", "sha1"] = Field(default="sha256", alias="BLOOM_PASSWORD_HASH")
+    bloom_shards: int = Field(default=1, alias="BLOOM_SHARDS")
+    bloom_shard_nodes: List[str] = Field(default=[], alias="BLOOM_SHARD_NODES")
+    bloom_scalable: bool = Field(default=False, alias="BLOOM_SCALABLE")
+    bloom_scalable_growth: int = Field(default=2, alias="BLOOM_SCALABLE_GROWTH")
+    bloom_scalable_tightening: float = Field(default=0.5, alias="BLOOM_SCALABLE_TIGHTENING")
+    bloom_batch_chunk_size: int = Field(default=5000, alias="BLOOM_BATCH_CHUNK_SIZE")
+    bloom_use_scripts: bool = Field(default=False, alias="BLOOM_USE_SCRIPTS")
+    bloom_local_replica: bool = Field(default=False, alias="BLOOM_LOCAL_REPLICA")
+    bloom_replica_refresh_interval: float = Field(default=1.0, alias="BLOOM_REPLICA_REFRESH_INTERVAL")
+    bloom_changelog_maxlen: int = Field(default=1_000_000, alias="BLOOM_CHANGELOG_MAXLEN")
+    bloom_coalesce: bool = Field(default=False, alias="BLOOM_COALESCE")
+    bloom_coalesce_window: float = Field(default=0.002, alias="BLOOM_COALESCE_WINDOW")
+    bloom_coalesce_max_batch: int = Field(default=256, alias="BLOOM_COALESCE_MAX_BATCH")
+    bloom_cache_size: int = Field(default=0, alias="BLOOM_CACHE_SIZE")
+    bloom_cache_ttl: float = Field(default=60.0, alias="BLOOM_CACHE_TTL")
+    bloom_page_cache_pages: int = Field(default=0, alias="BLOOM_PAGE_CACHE_PAGES")
+    bloom_page_size: int = Field(default=4096, alias="BLOOM_PAGE_SIZE")
+    bloom_page_cache_ttl: float = Field(default=60.0, alias="BLOOM_PAGE_CACHE_TTL")
+    bloom_snapshot_path: Optional[str] = Field(default=None, alias="BLOOM_SNAPSHOT_PATH")
+    bloom_snapshot_export: bool = Field(default=False, alias="BLOOM_SNAPSHOT_EXPORT")
+    bloom_xor: bool = Field(default=False, alias="BLOOM_XOR")
+    bloom_xor_path: Optional[str] = Field(default=None, alias="BLOOM_XOR_PATH")
+    bloom_xor_fingerprint_bits: Literal[8, 16] = Field(default=8, alias="BLOOM_XOR_FINGERPRINT_BITS")
+    bloom_stats_reconcile_interval: float = Field(default=300.0, alias="BLOOM_STATS_RECONCILE_INTERVAL")
+    bloom_storage: Literal["redis", "memory", "mmap"] = Field(default="redis", alias="BLOOM_STORAGE")
+    bloom_storage_path: Optional[str] = Field(default=None, alias="BLOOM_STORAGE_PATH")
     
     # API Configuration
     api_host: str = Field(default="0.0.0.0", alias="API_HOST")
     api_port: int = Field(default=8000, alias="API_PORT")
+    api_uds: Optional[str] = Field(default=None, alias="API_UDS")
     api_workers: int = Field(default=1, alias="API_WORKERS")
+    api_access_log: bool = Field(default=True, alias="API_ACCESS_LOG")
+    api_batch_max_size: int = Field(default=100_000, alias="API_BATCH_MAX_SIZE")
     
     # Security
     cors_origins: List[str] = Field(default=["*"], alias="CORS_ORIGINS")
@@ -47,6 +83,28 @@ class Settings(BaseSettings):
     def is_development(self) -> bool:
         return self.environment.lower() in ["development", "dev", "local"]
     
+    @property
+    def redis_worker_connections(self) -> int:
+        """Connections each worker may open, REDIS_MAX_CONNECTIONS is the budget for all of them"""
+        return self.redis_max_connections // max(1, self.api_workers)
+    
+    @property
+    def redis_listener_connections(self) -> int:
+        """Primary connections each worker's pub/sub listeners hold for as long as it runs"""
+        cache_listener = bool(self.bloom_cache_size) and not (self.bloom_snapshot_path or self.bloom_xor_path)
+        return int(cache_listener) + int(bool(self.bloom_page_cache_pages))
+    
+    @property
+    def redis_pool_count(self) -> int:
+        """Pools each worker opens: the primary, one per shard node and one per replica"""
+        shard_nodes = len(self.bloom_shard_nodes) if self.bloom_shards > 1 else 0
+        return 1 + shard_nodes + len(self.redis_replicas)
+    
+    @property
+    def redis_pool_size(self) -> int:
+        """Connections each pool may use for requests, the worker's share less its listeners, split between its pools"""
+        return max(1, (self.redis_worker_connections - self.redis_listener_connections) // self.redis_pool_count)
+    
     @property
     def redis_url(self) -> str:
         """Build Redis connection URL"""
@@ -0,0 +1,286 @@
+"""
+Bulk-load a breach corpus into the Bloom filter straight from a file.
+
+    python -m app.ingest rockyou.txt.gz
+    python -m app.ingest pwned-passwords-sha1.txt --format hash
+
+Reads one password (or one hex digest) per line, optionally gzip compressed,
+and adds them in pipelined chunks so memory stays bounded by --chunk-size no
+matter how big the file is. After every chunk the byte offset reached is
+written to a checkpoint file; running the same command again after an
+interruption picks up from there instead of starting over.
+
+The filter is built from the same settings as the API (BLOOM_* / REDIS_*), so
+the bits land where the running service looks for them.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+
+import redis
+
+from app.BloomFilter import BloomFilter, BlockedBloomFilter, HASH_SCHEME_DIGEST
+from app.sharded import ShardedBloomFilter, MAX_REDIS_BITS
+from app.scalable import ScalableBloomFilter
+from app.storage import StorageBloomFilter, StorageBlockedBloomFilter, open_storage
+from app.cache import publish_invalidation
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def open_corpus(path):
+    """Open a corpus file for binary line reading, transparently un-gzipping it"""
+    with open(path, "rb") as f:
+        magic = f.read(2)
+    return gzip.open(path, "rb") if magic == GZIP_MAGIC else open(path, "rb")
+
+
+def hash_line(line: bytes, fmt: str, algorithm: str, hash_scheme: int):
+    """
+    Turn one corpus line into a filter item, or None for lines to skip.
+
+    Plaintext lines are hashed like the API hashes passwords. Hash lines may
+    carry a trailing ":count" (the Pwned Passwords format) and must be a digest
+    of the configured algorithm.
+    """
+    line = line.rstrip(b"\r\n")
+    if not line:
+        return None
+
+    if fmt == "plain":
+        digest = hashlib.new(algorithm, line)
+        return digest.digest() if hash_scheme == HASH_SCHEME_DIGEST else digest.hexdigest()
+
+    hex_digest = line.split(b":", 1)[0].strip().decode("ascii", errors="replace").lower()
+    if len(hex_digest) != hashlib.new(algorithm).digest_size * 2:
+        return None
+    try:
+        digest = bytes.fromhex(hex_digest)
+    except ValueError:
+        return None
+    return digest if hash_scheme == HASH_SCHEME_DIGEST else hex_digest
+
+
+def load_checkpoint(checkpoint_path, path, redis_key):
+    """Return the saved progress for this file and key, or a fresh start"""
+    fresh = {"offset": 0, "items": 0, "skipped": 0}
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return fresh
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    # A checkpoint from another corpus or another filter would skip the wrong lines
+    if checkpoint.get("path") != os.path.abspath(path) or checkpoint.get("redis_key") != redis_key:
+        logger.warning(f"Ignoring checkpoint {checkpoint_path}, it belongs to a different file or key")
+        return fresh
+    return {key: checkpoint[key] for key in fresh}
+
+
+def save_checkpoint(checkpoint_path, path, redis_key, progress):
+    """Write progress atomically so a crash mid-write can't corrupt the checkpoint"""
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"path": os.path.abspath(path), "redis_key": redis_key, **progress}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def ingest(bloom_filter, path, fmt="plain", chunk_size=50_000, checkpoint_path=None, resume=True,
+           algorithm="sha256", hash_scheme=1, report_interval=10.0):
+    """
+    Stream path into bloom_filter, one add_many round per chunk_size lines.
+
+    Progress is checkpointed after each chunk has reached Redis. Setting bits is
+    idempotent, so if the process dies between the write and the checkpoint the
+    resumed run just adds that chunk again.
+
+    Returns the final progress dict (offset, items, skipped).
+    """
+    progress = load_checkpoint(checkpoint_path, path, bloom_filter.redis_key) if resume else {"offset": 0, "items": 0, "skipped": 0}
+    if progress["offset"]:
+        logger.info(f"Resuming {path} at byte {progress['offset']:,} ({progress['items']:,} items already added)")
+
+    started = time.monotonic()
+    last_report = started
+    items_at_start = progress["items"]
+    offset = progress["offset"]
+
+    with open_corpus(path) as corpus:
+        # Seeking a gzip stream decompresses up to the offset, still far cheaper than re-adding
+        corpus.seek(offset)
+        while True:
+            chunk = []
+            skipped = 0
+            for line in corpus:
+                offset += len(line)
+                item = hash_line(line, fmt, algorithm, hash_scheme)
+                if item is None:
+                    skipped += 1
+                    continue
+                chunk.append(item)
+                if len(chunk) >= chunk_size:
+                    break
+
+            if not chunk and not skipped:
+                break
+
+            bloom_filter.add_many(chunk, chunk_size)
+            progress = {"offset": offset, "items": progress["items"] + len(chunk), "skipped": progress["skipped"] + skipped}
+            if checkpoint_path:
+                save_checkpoint(checkpoint_path, path, bloom_filter.redis_key, progress)
+
+            now = time.monotonic()
+            if now - last_report >= report_interval:
+                rate = (progress["items"] - items_at_start) / (now - started)
+                logger.info(f"{progress['items']:,} items added, {offset:,} bytes read, {rate:,.0f} items/s")
+                last_report = now
+
+    elapsed = time.monotonic() - started
+    added = progress["items"] - items_at_start
+    logger.info(
+        f"Done: {added:,} items in {elapsed:.1f}s ({added / elapsed if elapsed else 0:,.0f} items/s), "
+        f"{progress['skipped']:,} lines skipped"
+    )
+    return progress
+
+
+def make_filter(redis_client, expected_items=None, fp_rate=None):
+    """
+    Sync counterpart of the filter the API builds in its lifespan, from the same settings.
+
+    Only constructs it, nothing here talks to Redis, so it also works with
+    redis_client=None for code that just needs the position math.
+    """
+    if settings.bloom_scalable and settings.bloom_shards > 1:
+        raise Exception("BLOOM_SCALABLE cannot be combined with BLOOM_SHARDS")
+
+    filter_class = BlockedBloomFilter if settings.bloom_layout == "blocked" else BloomFilter
+    filter_kwargs = {
+        "expected_items": expected_items or settings.bloom_expected_items,
+        "fp_rate": fp_rate or settings.bloom_false_positive_rate,
+        "use_scripts": settings.bloom_use_scripts,
+        "hash_scheme": settings.bloom_hash_scheme,
+    }
+
+    if settings.bloom_shards > 1:
+        shard_clients = [redis.Redis.from_url(url) for url in settings.bloom_shard_nodes]
+        bloom_filter = ShardedBloomFilter(shard_clients or redis_client, settings.bloom_shards, filter_class=filter_class, **filter_kwargs)
+        shard_bit_size = bloom_filter.shard_bit_size
+    elif settings.bloom_scalable:
+        bloom_filter = ScalableBloomFilter(
+            redis_client,
+            growth=settings.bloom_scalable_growth,
+            tightening=settings.bloom_scalable_tightening,
+            filter_class=filter_class,
+            **filter_kwargs
+        )
+        shard_bit_size = bloom_filter.generations[-1].bit_size
+    else:
+        bloom_filter = filter_class(redis_client=redis_client, **filter_kwargs)
+        shard_bit_size = bloom_filter.bit_size
+    bloom_filter.redis_key = settings.bloom_redis_key
+
+    if shard_bit_size > MAX_REDIS_BITS:
+        raise Exception(f"Each bitmap needs {shard_bit_size:,} bits but a Redis string holds at most {MAX_REDIS_BITS:,}, raise BLOOM_SHARDS")
+    return bloom_filter
+
+
+def build_filter(redis_client):
+    """make_filter, then the Redis side setup the API also does at startup"""
+    bloom_filter = make_filter(redis_client)
+
+    if settings.bloom_scalable:
+        bloom_filter.load_generations()
+
+    # Refuses a key written with other params before any bits go in
+    bloom_filter.allocate()
+
+    # Workers serving from a local replica only see adds that went through the changelog
+    if settings.bloom_local_replica:
+        bloom_filter.changelog_key = f"{settings.bloom_redis_key}:changelog"
+        bloom_filter.changelog_maxlen = settings.bloom_changelog_maxlen
+
+    if settings.bloom_use_scripts:
+        bloom_filter.load_scripts()
+    return bloom_filter
+
+
+def make_storage_filter():
+    """Filter on the BLOOM_STORAGE engine instead of Redis, sized from the same settings"""
+    filter_class = StorageBlockedBloomFilter if settings.bloom_layout == "blocked" else StorageBloomFilter
+    bloom_filter = filter_class(
+        open_storage(settings.bloom_storage, settings.bloom_storage_path),
+        expected_items=settings.bloom_expected_items,
+        fp_rate=settings.bloom_false_positive_rate,
+        hash_scheme=settings.bloom_hash_scheme,
+    )
+    bloom_filter.redis_key = settings.bloom_redis_key
+    return bloom_filter
+
+
+def connect():
+    """Sync Redis client from the same settings the API connects with"""
+    redis_client = redis.Redis(
+        host=settings.redis_host,
+        port=settings.redis_port,
+        db=settings.redis_db,
+        password=settings.redis_password or None,
+        ssl=settings.redis_ssl,
+        ssl_cert_reqs=None,
+        socket_connect_timeout=settings.redis_connection_timeout,
+    )
+    redis_client.ping()
+    return redis_client
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.ingest", description="Bulk-load a password corpus into the Bloom filter")
+    parser.add_argument("path", help="corpus file, one entry per line, plain or gzip")
+    parser.add_argument("--format", choices=["plain", "hash"], default="plain",
+                        help="plain: plaintext passwords, hash: hex digests of BLOOM_PASSWORD_HASH (':count' suffixes are ignored)")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="lines per pipelined batch")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <path>.checkpoint)")
+    parser.add_argument("--restart", action="store_true", help="ignore any existing checkpoint and start from the beginning")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="seconds between throughput reports")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    if settings.bloom_storage == "memory":
+        parser.error("BLOOM_STORAGE=memory keeps nothing once the load finishes, use redis or mmap")
+
+    if settings.bloom_storage == "mmap":
+        redis_client = None
+        bloom_filter = make_storage_filter()
+        logger.info(f"Loading {args.path} into {settings.bloom_storage_path} ({bloom_filter.bit_size:,} bits)")
+    else:
+        redis_client = connect()
+        bloom_filter = build_filter(redis_client)
+        logger.info(f"Loading {args.path} into {bloom_filter.redis_key} ({bloom_filter.bit_size:,} bits)")
+
+    ingest(
+        bloom_filter,
+        args.path,
+        fmt=args.format,
+        chunk_size=args.chunk_size,
+        checkpoint_path=args.checkpoint or f"{args.path}.checkpoint",
+        resume=not args.restart,
+        algorithm=settings.bloom_password_hash,
+        hash_scheme=settings.bloom_hash_scheme,
+        report_interval=args.report_interval,
+    )
+    if redis_client is None:
+        # Writes the mapped pages back, workers mapping the file already see them
+        bloom_filter.storage.close()
+        return
+    # Workers with BLOOM_CACHE_SIZE set drop their cached misses
+    publish_invalidation(redis_client, bloom_filter.redis_key)
+
+
+if __name__ == "__main__":
+    main()
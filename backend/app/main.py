@@ -1,13 +1,30 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 import redis
-from app.BloomFilter import BloomFilter
-from app.models import PasswordRequest, CheckResponse, AddResponse, StatsResponse, StatusResponse
+from redis import asyncio as aioredis
+from app.BloomFilter import AsyncBloomFilter, AsyncBlockedBloomFilter, HASH_SCHEME_DIGEST
+from app.replica import ReplicatedBloomFilter
+from app.pages import PagedBloomFilter
+from app.sharded import AsyncShardedBloomFilter, MAX_REDIS_BITS
+from app.scalable import AsyncScalableBloomFilter
+from app.snapshot import SnapshotBloomFilter, open_snapshot_filter
+from app.xor import FileXorFilter, RedisXorFilter
+from app.storage import StorageBloomFilter, AsyncStorageBloomFilter, AsyncStorageBlockedBloomFilter, open_storage
+from app.routing import ReplicaRoutedBloomFilter
+from app.cache import CachedBloomFilter
+from app.coalesce import CoalescingBloomFilter
+from app.stats import run_reconciliation
+from app.binary import CONTENT_TYPE as BINARY_CONTENT_TYPE, decode_batch, encode_results
+from app.models import PasswordRequest, BatchPasswordRequest, HashRequest, CheckResponse, BatchCheckResponse, AddResponse, StatsResponse, StatusResponse
+from app.metrics import PASSWORD_HASH_SECONDS, REQUEST_SECONDS, CHECKS, POSITIVES, ADDS, update_pool_gauges, latest, multiprocess_enabled, mark_worker_exited
 from app.config import settings
+from prometheus_client import CONTENT_TYPE_LATEST
+import asyncio
 import hashlib
-import time
 import logging
+import math
+import time
 
 # Configure logging
 logging.basicConfig(
@@ -17,70 +34,289 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 redis_client = None
+redis_pool = None
 bloom_filter = None
+replica_task = None
+cache_task = None
+stats_task = None
+routing_task = None
+pages_task = None
+shard_clients = []
+replica_clients = []
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global redis_client, bloom_filter
+    global redis_client, redis_pool, bloom_filter, replica_task, cache_task, stats_task, routing_task, pages_task, shard_clients, replica_clients
     
     logger.info(f"Starting application in {settings.environment} mode")
-    logger.info(f"Connecting to Redis at {settings.redis_host}:{settings.redis_port}")
-    logger.info(f"Redis SSL: {settings.redis_ssl}")
-
-    retry_count = 0
-    
-    while retry_count < settings.redis_max_retries:
-        try:
-            # Create Redis connection with proper configuration
-            redis_kwargs = {
-                "host": settings.redis_host,
-                "port": settings.redis_port,
-                "db": settings.redis_db,
-                "decode_responses": False,
-                "socket_connect_timeout": settings.redis_connection_timeout,
-                "socket_timeout": settings.redis_connection_timeout,
-            }
-            
-            # Add password if provided
-            if settings.redis_password:
-                redis_kwargs["password"] = settings.redis_password
-            
-            # Add SSL configuration for production
-            if settings.redis_ssl:
-                redis_kwargs["ssl"] = True
-                redis_kwargs["ssl_cert_reqs"] = None
-            
-            redis_client = redis.Redis(**redis_kwargs)
-            redis_client.ping()
-            logger.info("Redis connection successful")
-            break
+    if settings.bloom_storage == "redis" and settings.redis_worker_connections < settings.redis_listener_connections + settings.redis_pool_count:
+        raise Exception(
+            f"REDIS_MAX_CONNECTIONS={settings.redis_max_connections} leaves each of the {settings.api_workers} worker(s) "
+            f"{settings.redis_worker_connections} connection(s), it needs one for each of its {settings.redis_listener_connections} "
+            f"pub/sub listener(s) and at least one for each of its {settings.redis_pool_count} Redis pool(s)"
+        )
+    
+    if settings.bloom_storage == "redis":
+        logger.info(f"Connecting to Redis at {settings.redis_host}:{settings.redis_port}")
+        logger.info(f"Redis SSL: {settings.redis_ssl}")
+
+        retry_count = 0
         
-        except redis.ConnectionError as e:
-            retry_count += 1
-            logger.warning(f"Redis not ready, retry {retry_count}/{settings.redis_max_retries}...")
-            if retry_count == settings.redis_max_retries:
-                logger.error(f"Failed to connect to Redis after {settings.redis_max_retries} attempts: {e}")
-                raise Exception(f"Failed to connect to Redis: {e}")
-            time.sleep(2)
-
-    logger.info("Initializing Bloom Filter")
-    bloom_filter = BloomFilter(
-        redis_client=redis_client,
-        expected_items=settings.bloom_expected_items,
-        fp_rate=settings.bloom_false_positive_rate
-    )
+        while retry_count < settings.redis_max_retries:
+            try:
+                # Create Redis connection pool with proper configuration
+                redis_kwargs = {
+                    "host": settings.redis_host,
+                    "port": settings.redis_port,
+                    "db": settings.redis_db,
+                    "decode_responses": False,
+                    "socket_connect_timeout": settings.redis_connection_timeout,
+                    "socket_timeout": settings.redis_connection_timeout,
+                    # The cache listeners each hold one of these for good, on top of the requests' share
+                    "max_connections": settings.redis_pool_size + settings.redis_listener_connections,
+                    "timeout": settings.redis_pool_timeout,
+                }
+                
+                # Add password if provided
+                if settings.redis_password:
+                    redis_kwargs["password"] = settings.redis_password
+                
+                # Add SSL configuration for production
+                if settings.redis_ssl:
+                    redis_kwargs["connection_class"] = aioredis.SSLConnection
+                    redis_kwargs["ssl_cert_reqs"] = None
+                
+                # One primary pool per worker, shared by every request handled on this event loop
+                # Blocking, so a burst waits up to REDIS_POOL_TIMEOUT for a free connection
+                # instead of opening more than its part of this worker's share of REDIS_MAX_CONNECTIONS
+                redis_pool = aioredis.BlockingConnectionPool(**redis_kwargs)
+                redis_client = aioredis.Redis(connection_pool=redis_pool)
+                await redis_client.ping()
+                logger.info("Redis connection successful")
+                break
+            
+            except redis.ConnectionError as e:
+                retry_count += 1
+                await redis_pool.disconnect()
+                logger.warning(f"Redis not ready, retry {retry_count}/{settings.redis_max_retries}...")
+                if retry_count == settings.redis_max_retries:
+                    logger.error(f"Failed to connect to Redis after {settings.redis_max_retries} attempts: {e}")
+                    raise Exception(f"Failed to connect to Redis: {e}")
+                await asyncio.sleep(2)
+
+    logger.info(f"Initializing Bloom Filter ({settings.bloom_layout} layout)")
+    if settings.bloom_local_replica and (settings.bloom_layout != "standard" or settings.bloom_shards > 1 or settings.bloom_scalable):
+        raise Exception("BLOOM_LOCAL_REPLICA is only supported with the standard layout and a single fixed-size filter")
+    if settings.bloom_use_scripts and settings.bloom_layout != "standard":
+        raise Exception("BLOOM_USE_SCRIPTS is only supported with the standard layout, a blocked check is already a single GETRANGE")
+    if settings.bloom_scalable and settings.bloom_shards > 1:
+        raise Exception("BLOOM_SCALABLE cannot be combined with BLOOM_SHARDS")
+    if settings.bloom_snapshot_path and (settings.bloom_shards > 1 or settings.bloom_scalable or settings.bloom_local_replica):
+        raise Exception("BLOOM_SNAPSHOT_PATH serves a single fixed-size filter, it cannot be combined with BLOOM_SHARDS, BLOOM_SCALABLE or BLOOM_LOCAL_REPLICA")
+    if settings.bloom_xor and (settings.bloom_shards > 1 or settings.bloom_scalable or settings.bloom_local_replica or settings.bloom_snapshot_path):
+        raise Exception("BLOOM_XOR replaces the Bloom filter, it cannot be combined with BLOOM_SHARDS, BLOOM_SCALABLE, BLOOM_LOCAL_REPLICA or BLOOM_SNAPSHOT_PATH")
+    local_storage = settings.bloom_storage != "redis"
+    if local_storage and (settings.bloom_shards > 1 or settings.bloom_scalable or settings.bloom_local_replica or settings.bloom_snapshot_path or settings.bloom_xor):
+        raise Exception(f"BLOOM_STORAGE={settings.bloom_storage} keeps a single bitmap in this process, it cannot be combined with BLOOM_SHARDS, BLOOM_SCALABLE, BLOOM_LOCAL_REPLICA, BLOOM_SNAPSHOT_PATH or BLOOM_XOR")
+    if settings.redis_replicas and (settings.bloom_shards > 1 or settings.bloom_scalable or settings.bloom_local_replica or settings.bloom_snapshot_path or settings.bloom_xor_path or local_storage):
+        raise Exception("REDIS_REPLICAS routes the reads of a single Redis filter, it cannot be combined with BLOOM_SHARDS, BLOOM_SCALABLE, BLOOM_LOCAL_REPLICA, BLOOM_SNAPSHOT_PATH, BLOOM_XOR_PATH or BLOOM_STORAGE")
+    # A miss read from a lagging replica would be cached for the whole TTL, well past the replica catching up
+    if settings.redis_replicas and (settings.bloom_cache_size or settings.bloom_page_cache_pages):
+        raise Exception("REDIS_REPLICAS reads can lag the primary, caching them with BLOOM_CACHE_SIZE or BLOOM_PAGE_CACHE_PAGES would keep a stale miss for the cache TTL")
+    if settings.bloom_page_cache_pages and (settings.bloom_layout != "standard" or settings.bloom_shards > 1 or settings.bloom_scalable or settings.bloom_local_replica or settings.bloom_snapshot_path or settings.bloom_xor or local_storage):
+        raise Exception("BLOOM_PAGE_CACHE_PAGES caches pages of a single standard layout Redis bitmap, it cannot be combined with BLOOM_LAYOUT=blocked, BLOOM_SHARDS, BLOOM_SCALABLE, BLOOM_LOCAL_REPLICA, BLOOM_SNAPSHOT_PATH, BLOOM_XOR or BLOOM_STORAGE")
+    
+    filter_class = AsyncBlockedBloomFilter if settings.bloom_layout == "blocked" else AsyncBloomFilter
+    filter_kwargs = {
+        "expected_items": settings.bloom_expected_items,
+        "fp_rate": settings.bloom_false_positive_rate,
+        "use_scripts": settings.bloom_use_scripts,
+        "hash_scheme": settings.bloom_hash_scheme,
+    }
+    
+    if settings.bloom_shards > 1:
+        # Shards go round-robin over the configured nodes, or all on the main Redis
+        shard_clients = [
+            aioredis.Redis.from_pool(aioredis.BlockingConnectionPool.from_url(
+                url, max_connections=settings.redis_pool_size, timeout=settings.redis_pool_timeout
+            ))
+            for url in settings.bloom_shard_nodes
+        ]
+        bloom_filter = AsyncShardedBloomFilter(
+            shard_clients or redis_client,
+            settings.bloom_shards,
+            filter_class=filter_class,
+            **filter_kwargs
+        )
+        shard_bit_size = bloom_filter.shard_bit_size
+        logger.info(f"Sharded over {settings.bloom_shards} keys on {len(shard_clients) or 1} Redis node(s)")
+    elif settings.bloom_scalable:
+        bloom_filter = AsyncScalableBloomFilter(
+            redis_client,
+            growth=settings.bloom_scalable_growth,
+            tightening=settings.bloom_scalable_tightening,
+            filter_class=filter_class,
+            **filter_kwargs
+        )
+        bloom_filter.redis_key = settings.bloom_redis_key
+        await bloom_filter.load_generations()
+        shard_bit_size = bloom_filter.generations[-1].bit_size
+        logger.info(f"Scalable filter at {len(bloom_filter.generations)} generation(s)")
+    elif settings.bloom_xor:
+        # Static binary fuse filter, sized by its build rather than BLOOM_EXPECTED_ITEMS
+        if settings.bloom_xor_path:
+            bloom_filter = FileXorFilter(settings.bloom_xor_path)
+            logger.info(f"Serving checks from binary fuse filter file {settings.bloom_xor_path}")
+        else:
+            bloom_filter = RedisXorFilter(redis_client, settings.bloom_redis_key)
+            await bloom_filter.load()
+            logger.info(f"Serving checks from binary fuse filter {bloom_filter.data_key}")
+        shard_bit_size = bloom_filter.bit_size
+    elif settings.bloom_snapshot_path:
+        # Sizing, layout and hash scheme all come from the snapshot header
+        bloom_filter = open_snapshot_filter(settings.bloom_snapshot_path)
+        shard_bit_size = bloom_filter.bit_size
+        logger.info(f"Serving checks from snapshot {settings.bloom_snapshot_path}")
+    elif local_storage:
+        # No Redis at all, the bitmap lives in this process (or a file every worker maps)
+        filter_class = AsyncStorageBlockedBloomFilter if settings.bloom_layout == "blocked" else AsyncStorageBloomFilter
+        bloom_filter = filter_class(open_storage(settings.bloom_storage, settings.bloom_storage_path), **filter_kwargs)
+        shard_bit_size = bloom_filter.bit_size
+        logger.info(f"Keeping the bitmap in {settings.bloom_storage_path or 'process memory'}")
+    else:
+        if settings.bloom_local_replica:
+            filter_class = ReplicatedBloomFilter
+        elif settings.bloom_page_cache_pages:
+            # Too big to copy whole, keep the pages the checks keep landing on
+            filter_class = PagedBloomFilter
+            filter_kwargs.update(
+                page_bytes=settings.bloom_page_size,
+                max_pages=settings.bloom_page_cache_pages,
+                ttl=settings.bloom_page_cache_ttl
+            )
+        bloom_filter = filter_class(redis_client=redis_client, **filter_kwargs)
+        shard_bit_size = bloom_filter.bit_size
     # Update redis key from settings
     bloom_filter.redis_key = settings.bloom_redis_key
     
+    if shard_bit_size > MAX_REDIS_BITS and not local_storage:
+        raise Exception(
+            f"Each bitmap needs {shard_bit_size:,} bits but a Redis string holds at most {MAX_REDIS_BITS:,}, "
+            f"set BLOOM_SHARDS to at least {math.ceil(bloom_filter.bit_size / MAX_REDIS_BITS)}"
+        )
+    
+    # Fails on a key written with other sizing, layout or hash scheme, then sizes it in one go
+    # A snapshot, xor filter or local storage never writes to a Redis bitmap
+    if not (settings.bloom_snapshot_path or settings.bloom_xor or local_storage):
+        await bloom_filter.allocate()
+        logger.info(f"Pre-sized {bloom_filter.bit_size:,} bits and checked the params stored with them")
+    
+    if settings.bloom_use_scripts:
+        await bloom_filter.load_scripts()
+        logger.info("Using server-side Lua scripts for check/add")
+    
+    if settings.bloom_local_replica:
+        bloom_filter.changelog_key = f"{settings.bloom_redis_key}:changelog"
+        bloom_filter.changelog_maxlen = settings.bloom_changelog_maxlen
+        await bloom_filter.load()
+        replica_task = asyncio.create_task(
+            bloom_filter.run_refresh(settings.bloom_replica_refresh_interval)
+        )
+        logger.info("Serving checks from local bitmap replica")
+    
+    if settings.bloom_page_cache_pages:
+        pages_task = asyncio.create_task(bloom_filter.run_invalidation_listener())
+        logger.info(f"Caching up to {settings.bloom_page_cache_pages:,} bitmap pages of {settings.bloom_page_size:,} bytes")
+    
+    # A snapshot or xor filter counts its own bits once, it never changes, local storage counts in process
+    if settings.bloom_stats_reconcile_interval and not (settings.bloom_snapshot_path or settings.bloom_xor or local_storage):
+        stats_task = asyncio.create_task(
+            run_reconciliation(bloom_filter, redis_client, settings.bloom_stats_reconcile_interval)
+        )
+    
+    # Checks and /stats go round-robin over the replicas, adds and reconciliation stay on the primary
+    if settings.redis_replicas:
+        replica_clients = [
+            aioredis.Redis.from_pool(aioredis.BlockingConnectionPool.from_url(
+                url, max_connections=settings.redis_pool_size, timeout=settings.redis_pool_timeout
+            ))
+            for url in settings.redis_replicas
+        ]
+        bloom_filter = ReplicaRoutedBloomFilter(bloom_filter, replica_clients)
+        routing_task = asyncio.create_task(
+            bloom_filter.run_health_checks(settings.redis_replica_check_interval)
+        )
+        logger.info(f"Routing checks over {len(replica_clients)} Redis replica(s), writes go to the primary")
+    
+    # Only checks that go to Redis gain anything from sharing a pipeline
+    if settings.bloom_coalesce and not (settings.bloom_snapshot_path or settings.bloom_local_replica or settings.bloom_xor_path or local_storage):
+        bloom_filter = CoalescingBloomFilter(
+            bloom_filter,
+            window=settings.bloom_coalesce_window,
+            max_batch=settings.bloom_coalesce_max_batch,
+            chunk_size=settings.bloom_batch_chunk_size
+        )
+        logger.info(f"Coalescing concurrent checks: up to {settings.bloom_coalesce_max_batch} per batch, {settings.bloom_coalesce_window * 1000:g}ms window")
+    
+    # Goes in front of the coalescer so cache hits never wait for a batch
+    # A snapshot never changes under us and is already local, nothing to gain from a cache
+    if settings.bloom_cache_size and not (settings.bloom_snapshot_path or settings.bloom_xor_path or local_storage):
+        bloom_filter = CachedBloomFilter(
+            bloom_filter,
+            redis_client,
+            max_size=settings.bloom_cache_size,
+            ttl=settings.bloom_cache_ttl
+        )
+        cache_task = asyncio.create_task(bloom_filter.run_invalidation_listener())
+        logger.info(f"Caching up to {settings.bloom_cache_size:,} check results, misses for {settings.bloom_cache_ttl}s")
+    
     logger.info(f"Bloom filter ready: {bloom_filter.bit_size:,} bits")
     logger.info(f"Expected items: {settings.bloom_expected_items:,}")
     logger.info(f"False positive rate: {settings.bloom_false_positive_rate}")
+    if redis_client:
+        logger.info(
+            f"Redis connections: {settings.redis_pool_size} per pool over {settings.redis_pool_count} pool(s) "
+            f"and {settings.redis_listener_connections} listener(s), of {settings.redis_max_connections} over {settings.api_workers} worker(s)"
+        )
     
     yield
   
+    if replica_task:
+        replica_task.cancel()
+    
+    if cache_task:
+        cache_task.cancel()
+    
+    if stats_task:
+        stats_task.cancel()
+    
+    if routing_task:
+        routing_task.cancel()
+    
+    if pages_task:
+        pages_task.cancel()
+    
+    if isinstance(bloom_filter, SnapshotBloomFilter):
+        bloom_filter.snapshot.close()
+    
+    if isinstance(bloom_filter, FileXorFilter):
+        bloom_filter.close()
+    
+    if isinstance(bloom_filter, StorageBloomFilter):
+        bloom_filter.storage.close()
+    
+    for shard_client in shard_clients:
+        await shard_client.aclose()
+    
+    for replica_client in replica_clients:
+        await replica_client.aclose()
+    
     if redis_client:
-        logger.info("Closing Redis connection")
-        redis_client.close()
+        logger.info("Closing Redis connection pool")
+        await redis_client.aclose()
+        await redis_pool.disconnect()
+    
+    mark_worker_exited()
 
 app = FastAPI(
     title="Password Bloom Filter API",
@@ -99,32 +335,139 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    """Observe total handler time per route, unmatched paths are not recorded"""
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    if route is not None:
+        REQUEST_SECONDS.labels(route.path).observe(time.perf_counter() - start)
+    return response
+
+def hash_password(password: str):
+    """Digest a password with the configured algorithm, as the filter expects its items"""
+    with PASSWORD_HASH_SECONDS.time():
+        digest = hashlib.new(settings.bloom_password_hash, password.encode())
+        # Hash scheme 2 reads positions straight from the digest bytes, no need to hex encode
+        return digest.digest() if settings.bloom_hash_scheme == HASH_SCHEME_DIGEST else digest.hexdigest()
+
+def check_message(is_compromised: bool):
+    return "Password found in compromised database" if is_compromised else "Password appears safe"
+
+def count_checks(endpoint: str, checked: int, positives: int):
+    CHECKS.labels(endpoint).inc(checked)
+    POSITIVES.labels(endpoint).inc(positives)
+
 @app.post("/check", response_model=CheckResponse)
 async def check_password(request: PasswordRequest):
     if not bloom_filter:
         raise HTTPException(status_code=503, detail="Bloom filter not initialized")
     
     #we are hashing here because we dont want to actually store real passwords
-    password_hash = hashlib.sha256(request.password.encode()).hexdigest()
+    password_hash = hash_password(request.password)
     
-    is_compromised = bloom_filter.check(password_hash)
+    is_compromised = await bloom_filter.check(password_hash)
+    count_checks("check", 1, is_compromised)
     
-    message = "Password found in compromised database" if is_compromised else "Password appears safe"
+    return CheckResponse(
+        compromised=is_compromised,
+        message=check_message(is_compromised)
+    )
+
+@app.post("/check/hash", response_model=CheckResponse)
+async def check_password_hash(request: HashRequest):
+    """Check a precomputed digest, for clients that already hold password hashes"""
+    if not bloom_filter:
+        raise HTTPException(status_code=503, detail="Bloom filter not initialized")
+    
+    expected_length = hashlib.new(settings.bloom_password_hash).digest_size * 2
+    if len(request.hash) != expected_length:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Expected a {settings.bloom_password_hash} digest of {expected_length} hex characters"
+        )
+    
+    password_hash = request.hash.lower()
+    if settings.bloom_hash_scheme == HASH_SCHEME_DIGEST:
+        password_hash = bytes.fromhex(password_hash)
+    
+    is_compromised = await bloom_filter.check(password_hash)
+    count_checks("check_hash", 1, is_compromised)
     
     return CheckResponse(
         compromised=is_compromised,
-        message=message
+        message=check_message(is_compromised)
+    )
+
+@app.post("/check/batch", response_model=BatchCheckResponse)
+async def check_passwords_batch(request: BatchPasswordRequest):
+    if not bloom_filter:
+        raise HTTPException(status_code=503, detail="Bloom filter not initialized")
+
+    if len(request.passwords) > settings.api_batch_max_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(request.passwords)} passwords, maximum is {settings.api_batch_max_size}"
+        )
+
+    password_hashes = [hash_password(password) for password in request.passwords]
+
+    results = await bloom_filter.check_many(password_hashes, chunk_size=settings.bloom_batch_chunk_size)
+    count_checks("check_batch", len(results), sum(results))
+
+    return BatchCheckResponse(
+        results=results,
+        compromised_count=sum(results)
     )
 
+@app.post("/check/binary")
+async def check_digests_binary(request: Request):
+    """Check a batch of raw digests without JSON, see app.binary for the format"""
+    if not bloom_filter:
+        raise HTTPException(status_code=503, detail="Bloom filter not initialized")
+    
+    if request.headers.get("content-type", "").split(";")[0].strip() != BINARY_CONTENT_TYPE:
+        raise HTTPException(status_code=415, detail=f"Expected a {BINARY_CONTENT_TYPE} body")
+    
+    digest_size = hashlib.new(settings.bloom_password_hash).digest_size
+    try:
+        digests = decode_batch(await request.body(), digest_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if len(digests) > settings.api_batch_max_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(digests)} digests, maximum is {settings.api_batch_max_size}"
+        )
+    
+    # Hash scheme 2 takes the digest bytes as they are, scheme 1 hashes the hex form
+    if settings.bloom_hash_scheme != HASH_SCHEME_DIGEST:
+        digests = [digest.hex() for digest in digests]
+    
+    results = await bloom_filter.check_many(digests, chunk_size=settings.bloom_batch_chunk_size) if digests else []
+    count_checks("check_binary", len(results), sum(results))
+    
+    return Response(encode_results(results), media_type=BINARY_CONTENT_TYPE)
+
 @app.post("/add", response_model=AddResponse)
 async def add_password(request: PasswordRequest):
     if not bloom_filter:
         raise HTTPException(status_code=503, detail="Bloom filter not initialized")
 
+    if isinstance(bloom_filter, SnapshotBloomFilter):
+        raise HTTPException(status_code=409, detail="Filter is served from a read-only snapshot")
+    
+    # Checked on the setting, the cache or coalescer may wrap the filter
+    if settings.bloom_xor:
+        raise HTTPException(status_code=409, detail="Filter is a static binary fuse filter, rebuild it with python -m app.xor build")
+
     #we are hashing here because we dont want to actually store real passwords
-    password_hash = hashlib.sha256(request.password.encode()).hexdigest()
+    password_hash = hash_password(request.password)
 
-    bloom_filter.add(password_hash)
+    await bloom_filter.add(password_hash)
+    ADDS.inc()
     return AddResponse(added=True)
 
 @app.get("/", response_model=StatusResponse)
@@ -136,7 +479,7 @@ async def health_check():
     """Health check endpoint for load balancers and monitoring"""
     try:
         if redis_client:
-            redis_client.ping()
+            await redis_client.ping()
         return StatusResponse(
             status="healthy", 
             message=f"API running in {settings.environment} mode"
@@ -148,22 +491,38 @@ async def health_check():
             detail=f"Service unhealthy: {str(e)}"
         )
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    # Without a shared directory a scrape would only see whichever worker answered it
+    if settings.api_workers > 1 and not multiprocess_enabled():
+        raise HTTPException(
+            status_code=503,
+            detail="Metrics with API_WORKERS > 1 need PROMETHEUS_MULTIPROC_DIR, start the server with python -m app.serve"
+        )
+    if redis_pool:
+        update_pool_gauges(redis_pool)
+    return Response(latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/stats", response_model=StatsResponse)
 async def get_stats():
-    if not bloom_filter or not redis_client:
+    if not bloom_filter or (not redis_client and settings.bloom_storage == "redis"):
         raise HTTPException(status_code=503, detail="Service unavailable")
     
     try:
-        # Get bit count from Redis
-        bits_set = redis_client.bitcount(bloom_filter.redis_key)
+        # Running totals kept by the adds, BITCOUNT only runs in the background reconciliation
+        stats = await bloom_filter.stats()
         
         return StatsResponse(
             bit_size=bloom_filter.bit_size,
-            bits_set=bits_set,
+            bits_set=stats["bits_set"],
             num_hashes=bloom_filter.num_hashes,
             expected_items=bloom_filter.expected_items,
             false_positive_rate=bloom_filter.fp_rate,
-            memory_usage_mb=bloom_filter.bit_size / (8 * 1024 * 1024)
+            memory_usage_mb=bloom_filter.bit_size / (8 * 1024 * 1024),
+            items_added=stats["items_added"],
+            estimated_items=stats["estimated_items"],
+            current_false_positive_rate=stats["false_positive_rate"]
         )
     except Exception as e:
         logger.error(f"Failed to get stats: {e}")
@@ -0,0 +1,104 @@
+"""
+prometheus metrics, served by GET /metrics
+
+the filters time their own position math and redis round-trips, main.py times
+password hashing and whole requests and counts results. buckets start at 10us
+because a cached or local check is over long before a millisecond
+
+with several workers every process has its own registry, so app.serve points
+PROMETHEUS_MULTIPROC_DIR at a directory they all write to and a scrape adds up the
+files of every worker. that has to be set before this module is first imported
+"""
+import os
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+LATENCY_BUCKETS = (
+  0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+  0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+PASSWORD_HASH_SECONDS = Histogram(
+  "bloom_password_hash_seconds", "Time to digest one password before it reaches the filter",
+  buckets=LATENCY_BUCKETS
+)
+POSITIONS_SECONDS = Histogram(
+  "bloom_positions_seconds", "Time to compute bit positions, per call (one item or one batch chunk)",
+  buckets=LATENCY_BUCKETS
+)
+REDIS_PIPELINE_SECONDS = Histogram(
+  "bloom_redis_pipeline_seconds", "Round-trip time of one Redis pipeline execute",
+  buckets=LATENCY_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+  "bloom_request_seconds", "Total handler time per endpoint", ["endpoint"],
+  buckets=LATENCY_BUCKETS
+)
+
+CHECKS = Counter("bloom_checks", "Passwords checked", ["endpoint"])
+POSITIVES = Counter("bloom_positives", "Checks that found the password in the filter", ["endpoint"])
+ADDS = Counter("bloom_adds", "Passwords added")
+REDIS_ERRORS = Counter("bloom_redis_errors", "Redis pipelines that failed")
+
+# in multiprocess mode the pool gauges add up the live workers, the replica count is
+# the fewest any worker has in rotation
+POOL_CONNECTIONS = Gauge("bloom_redis_pool_connections", "Connections in the Redis pool", ["state"], multiprocess_mode="livesum")
+POOL_MAX_CONNECTIONS = Gauge("bloom_redis_pool_max_connections", "Size limit of the Redis pool", multiprocess_mode="livesum")
+REPLICAS_HEALTHY = Gauge("bloom_redis_replicas_healthy", "Redis read replicas currently in rotation", multiprocess_mode="livemin")
+
+
+def update_pool_gauges(pool):
+  """
+  set the pool gauges from a redis.asyncio ConnectionPool, right before a scrape
+
+  the connection lists are private to redis-py, a release without them leaves the
+  connection gauges unset rather than failing the scrape
+  """
+  in_use = getattr(pool, "_in_use_connections", None)
+  available = getattr(pool, "_available_connections", None)
+  if in_use is not None and available is not None:
+    POOL_CONNECTIONS.labels("in_use").set(len(in_use))
+    POOL_CONNECTIONS.labels("idle").set(len(available))
+  POOL_MAX_CONNECTIONS.set(pool.max_connections)
+
+
+def multiprocess_enabled():
+  return MULTIPROC_DIR_ENV in os.environ
+
+
+def prepare_multiprocess_dir():
+  """
+  for app.serve, before the workers start: PROMETHEUS_MULTIPROC_DIR if it's set,
+  otherwise a fresh temp dir. files an earlier run left behind are removed, they'd
+  be added to this run's counts
+  """
+  import tempfile
+
+  path = os.environ.get(MULTIPROC_DIR_ENV) or tempfile.mkdtemp(prefix="bloom-metrics-")
+  os.makedirs(path, exist_ok=True)
+  for name in os.listdir(path):
+    if name.endswith(".db"):
+      os.remove(os.path.join(path, name))
+  os.environ[MULTIPROC_DIR_ENV] = path
+  return path
+
+
+def latest():
+  """
+  the scrape body, summed over every worker in multiprocess mode
+  """
+  if not multiprocess_enabled():
+    return generate_latest()
+  registry = CollectorRegistry()
+  multiprocess.MultiProcessCollector(registry)
+  return generate_latest(registry)
+
+
+def mark_worker_exited():
+  """
+  drop this worker's live gauges on shutdown, counters and histograms stay in the totals
+  """
+  if multiprocess_enabled():
+    multiprocess.mark_process_dead(os.getpid())
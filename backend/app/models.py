@@ -1,14 +1,25 @@
+from typing import Annotated, List, Optional
 from pydantic import BaseModel, Field
 
 # Request models
 class PasswordRequest(BaseModel):
     password: str = Field(..., min_length=1, description="Password to check or add")
 
+class BatchPasswordRequest(BaseModel):
+    passwords: List[Annotated[str, Field(min_length=1)]] = Field(..., min_length=1, description="Passwords to check, results are returned in the same order")
+
+class HashRequest(BaseModel):
+    hash: str = Field(..., min_length=40, max_length=64, pattern=r"^[0-9a-fA-F]+$", description="Hex encoded SHA-1 or SHA-256 digest of the password")
+
 # Response models
 class CheckResponse(BaseModel):
     compromised: bool
     message: str = ""
 
+class BatchCheckResponse(BaseModel):
+    results: List[bool]
+    compromised_count: int
+
 class AddResponse(BaseModel):
     added: bool
     message: str = "Password hash added to bloom filter"
@@ -20,6 +31,9 @@ class StatsResponse(BaseModel):
     expected_items: int
     false_positive_rate: float
     memory_usage_mb: float
+    items_added: Optional[int] = Field(None, description="Adds that set at least one new bit, unknown after an offline build or snapshot import")
+    estimated_items: int = Field(..., description="Items the filter holds, estimated from the share of bits set")
+    current_false_positive_rate: float = Field(..., description="False positive rate at the current fill, false_positive_rate is the one the filter was sized for")
 
 class StatusResponse(BaseModel):
     status: str
@@ -0,0 +1,195 @@
+"""
+a bounded LRU of bitmap pages in front of redis, for filters too big for
+BLOOM_LOCAL_REPLICA to copy into every worker
+
+a check works out which aligned pages its k bits fall in, GETRANGEs the ones it
+doesn't hold (all of them in one pipeline) and answers from the pages. password
+traffic is skewed, so the pages under the popular passwords stay cached
+
+bits only ever go from 0 to 1, so a stale page can only turn a present password
+into an absent one, never the other way round. adds drop the pages they touched in
+this worker and PUBLISH their numbers on <key>:pages, every worker drops them when
+the message arrives. pub/sub isn't guaranteed delivery, so pages also expire after
+ttl and everything is dropped whenever the subscription is (re)made
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, OrderedDict
+
+from app.BloomFilter import AsyncBloomFilter, _chunks
+from app.bitmap import bitmap_bytes, get_bit
+from app.cache import page_channel, ALL_PAGES
+from app.metrics import POSITIONS_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class PageCache:
+  """
+  LRU of page number -> page bytes, each entry expires ttl seconds after it was fetched
+
+  a page that is invalidated while a GETRANGE for it is out may come back with the
+  bits from before the add, so it's marked stale and that reply isn't stored
+  """
+
+  def __init__(self, max_pages=4096, ttl=60.0):
+    self.max_pages = max_pages
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self._pages = OrderedDict()
+    self._fetching = Counter()
+    self._stale = set()
+
+  def __len__(self):
+    return len(self._pages)
+
+  def get(self, page):
+    """
+    the page's bytes, or None on a miss
+    """
+    entry = self._pages.get(page)
+    if entry is not None:
+      data, expires = entry
+      if time.monotonic() < expires:
+        self._pages.move_to_end(page)
+        self.hits += 1
+        return data
+      del self._pages[page]
+    self.misses += 1
+    return None
+
+  def start_fetch(self, pages):
+    self._fetching.update(pages)
+
+  def finish_fetch(self, pages, replies):
+    """
+    store what came back for pages (None if the fetch failed) unless one was invalidated meanwhile
+    """
+    expires = time.monotonic() + self.ttl
+    for i, page in enumerate(pages):
+      if replies is not None and page not in self._stale:
+        self._pages[page] = (replies[i], expires)
+        self._pages.move_to_end(page)
+      self._fetching[page] -= 1
+      if not self._fetching[page]:
+        del self._fetching[page]
+        self._stale.discard(page)
+    while len(self._pages) > self.max_pages:
+      self._pages.popitem(last=False)
+
+  def invalidate(self, pages):
+    for page in pages:
+      self._pages.pop(page, None)
+      if page in self._fetching:
+        self._stale.add(page)
+
+  def clear(self):
+    self._pages.clear()
+    self._stale.update(self._fetching)
+
+
+class PagedBloomFilter(AsyncBloomFilter):
+  """
+  standard layout filter that answers checks from cached pages of the bitmap
+
+  adds still go straight to redis. run_invalidation_listener has to run in every
+  worker for other workers' adds to reach its pages
+  """
+
+  def __init__(self, *args, page_bytes=4096, max_pages=4096, ttl=60.0, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.page_bytes = page_bytes
+    self.page_bits = page_bytes * 8
+    self.pages = PageCache(max_pages, ttl)
+
+  @property
+  def page_channel(self):
+    return page_channel(self.redis_key)
+
+  def _pages_of(self, positions):
+    return {pos // self.page_bits for item_positions in positions for pos in item_positions}
+
+  async def _load_pages(self, pages):
+    """
+    page number -> bytes for every page, the missing ones in one pipeline of GETRANGEs
+    """
+    loaded = {page: self.pages.get(page) for page in pages}
+    missing = [page for page, data in loaded.items() if data is None]
+    if missing:
+      size = bitmap_bytes(self.bit_size)
+      self.pages.start_fetch(missing)
+      replies = None
+      try:
+        replies, _ = await self._execute(
+          lambda pipe: [pipe.getrange(self.redis_key, page * self.page_bytes, (page + 1) * self.page_bytes - 1) for page in missing],
+          transaction=False
+        )
+        # a string shorter than the filter reads back short, the bits past its end are 0
+        replies = [
+          data.ljust(min(self.page_bytes, size - page * self.page_bytes), b"\x00")
+          for page, data in zip(missing, replies)
+        ]
+      finally:
+        self.pages.finish_fetch(missing, replies)
+      loaded.update(zip(missing, replies))
+    return loaded
+
+  def _is_set(self, loaded, positions):
+    return all(get_bit(loaded[pos // self.page_bits], pos % self.page_bits) for pos in positions)
+
+  async def _publish_pages(self, positions):
+    pages = self._pages_of(positions)
+    self.pages.invalidate(pages)
+    await self.redis_client.publish(self.page_channel, " ".join(str(page) for page in sorted(pages)))
+
+  def _seen_message(self, data):
+    data = data.decode() if isinstance(data, bytes) else data
+    if data == ALL_PAGES:
+      self.pages.clear()
+    else:
+      self.pages.invalidate(int(page) for page in data.split())
+
+  async def run_invalidation_listener(self, retry_interval=1.0):
+    """
+    background loop for lifespan, resubscribes if the connection drops
+    """
+    while True:
+      try:
+        async with self.redis_client.pubsub() as pubsub:
+          await pubsub.subscribe(self.page_channel)
+          # anything published before the subscribe went through is lost
+          self.pages.clear()
+          async for message in pubsub.listen():
+            if message["type"] == "message":
+              self._seen_message(message["data"])
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        logger.warning(f"Page invalidation listener failed, dropping cached pages: {e}")
+        self.pages.clear()
+      await asyncio.sleep(retry_interval)
+
+  async def add(self, password_hash):
+    await super().add(password_hash)
+    await self._publish_pages([self._get_bit_positions(password_hash)])
+
+  async def add_many(self, password_hashes, chunk_size=5000):
+    await super().add_many(password_hashes, chunk_size)
+    await self._publish_pages(self._get_bit_positions_many(password_hashes))
+
+  async def check(self, password_hash):
+    with POSITIONS_SECONDS.time():
+      positions = self._get_bit_positions(password_hash)
+    loaded = await self._load_pages(self._pages_of([positions]))
+    return self._is_set(loaded, positions)
+
+  async def check_many(self, password_hashes, chunk_size=5000):
+    results = []
+    for chunk in _chunks(password_hashes, chunk_size):
+      with POSITIONS_SECONDS.time():
+        positions = self._get_bit_positions_many(chunk)
+      loaded = await self._load_pages(self._pages_of(positions))
+      results.extend(self._is_set(loaded, item_positions) for item_positions in positions)
+    return results
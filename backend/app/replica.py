@@ -0,0 +1,133 @@
+import asyncio
+import logging
+
+from redis.exceptions import ResponseError
+
+from app.BloomFilter import AsyncBloomFilter
+from app.bitmap import bitmap_bytes, set_bit, all_bits_set
+from app.metrics import POSITIONS_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def _decode(entry_id):
+  return entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+
+
+class ReplicatedBloomFilter(AsyncBloomFilter):
+  """
+  keeps a full copy of the bitmap in process memory and answers check() from it,
+  so reads never leave the worker. adds still go to redis (plus the changelog
+  stream) and are applied locally straight away
+
+  other workers' adds arrive through refresh(), which reads the changelog stream
+  from the last entry we've seen. if entries we never saw were trimmed off the
+  stream the whole bitmap is pulled again. XADD MAXLEN trims don't show up in
+  max-deleted-entry-id, so the gap is worked out from counts: redis 7 reports how
+  many entries were ever added (XINFO STREAM entries-added), and the ones we
+  haven't applied are the newest entries-added - seen of them. if that's more than
+  the stream still holds, some were trimmed before we read them
+  """
+
+  def __init__(self, *args, load_chunk_bytes=4 * 1024 * 1024, read_count=10_000, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.load_chunk_bytes = load_chunk_bytes
+    self.read_count = read_count
+    self.bitmap = None
+    self._last_id = "0-0"
+    self._entries_seen = 0
+
+  async def _changelog_info(self):
+    """
+    (last-generated-id, entries-added, length) of the changelog, ("0-0", 0, 0) before the first add
+
+    last-generated-id is the newest id ever added and entries-added counts every
+    entry ever added, both even if the entries have been trimmed since
+    """
+    try:
+      info = await self.redis_client.xinfo_stream(self.changelog_key)
+    except ResponseError:
+      # no such key, nothing was ever added
+      return "0-0", 0, 0
+    return _decode(info["last-generated-id"]), info["entries-added"], info["length"]
+
+  async def load(self):
+    """
+    pull the whole bitmap with GETRANGE in chunks
+
+    the changelog position is read first, anything added while we copy gets
+    replayed by the next refresh(). setting a bit twice is harmless
+    """
+    last_id, entries_added, _ = await self._changelog_info()
+
+    bitmap = bytearray(bitmap_bytes(self.bit_size))
+    for start in range(0, len(bitmap), self.load_chunk_bytes):
+      end = min(start + self.load_chunk_bytes, len(bitmap)) - 1
+      chunk = await self.redis_client.getrange(self.redis_key, start, end)
+      # redis only stores the string up to the highest bit ever set
+      bitmap[start:start + len(chunk)] = chunk
+      if len(chunk) < end - start + 1:
+        break
+
+    self.bitmap = bitmap
+    self._last_id = last_id
+    self._entries_seen = entries_added
+    logger.info(f"Loaded local bitmap replica: {len(bitmap):,} bytes, changelog at {last_id}")
+
+  async def refresh(self):
+    """
+    apply every changelog entry after the last one we've seen, returns how many were applied
+    """
+    applied = 0
+    while True:
+      response = await self.redis_client.xread({self.changelog_key: self._last_id}, count=self.read_count)
+      # asked after the read, so a trim that beat the read to an unread entry shows up here
+      _, entries_added, length = await self._changelog_info()
+      if entries_added - self._entries_seen > length:
+        logger.warning("Changelog was trimmed past the local replica, reloading bitmap")
+        await self.load()
+        return applied
+      if not response:
+        return applied
+
+      _, entries = response[0]
+      for entry_id, fields in entries:
+        for pos in fields[b"positions"].split(b","):
+          set_bit(self.bitmap, int(pos))
+        self._last_id = _decode(entry_id)
+      self._entries_seen += len(entries)
+      applied += len(entries)
+
+  async def run_refresh(self, interval):
+    """
+    background loop for lifespan, one failed refresh shouldn't take the replica down
+    """
+    while True:
+      await asyncio.sleep(interval)
+      try:
+        await self.refresh()
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        logger.warning(f"Local replica refresh failed: {e}")
+
+  async def add(self, password_hash):
+    await super().add(password_hash)
+    for pos in self._get_bit_positions(password_hash):
+      set_bit(self.bitmap, pos)
+
+  async def add_many(self, password_hashes, chunk_size=5000):
+    await super().add_many(password_hashes, chunk_size)
+    for positions in self._get_bit_positions_many(password_hashes):
+      for pos in positions:
+        set_bit(self.bitmap, pos)
+
+  async def check(self, password_hash):
+    with POSITIONS_SECONDS.time():
+      positions = self._get_bit_positions(password_hash)
+    return all_bits_set(self.bitmap, positions)
+
+  async def check_many(self, password_hashes, chunk_size=5000):
+    with POSITIONS_SECONDS.time():
+      positions = self._get_bit_positions_many(password_hashes)
+    return [all_bits_set(self.bitmap, item_positions) for item_positions in positions]
@@ -0,0 +1,118 @@
+"""
+reads from redis replicas, writes to the primary
+
+/check is nearly all of the traffic and never writes, so checks and /stats go
+round-robin over the replicas while adds, allocate, scripts loading and stats
+reconciliation stay on the primary. a replica is a copy of the filter object
+with its redis_client swapped, positions and queued commands are the filter's own
+
+a replica leaves the rotation when it stops answering PING or loses its link to
+the primary (a replica that can't sync serves stale bits), and comes back once the
+health check passes again. a check that fails on a replica is retried on the
+primary, so losing a replica never fails a request. with no healthy replica left
+every read goes to the primary
+
+replication is asynchronous, a password added a moment ago can still read as
+absent on a replica that hasn't caught up
+"""
+import asyncio
+import copy
+import logging
+
+from redis.exceptions import RedisError
+
+from app.metrics import REPLICAS_HEALTHY
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaRoutedBloomFilter:
+  """
+  wraps an async filter on the primary, replica_clients are redis.asyncio clients
+
+  only reads are routed, everything else (add, add_many, sizing ...) goes straight
+  to the wrapped filter
+  """
+
+  def __init__(self, bloom_filter, replica_clients):
+    self.bloom_filter = bloom_filter
+    self.replica_clients = list(replica_clients)
+    self.readers = [self._reader(replica_client) for replica_client in self.replica_clients]
+    self.healthy = [True] * len(self.readers)
+    self._next = 0
+    REPLICAS_HEALTHY.set(len(self.readers))
+
+  def __getattr__(self, name):
+    return getattr(self.bloom_filter, name)
+
+  def _reader(self, replica_client):
+    reader = copy.copy(self.bloom_filter)
+    reader.redis_client = replica_client
+    return reader
+
+  def _pick(self):
+    """
+    index of the next healthy replica, None if there isn't one
+    """
+    for _ in range(len(self.readers)):
+      index = self._next
+      self._next = (self._next + 1) % len(self.readers)
+      if self.healthy[index]:
+        return index
+    return None
+
+  def _mark(self, index, healthy):
+    if self.healthy[index] != healthy:
+      self.healthy[index] = healthy
+      REPLICAS_HEALTHY.set(sum(self.healthy))
+      if healthy:
+        logger.info(f"Redis replica {index} is back in rotation")
+      else:
+        logger.warning(f"Redis replica {index} dropped from rotation")
+
+  async def _read(self, method, *args):
+    index = self._pick()
+    if index is not None:
+      try:
+        return await getattr(self.readers[index], method)(*args)
+      except RedisError as e:
+        logger.warning(f"Read from Redis replica {index} failed, retrying on the primary: {e}")
+        self._mark(index, False)
+    return await getattr(self.bloom_filter, method)(*args)
+
+  async def check(self, password_hash):
+    return await self._read("check", password_hash)
+
+  async def check_many(self, password_hashes, chunk_size=5000):
+    return await self._read("check_many", password_hashes, chunk_size)
+
+  async def stats(self):
+    return await self._read("stats")
+
+  async def check_replica(self, index):
+    """
+    True if the replica answers and is in sync with the primary
+    """
+    try:
+      replica_client = self.replica_clients[index]
+      await replica_client.ping()
+      info = await replica_client.info("replication")
+    except RedisError:
+      return False
+    # a primary listed as a replica has no link of its own and is always current
+    return info.get("role") != "slave" or info.get("master_link_status") == "up"
+
+  async def run_health_checks(self, interval):
+    """
+    background loop for lifespan, takes replicas out of and back into rotation
+    """
+    while True:
+      try:
+        results = await asyncio.gather(*(self.check_replica(index) for index in range(len(self.readers))))
+        for index, healthy in enumerate(results):
+          self._mark(index, healthy)
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        logger.warning(f"Replica health check failed: {e}")
+      await asyncio.sleep(interval)
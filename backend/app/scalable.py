@@ -0,0 +1,342 @@
+import math
+
+from app.BloomFilter import BloomFilter, AsyncBloomFilter
+from app.stats import combine_stats, RECONCILE_CHUNK_BYTES
+
+# opens the next generation in one step, KEYS[1] = meta hash, ARGV[1] = grown:{active}
+# the HSETNX on grown:{active} is the lock, only the caller that wins it bumps the
+# count (a fresh meta hash has no generations field, which means 1). returns
+# {1 if this caller opened it, generation count}
+GROW_SCRIPT = """
+if redis.call('HSETNX', KEYS[1], ARGV[1], 1) == 1 then
+  redis.call('HSETNX', KEYS[1], 'generations', 1)
+  return {1, redis.call('HINCRBY', KEYS[1], 'generations', 1)}
+end
+return {0, tonumber(redis.call('HGET', KEYS[1], 'generations') or 1)}
+"""
+
+
+class ScalableBloomFilter:
+  """
+  scalable bloom filter (Almeida et al. 2007): a chain of generations that grows
+  instead of letting the false positive rate drift up past fp_rate
+
+  generation g is a normal filter at bloom:passwords:{g} sized for
+  expected_items * growth^g items at fp_rate * (1 - tightening) * tightening^g,
+  so however many generations get added the compound rate stays under fp_rate.
+  adds go to the newest generation, and the ones that set at least one new bit
+  bump its item count in the bloom:passwords:meta hash (so loading the same corpus
+  twice doesn't count it twice). once that passes the generation's capacity the
+  next one is opened. checks queue every generation into one pipeline
+
+  the meta hash also holds the generation count, every pipeline reads it so
+  workers pick up a new generation on their next round-trip
+  """
+
+  filter_class = BloomFilter
+
+  def __init__(self, redis_client, expected_items=1_000_000, fp_rate=0.001, growth=2, tightening=0.5, filter_class=None, **filter_kwargs):
+    self.redis_client = redis_client
+    self.expected_items = expected_items
+    self.fp_rate = fp_rate
+    self.growth = growth
+    self.tightening = tightening
+
+    self._filter_class = filter_class or self.filter_class
+    self._filter_kwargs = filter_kwargs
+    self.generations = []
+    self._redis_key = "bloom:passwords"
+    self._sync_generations(1)
+
+  @property
+  def redis_key(self):
+    return self._redis_key
+
+  @redis_key.setter
+  def redis_key(self, redis_key):
+    # main.py sets redis_key after construction, keep the generation keys in step
+    self._redis_key = redis_key
+    for g, generation in enumerate(self.generations):
+      generation.redis_key = f"{redis_key}:{g}"
+
+  @property
+  def meta_key(self):
+    return f"{self._redis_key}:meta"
+
+  @property
+  def bit_size(self):
+    return sum(generation.bit_size for generation in self.generations)
+
+  @property
+  def num_hashes(self):
+    return self.generations[-1].num_hashes
+
+  @property
+  def capacity(self):
+    return sum(generation.expected_items for generation in self.generations)
+
+  def _sync_generations(self, count):
+    """
+    open generations locally up to count (the count stored in redis), never shrinks
+    """
+    count = int(count or 1)
+    while len(self.generations) < count:
+      g = len(self.generations)
+      generation = self._filter_class(
+        self.redis_client,
+        expected_items=int(self.expected_items * self.growth ** g),
+        fp_rate=self.fp_rate * (1 - self.tightening) * self.tightening ** g,
+        **self._filter_kwargs
+      )
+      generation.redis_key = f"{self._redis_key}:{g}"
+      self.generations.append(generation)
+
+  def _queue_checks(self, pipe, items):
+    """
+    HGET the generation count, then every generation's check for every item,
+    returns per item a list of (generation, _queue_check token, reply count)
+    """
+    pipe.hget(self.meta_key, "generations")
+    queued = []
+    for item in items:
+      item_queued = []
+      for generation in self.generations:
+        before = len(pipe)
+        token = generation._queue_check(pipe, generation._get_bit_positions(item))
+        item_queued.append((generation, token, len(pipe) - before))
+      queued.append(item_queued)
+    return queued
+
+  def _split_checks(self, replies, queued):
+    """
+    -> (result per item, generation count redis reported)
+    """
+    results = []
+    offset = 1
+    for item_queued in queued:
+      found = False
+      for generation, token, count in item_queued:
+        found = generation._split_results(replies[offset:offset + count], [token])[0] or found
+        offset += count
+      results.append(found)
+    return results, int(replies[0] or 1)
+
+  def _queue_adds(self, pipe, items):
+    """
+    HGET the generation count, then the adds to the newest generation.
+    returns the active generation and the reply count of every add
+    """
+    active = len(self.generations) - 1
+    generation = self.generations[active]
+    pipe.hget(self.meta_key, "generations")
+    return active, [generation._queue_add(pipe, generation._get_bit_positions(item)) for item in items]
+
+  def _newly_set(self, replies, active, reply_counts):
+    # the adds' replies come after the HGET
+    return self.generations[active]._split_added(replies[1:], reply_counts)
+
+  def _queue_recorded(self, pipe, active, newly_set):
+    """
+    the generation's /stats totals and its item count in the meta hash, both only
+    for adds that flipped a bit. the HINCRBY reply (last) is the new item count
+    """
+    self.generations[active]._queue_stats(pipe, newly_set)
+    pipe.hincrby(self.meta_key, f"items:{active}", sum(1 for bits in newly_set if bits))
+
+  def _record_added(self, active, newly_set):
+    """
+    the active generation's item count after these adds, None if they were all
+    already in the filter (nothing is written then)
+    """
+    if any(newly_set):
+      replies, _ = self._execute(lambda pipe: self._queue_recorded(pipe, active, newly_set), transaction=False)
+      return replies[-1]
+    return None
+
+  def _needs_growth(self, generations, items, active):
+    """
+    the active generation is full and nobody else has opened the next one yet
+    """
+    return int(generations or 1) == active + 1 and items >= self.generations[active].expected_items
+
+  def _remaining_capacity(self, items_added):
+    return max(1, self.generations[-1].expected_items - items_added)
+
+  def _execute(self, queue, transaction=True):
+    # every generation is on the same client and uses the same scripts, so the first
+    # one's pipeline and NoScriptError retry serve for the whole chain. in the async
+    # class this hands back the generation's coroutine
+    return self.generations[0]._execute(queue, transaction)
+
+  def load_generations(self):
+    """
+    pick up generations other workers opened, checks and adds also do this as they go
+    """
+    self._sync_generations(self.redis_client.hget(self.meta_key, "generations"))
+
+  def _stored_items(self):
+    """
+    items already in the active generation, add_many sizes its first chunk from this
+    """
+    self.load_generations()
+    return int(self.redis_client.hget(self.meta_key, f"items:{len(self.generations) - 1}") or 0)
+
+  def allocate(self):
+    # later generations are allocated by whoever opens them, see _grow
+    for generation in self.generations:
+      generation.allocate()
+
+  def load_scripts(self):
+    # every generation uses the same two scripts on the same server
+    self.generations[0].load_scripts()
+
+  def count_bits(self):
+    return sum(generation.count_bits() for generation in self.generations)
+
+  def _combine_stats(self, generation_stats):
+    # an item is a false positive if any generation says yes
+    return combine_stats(
+      generation_stats,
+      1 - math.prod(1 - stats["false_positive_rate"] for stats in generation_stats)
+    )
+
+  def stats(self):
+    return self._combine_stats([generation.stats() for generation in self.generations])
+
+  def reconcile_stats(self, chunk_bytes=RECONCILE_CHUNK_BYTES):
+    return sum(generation.reconcile_stats(chunk_bytes) for generation in self.generations)
+
+  def _grow(self, active):
+    """
+    open generation active + 1 with GROW_SCRIPT, only the worker that opened it
+    allocates it, everyone else just picks up the new count
+    """
+    opened, generations = self.redis_client.eval(GROW_SCRIPT, 1, self.meta_key, f"grown:{active}")
+    self._sync_generations(generations)
+    if opened:
+      self.generations[-1].allocate()
+
+  def add(self, password_hash):
+    self.add_many([password_hash])
+
+  def add_many(self, password_hashes, chunk_size=5000):
+    """
+    chunks never run past the active generation's remaining capacity, so a bulk
+    load opens new generations at the right point instead of overfilling one.
+    the first chunk is sized from the stored count, a single item always fits
+    """
+    start = 0
+    items_added = self._stored_items() if len(password_hashes) > 1 else 0
+    while start < len(password_hashes):
+      chunk = password_hashes[start:start + min(chunk_size, self._remaining_capacity(items_added))]
+      replies, (active, reply_counts) = self._execute(lambda pipe: self._queue_adds(pipe, chunk))
+      items = self._record_added(active, self._newly_set(replies, active, reply_counts))
+      if items is not None:
+        items_added = items
+      if items is not None and self._needs_growth(replies[0], items, active):
+        self._grow(active)
+      else:
+        self._sync_generations(replies[0])
+      if len(self.generations) - 1 != active:
+        items_added = self._stored_items()
+      start += len(chunk)
+
+  def check(self, password_hash):
+    return self.check_many([password_hash])[0]
+
+  def check_many(self, password_hashes, chunk_size=5000):
+    results = []
+    for start in range(0, len(password_hashes), chunk_size):
+      chunk = password_hashes[start:start + chunk_size]
+      replies, queued = self._execute(lambda pipe: self._queue_checks(pipe, chunk), transaction=False)
+      chunk_results, generations = self._split_checks(replies, queued)
+
+      # another worker opened a generation we didn't check, misses get a second look
+      if generations > len(self.generations):
+        self._sync_generations(generations)
+        misses = [i for i, found in enumerate(chunk_results) if not found]
+        for i, found in zip(misses, self.check_many([chunk[i] for i in misses], chunk_size)):
+          chunk_results[i] = found
+      results.extend(chunk_results)
+    return results
+
+
+class AsyncScalableBloomFilter(ScalableBloomFilter):
+  """
+  scalable filter on a redis.asyncio client, same queueing, awaited round-trips
+  """
+
+  filter_class = AsyncBloomFilter
+
+  async def load_generations(self):
+    self._sync_generations(await self.redis_client.hget(self.meta_key, "generations"))
+
+  async def allocate(self):
+    for generation in self.generations:
+      await generation.allocate()
+
+  async def _stored_items(self):
+    await self.load_generations()
+    return int(await self.redis_client.hget(self.meta_key, f"items:{len(self.generations) - 1}") or 0)
+
+  async def load_scripts(self):
+    await self.generations[0].load_scripts()
+
+  async def count_bits(self):
+    return sum([await generation.count_bits() for generation in self.generations])
+
+  async def stats(self):
+    return self._combine_stats([await generation.stats() for generation in self.generations])
+
+  async def reconcile_stats(self, chunk_bytes=RECONCILE_CHUNK_BYTES):
+    return sum([await generation.reconcile_stats(chunk_bytes) for generation in self.generations])
+
+  async def _record_added(self, active, newly_set):
+    if any(newly_set):
+      replies, _ = await self._execute(lambda pipe: self._queue_recorded(pipe, active, newly_set), transaction=False)
+      return replies[-1]
+    return None
+
+  async def _grow(self, active):
+    opened, generations = await self.redis_client.eval(GROW_SCRIPT, 1, self.meta_key, f"grown:{active}")
+    self._sync_generations(generations)
+    if opened:
+      await self.generations[-1].allocate()
+
+  async def add(self, password_hash):
+    await self.add_many([password_hash])
+
+  async def add_many(self, password_hashes, chunk_size=5000):
+    start = 0
+    items_added = await self._stored_items() if len(password_hashes) > 1 else 0
+    while start < len(password_hashes):
+      chunk = password_hashes[start:start + min(chunk_size, self._remaining_capacity(items_added))]
+      replies, (active, reply_counts) = await self._execute(lambda pipe: self._queue_adds(pipe, chunk))
+      items = await self._record_added(active, self._newly_set(replies, active, reply_counts))
+      if items is not None:
+        items_added = items
+      if items is not None and self._needs_growth(replies[0], items, active):
+        await self._grow(active)
+      else:
+        self._sync_generations(replies[0])
+      if len(self.generations) - 1 != active:
+        items_added = await self._stored_items()
+      start += len(chunk)
+
+  async def check(self, password_hash):
+    return (await self.check_many([password_hash]))[0]
+
+  async def check_many(self, password_hashes, chunk_size=5000):
+    results = []
+    for start in range(0, len(password_hashes), chunk_size):
+      chunk = password_hashes[start:start + chunk_size]
+      replies, queued = await self._execute(lambda pipe: self._queue_checks(pipe, chunk), transaction=False)
+      chunk_results, generations = self._split_checks(replies, queued)
+
+      if generations > len(self.generations):
+        self._sync_generations(generations)
+        misses = [i for i, found in enumerate(chunk_results) if not found]
+        for i, found in zip(misses, await self.check_many([chunk[i] for i in misses], chunk_size)):
+          chunk_results[i] = found
+      results.extend(chunk_results)
+    return results
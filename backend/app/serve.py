@@ -0,0 +1,87 @@
+"""
+Run the API with API_WORKERS uvicorn worker processes.
+
+    python -m app.serve
+
+This is what the Docker image runs. Every worker is a separate process with its
+own event loop and its own Redis pools. REDIS_MAX_CONNECTIONS is split between
+the workers (Settings.redis_worker_connections), so adding workers doesn't add
+Redis connections.
+
+With BLOOM_SNAPSHOT_PATH set, every worker maps the same file read-only, so
+the bitmap is in memory once however many workers there are. Set
+BLOOM_SNAPSHOT_EXPORT=true to write that file from Redis before the workers
+start, so a deploy always serves the filter as it is at startup.
+
+With more than one worker, PROMETHEUS_MULTIPROC_DIR (a temp dir if unset) is
+where every worker writes its metrics, so /metrics reports all of them.
+
+With API_UDS set the workers listen on that Unix domain socket instead of
+API_HOST:API_PORT, for callers on the same host (see app.binary).
+"""
+import logging
+
+import uvicorn
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def export_shared_snapshot():
+    """Write BLOOM_SNAPSHOT_PATH from the live filter in Redis, for the workers to map"""
+    from app.ingest import make_filter, connect
+    from app.snapshot import export_snapshot
+
+    bloom_filter = make_filter(connect())
+    checksum = export_snapshot(bloom_filter, settings.bloom_snapshot_path)
+    logger.info(f"Exported {bloom_filter.redis_key} to {settings.bloom_snapshot_path} (crc32 {checksum:#010x})")
+
+
+def main():
+    logging.basicConfig(
+        level=logging.DEBUG if settings.debug else logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+
+    if settings.bloom_snapshot_export:
+        if not settings.bloom_snapshot_path:
+            raise Exception("BLOOM_SNAPSHOT_EXPORT needs BLOOM_SNAPSHOT_PATH to export to")
+        # Before the workers start, they open the file in their lifespan
+        export_shared_snapshot()
+
+    if settings.api_workers > 1 and settings.bloom_local_replica:
+        logger.warning(
+            f"BLOOM_LOCAL_REPLICA keeps a private copy of the bitmap in each of the {settings.api_workers} workers, "
+            "use BLOOM_SNAPSHOT_PATH to share one"
+        )
+
+    if settings.api_workers > 1 and settings.bloom_storage == "memory":
+        logger.warning(
+            f"BLOOM_STORAGE=memory keeps a separate bitmap in each of the {settings.api_workers} workers, "
+            "an add only reaches the worker that took it, use BLOOM_STORAGE=mmap to share one"
+        )
+
+    if settings.api_workers > 1:
+        from app.metrics import prepare_multiprocess_dir
+
+        # Workers are spawned with this environment, so they all write to the same directory
+        logger.info(f"Collecting metrics from every worker in {prepare_multiprocess_dir()}")
+
+    listen = settings.api_uds or f"{settings.api_host}:{settings.api_port}"
+    logger.info(f"Starting {settings.api_workers} worker(s) on {listen}, "
+                f"{settings.redis_worker_connections} Redis connection(s) each")
+    # Workers are spawned with this environment, so they see the same settings
+    uvicorn.run(
+        "app.main:app",
+        host=settings.api_host,
+        port=settings.api_port,
+        uds=settings.api_uds,
+        workers=settings.api_workers,
+        access_log=settings.api_access_log,
+        log_level="debug" if settings.debug else "info",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import asyncio
+import mmh3
+
+from app.BloomFilter import BloomFilter, AsyncBloomFilter, HASH_SCHEME_DIGEST, _digest_bytes
+from app.stats import combine_stats, RECONCILE_CHUNK_BYTES
+
+# a redis string tops out at 512MB, so no single bitmap key can go past 2^32 bits
+MAX_REDIS_BITS = 2**32
+
+
+class ShardedBloomFilter:
+  """
+  splits the filter over num_shards independent bitmaps, bloom:passwords:{0} .. {N-1}
+
+  each item is routed by one extra hash (seed 2, independent of the position hashes)
+  to exactly one shard, and all k of its positions live inside that shard. so a check
+  is still a single round-trip, just to whichever node holds the shard. the {i} hash
+  tag puts each shard on its own slot in redis cluster
+
+  redis_clients can be one client (all shards on one server) or one per node, shards
+  are spread over them round-robin. any BloomFilter subclass works as the shard type
+  """
+
+  filter_class = BloomFilter
+
+  def __init__(self, redis_clients, num_shards, expected_items=1_000_000, fp_rate=0.001, filter_class=None, **filter_kwargs):
+    if not isinstance(redis_clients, (list, tuple)):
+      redis_clients = [redis_clients]
+
+    self.num_shards = num_shards
+    self.expected_items = expected_items
+    self.fp_rate = fp_rate
+
+    # every shard is sized for its share of the items at the same fp rate
+    filter_class = filter_class or self.filter_class
+    shard_items = -(-expected_items // num_shards)
+    self.shards = [
+      filter_class(redis_clients[i % len(redis_clients)], expected_items=shard_items, fp_rate=fp_rate, **filter_kwargs)
+      for i in range(num_shards)
+    ]
+    self.redis_key = "bloom:passwords"
+
+  @property
+  def redis_key(self):
+    return self._redis_key
+
+  @redis_key.setter
+  def redis_key(self, redis_key):
+    # main.py sets redis_key after construction, keep the shard keys in step
+    self._redis_key = redis_key
+    for i, shard in enumerate(self.shards):
+      shard.redis_key = f"{redis_key}:{{{i}}}"
+
+  @property
+  def bit_size(self):
+    return sum(shard.bit_size for shard in self.shards)
+
+  @property
+  def num_hashes(self):
+    return self.shards[0].num_hashes
+
+  @property
+  def shard_bit_size(self):
+    return self.shards[0].bit_size
+
+  def _shard_for(self, item:str):
+    """
+    with the digest hash scheme bytes 16-20 of the digest (not used for positions) pick the shard
+    """
+    if self.shards[0].hash_scheme == HASH_SCHEME_DIGEST:
+      return int.from_bytes(_digest_bytes(item)[16:20], "little") % self.num_shards
+    item = self.shards[0]._hash_input(item)
+    return mmh3.hash(item, seed=2, signed=False) % self.num_shards
+
+  def _group_by_shard(self, items):
+    """
+    {shard index: (input indexes, items)} so results can be put back in input order
+    """
+    groups = {}
+    for index, item in enumerate(items):
+      indexes, shard_items = groups.setdefault(self._shard_for(item), ([], []))
+      indexes.append(index)
+      shard_items.append(item)
+    return groups
+
+  def allocate(self):
+    for shard in self.shards:
+      shard.allocate()
+
+  def load_scripts(self):
+    for shard in self.shards:
+      shard.load_scripts()
+
+  def count_bits(self):
+    return sum(shard.count_bits() for shard in self.shards)
+
+  def _combine_stats(self, shard_stats):
+    # items are spread evenly, so a random item's chance of a false positive is the shards' average
+    return combine_stats(shard_stats, sum(stats["false_positive_rate"] for stats in shard_stats) / len(shard_stats))
+
+  def stats(self):
+    return self._combine_stats([shard.stats() for shard in self.shards])
+
+  def reconcile_stats(self, chunk_bytes=RECONCILE_CHUNK_BYTES):
+    return sum(shard.reconcile_stats(chunk_bytes) for shard in self.shards)
+
+  def add(self, password_hash):
+    self.shards[self._shard_for(password_hash)].add(password_hash)
+
+  def add_many(self, password_hashes, chunk_size=5000):
+    for shard, (_, items) in self._group_by_shard(password_hashes).items():
+      self.shards[shard].add_many(items, chunk_size)
+
+  def check(self, password_hash):
+    return self.shards[self._shard_for(password_hash)].check(password_hash)
+
+  def check_many(self, password_hashes, chunk_size=5000):
+    results = [False] * len(password_hashes)
+    for shard, (indexes, items) in self._group_by_shard(password_hashes).items():
+      for index, result in zip(indexes, self.shards[shard].check_many(items, chunk_size)):
+        results[index] = result
+    return results
+
+
+class AsyncShardedBloomFilter(ShardedBloomFilter):
+  """
+  sharded filter on redis.asyncio clients, batches hit all the shards concurrently
+  """
+
+  filter_class = AsyncBloomFilter
+
+  async def allocate(self):
+    await asyncio.gather(*(shard.allocate() for shard in self.shards))
+
+  async def load_scripts(self):
+    await asyncio.gather(*(shard.load_scripts() for shard in self.shards))
+
+  async def count_bits(self):
+    return sum(await asyncio.gather(*(shard.count_bits() for shard in self.shards)))
+
+  async def stats(self):
+    return self._combine_stats(await asyncio.gather(*(shard.stats() for shard in self.shards)))
+
+  async def reconcile_stats(self, chunk_bytes=RECONCILE_CHUNK_BYTES):
+    return sum(await asyncio.gather(*(shard.reconcile_stats(chunk_bytes) for shard in self.shards)))
+
+  async def add(self, password_hash):
+    await self.shards[self._shard_for(password_hash)].add(password_hash)
+
+  async def add_many(self, password_hashes, chunk_size=5000):
+    groups = self._group_by_shard(password_hashes)
+    await asyncio.gather(*(self.shards[shard].add_many(items, chunk_size) for shard, (_, items) in groups.items()))
+
+  async def check(self, password_hash):
+    return await self.shards[self._shard_for(password_hash)].check(password_hash)
+
+  async def check_many(self, password_hashes, chunk_size=5000):
+    groups = self._group_by_shard(password_hashes)
+    shard_results = await asyncio.gather(
+      *(self.shards[shard].check_many(items, chunk_size) for shard, (_, items) in groups.items())
+    )
+
+    results = [False] * len(password_hashes)
+    for (indexes, _), shard_result in zip(groups.values(), shard_results):
+      for index, result in zip(indexes, shard_result):
+        results[index] = result
+    return results
@@ -0,0 +1,303 @@
+"""
+one filter's bitmap in a file, so it can be copied around, used to seed a fresh
+redis (or another region) with a few big writes, or served straight from disk
+
+    python -m app.snapshot export bloom.snap
+    python -m app.snapshot import bloom.snap
+    python -m app.snapshot info bloom.snap
+
+file layout, little endian:
+
+  0   8s  magic b"BLOOMSNP"
+  8   H   format version
+  10  B   layout, 0 standard / 1 blocked
+  11  B   hash scheme, see HASH_SCHEMES in app.BloomFilter
+  12  I   num_hashes
+  16  Q   bit_size
+  24  Q   expected_items
+  32  d   fp_rate
+  40  I   crc32 of the bits
+  44      zero padding
+  64      the bits, the same MSB-first bytes as the redis string (see app.bitmap)
+
+the header is padded to 64 bytes so the bits start on a cache line boundary
+"""
+import argparse
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+from app.BloomFilter import BloomFilter, AsyncBloomFilter, BlockedBloomFilter, HASH_SCHEMES
+from app.bitmap import bitmap_bytes, all_bits_set, count_set_bits
+from app.cache import publish_invalidation
+from app.metrics import POSITIONS_SECONDS
+from app.stats import filter_stats, RECONCILE_CHUNK_BYTES
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"BLOOMSNP"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sHBBIQQdI20x")
+
+LAYOUT_STANDARD = 0
+LAYOUT_BLOCKED = 1
+
+
+def filter_layout(bloom_filter):
+  """
+  layout code for a filter, snapshots only cover a single bitmap
+  """
+  if not isinstance(bloom_filter, BloomFilter):
+    raise ValueError(f"Snapshots hold a single bitmap, {type(bloom_filter).__name__} can't be snapshotted")
+  return LAYOUT_BLOCKED if isinstance(bloom_filter, BlockedBloomFilter) else LAYOUT_STANDARD
+
+
+class Snapshot:
+  """
+  an open snapshot file, mapped read-only
+
+  bits is a memoryview straight onto the mapping, so opening even a multi GB file
+  copies nothing. pages are read in by the OS as checks touch them, and every
+  process mapping the same file shares them in the page cache
+  """
+
+  def __init__(self, path, verify=True):
+    self.path = path
+    with open(path, "rb") as f:
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(self._mmap) < HEADER.size:
+      self._mmap.close()
+      raise ValueError(f"{path} is too short to be a filter snapshot")
+    (magic, version, self.layout, self.hash_scheme, self.num_hashes, self.bit_size,
+     self.expected_items, self.fp_rate, self.checksum) = HEADER.unpack_from(self._mmap)
+
+    try:
+      if magic != MAGIC:
+        raise ValueError(f"{path} is not a filter snapshot")
+      if version != FORMAT_VERSION:
+        raise ValueError(f"{path} is snapshot format version {version}, this build reads version {FORMAT_VERSION}")
+      if self.layout not in (LAYOUT_STANDARD, LAYOUT_BLOCKED) or self.hash_scheme not in HASH_SCHEMES:
+        raise ValueError(f"{path} has an unknown layout ({self.layout}) or hash scheme ({self.hash_scheme})")
+      if len(self._mmap) != HEADER.size + bitmap_bytes(self.bit_size):
+        raise ValueError(f"{path} should hold {bitmap_bytes(self.bit_size):,} bytes of bits, it is truncated or padded")
+    except ValueError:
+      self._mmap.close()
+      raise
+
+    self.bits = memoryview(self._mmap)[HEADER.size:]
+    if verify:
+      self.verify()
+
+  def verify(self, chunk_bytes=4 * 1024 * 1024):
+    """
+    crc32 the bits against the header, reads the whole file once
+    """
+    checksum = 0
+    for start in range(0, len(self.bits), chunk_bytes):
+      checksum = zlib.crc32(self.bits[start:start + chunk_bytes], checksum)
+    if checksum != self.checksum:
+      raise ValueError(f"{self.path} is corrupt, checksum {checksum:#010x} != {self.checksum:#010x} in the header")
+
+  def chunks(self, chunk_bytes):
+    """
+    (offset, bytes) over the bits, the shape build.upload_and_swap takes
+    """
+    for start in range(0, len(self.bits), chunk_bytes):
+      yield start, bytes(self.bits[start:start + chunk_bytes])
+
+  def check_compatible(self, bloom_filter):
+    """
+    raise unless bloom_filter would put every item at the same bits this snapshot did
+    """
+    expected = (filter_layout(bloom_filter), bloom_filter.hash_scheme, bloom_filter.num_hashes, bloom_filter.bit_size)
+    found = (self.layout, self.hash_scheme, self.num_hashes, self.bit_size)
+    if expected != found:
+      raise ValueError(
+        f"{self.path} was written as (layout, hash scheme, hashes, bits) = {found}, "
+        f"the filter is {expected}"
+      )
+
+  def close(self):
+    self.bits.release()
+    self._mmap.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+def write_snapshot(path, bloom_filter, chunks):
+  """
+  write the header and then chunks (byte strings, in order) as the bits
+
+  the checksum is only known at the end, so the header goes in twice. the file is
+  written next to path and renamed over it, readers never see half a snapshot
+  """
+  layout = filter_layout(bloom_filter)
+  size = bitmap_bytes(bloom_filter.bit_size)
+  tmp_path = f"{path}.tmp"
+
+  checksum = 0
+  written = 0
+  with open(tmp_path, "wb") as f:
+    f.write(bytes(HEADER.size))
+    for chunk in chunks:
+      f.write(chunk)
+      checksum = zlib.crc32(chunk, checksum)
+      written += len(chunk)
+    if written != size:
+      raise ValueError(f"Got {written:,} bytes of bits, a {bloom_filter.bit_size:,} bit filter needs {size:,}")
+
+    f.seek(0)
+    f.write(HEADER.pack(
+      MAGIC, FORMAT_VERSION, layout, bloom_filter.hash_scheme, bloom_filter.num_hashes,
+      bloom_filter.bit_size, bloom_filter.expected_items, bloom_filter.fp_rate, checksum
+    ))
+  os.replace(tmp_path, path)
+  return checksum
+
+
+def _redis_chunks(bloom_filter, chunk_bytes):
+  """
+  GETRANGE the bitmap in chunks, zero filling past the end of the redis string
+  """
+  size = bitmap_bytes(bloom_filter.bit_size)
+  for start in range(0, size, chunk_bytes):
+    end = min(start + chunk_bytes, size)
+    chunk = bloom_filter.redis_client.getrange(bloom_filter.redis_key, start, end - 1)
+    # redis only stores the string up to the highest bit ever set
+    yield chunk.ljust(end - start, b"\x00")
+
+
+def export_snapshot(bloom_filter, path, chunk_bytes=4 * 1024 * 1024):
+  """
+  copy the filter's bitmap out of redis into a snapshot file, returns the checksum
+
+  bits set while the export runs may or may not make it in, same as any GETRANGE copy
+  """
+  return write_snapshot(path, bloom_filter, _redis_chunks(bloom_filter, chunk_bytes))
+
+
+def import_snapshot(path, bloom_filter, chunk_bytes=4 * 1024 * 1024):
+  """
+  seed bloom_filter's redis key from a snapshot: SETRANGE into a staging key, then RENAME
+
+  the snapshot has to match the filter's sizing, otherwise checks would look at the wrong bits
+  """
+  # app.build pulls in the ingest CLI and its settings, only needed here
+  from app.build import upload_and_swap
+
+  with Snapshot(path) as snapshot:
+    snapshot.check_compatible(bloom_filter)
+    upload_and_swap(bloom_filter, snapshot.chunks(chunk_bytes), len(snapshot.bits))
+
+
+class SnapshotBloomFilter(AsyncBloomFilter):
+  """
+  answers checks straight from a mapped snapshot file, no redis and no copy
+
+  the sizing comes from the header rather than from expected_items/fp_rate, so the
+  positions always match the bits that were written. the file is mapped read-only,
+  adds have to go to redis and reach this process as a new snapshot
+  """
+
+  def __init__(self, snapshot, **kwargs):
+    super().__init__(
+      None,
+      expected_items=snapshot.expected_items,
+      fp_rate=snapshot.fp_rate,
+      hash_scheme=snapshot.hash_scheme,
+      **kwargs
+    )
+    self.bit_size = snapshot.bit_size
+    self.num_hashes = snapshot.num_hashes
+    self.snapshot = snapshot
+    self.bitmap = snapshot.bits
+    self._bits_set = None
+
+  async def load_scripts(self):
+    # nothing runs inside redis
+    pass
+
+  async def count_bits(self):
+    return count_set_bits(self.bitmap)
+
+  async def stats(self):
+    # the file never changes, so one count lasts as long as it's mapped
+    if self._bits_set is None:
+      await self.reconcile_stats()
+    return filter_stats(self.bit_size, self.num_hashes, self._bits_set, None)
+
+  async def reconcile_stats(self, chunk_bytes=RECONCILE_CHUNK_BYTES):
+    self._bits_set = count_set_bits(self.bitmap, chunk_bytes)
+    return self._bits_set
+
+  async def add(self, password_hash):
+    raise Exception(f"Filter is served from the read-only snapshot {self.snapshot.path}")
+
+  async def add_many(self, password_hashes, chunk_size=5000):
+    raise Exception(f"Filter is served from the read-only snapshot {self.snapshot.path}")
+
+  async def check(self, password_hash):
+    with POSITIONS_SECONDS.time():
+      positions = self._get_bit_positions(password_hash)
+    return all_bits_set(self.bitmap, positions)
+
+  async def check_many(self, password_hashes, chunk_size=5000):
+    with POSITIONS_SECONDS.time():
+      positions = self._get_bit_positions_many(password_hashes)
+    return [all_bits_set(self.bitmap, item_positions) for item_positions in positions]
+
+
+class SnapshotBlockedBloomFilter(SnapshotBloomFilter, BlockedBloomFilter):
+  """
+  blocked layout served from a snapshot file
+  """
+
+
+def open_snapshot_filter(path, verify=True):
+  """
+  map path and wrap it in the filter class its layout needs
+  """
+  snapshot = Snapshot(path, verify=verify)
+  filter_class = SnapshotBlockedBloomFilter if snapshot.layout == LAYOUT_BLOCKED else SnapshotBloomFilter
+  return filter_class(snapshot)
+
+
+def main(argv=None):
+  # the CLI works on the filter the API is configured for
+  from app.ingest import make_filter, connect
+
+  parser = argparse.ArgumentParser(prog="python -m app.snapshot", description="Export, import or inspect a filter snapshot file")
+  parser.add_argument("command", choices=["export", "import", "info"])
+  parser.add_argument("path", help="snapshot file")
+  parser.add_argument("--chunk-bytes", type=int, default=4 * 1024 * 1024, help="bytes per GETRANGE/SETRANGE")
+  args = parser.parse_args(argv)
+
+  logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+  if args.command == "info":
+    with Snapshot(args.path) as snapshot:
+      layout = "blocked" if snapshot.layout == LAYOUT_BLOCKED else "standard"
+      print(f"{args.path}: {layout} layout, hash scheme {snapshot.hash_scheme}, {snapshot.bit_size:,} bits, "
+            f"{snapshot.num_hashes} hashes, sized for {snapshot.expected_items:,} items at {snapshot.fp_rate}, "
+            f"{count_set_bits(snapshot.bits):,} bits set, crc32 {snapshot.checksum:#010x}")
+    return
+
+  bloom_filter = make_filter(connect())
+  if args.command == "export":
+    checksum = export_snapshot(bloom_filter, args.path, args.chunk_bytes)
+    logger.info(f"Exported {bloom_filter.redis_key} to {args.path} (crc32 {checksum:#010x})")
+  else:
+    import_snapshot(args.path, bloom_filter, args.chunk_bytes)
+    publish_invalidation(bloom_filter.redis_client, bloom_filter.redis_key)
+    logger.info(f"Imported {args.path} into {bloom_filter.redis_key}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,83 @@
+"""
+running totals for /stats, so serving it never means a BITCOUNT over the whole bitmap
+
+every add HINCRBYs <redis_key>:stats with the bits it flipped from 0 (SETBIT
+and BITFIELD already hand back the old bits, the add script returns the count)
+and, if it flipped any, one item. adds that flip nothing are duplicates or false
+positives, so items is only approximate. estimated_items is worked out from the
+fill ratio instead and doesn't depend on every writer counting
+
+bits_set drifts if something writes the bitmap without going through add (an
+older build, a lost HINCRBY after a failed round-trip), so a background pass
+recounts it with BITCOUNT one byte range at a time
+"""
+import asyncio
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_CHUNK_BYTES = 1024 * 1024
+
+
+def stats_key(redis_key):
+  return f"{redis_key}:stats"
+
+
+def estimate_items(bit_size, num_hashes, bits_set):
+  """
+  items a filter with bits_set of bit_size bits holds, n = -(m / k) * ln(1 - X / m)
+  (Swamidass & Baldi 2007). a full bitmap says nothing, it's reported as at least
+  what one bit short of full would be
+  """
+  fill = min(bits_set, bit_size - 1) / bit_size
+  return round(-(bit_size / num_hashes) * math.log(1 - fill))
+
+
+def fill_fp_rate(bit_size, num_hashes, bits_set):
+  """
+  false positive rate right now: a random item hits k bits that are each set with
+  probability X / m. this is what the filter gives today, fp_rate is what it was sized for
+  """
+  return (bits_set / bit_size) ** num_hashes
+
+
+def filter_stats(bit_size, num_hashes, bits_set, items):
+  return {
+    "bits_set": bits_set,
+    "items_added": items,
+    "estimated_items": estimate_items(bit_size, num_hashes, bits_set),
+    "false_positive_rate": fill_fp_rate(bit_size, num_hashes, bits_set),
+  }
+
+
+def combine_stats(parts, false_positive_rate):
+  """
+  totals over shards or generations, false_positive_rate is however theirs combine
+  """
+  items = [part["items_added"] for part in parts]
+  return {
+    "bits_set": sum(part["bits_set"] for part in parts),
+    "items_added": None if None in items else sum(items),
+    "estimated_items": sum(part["estimated_items"] for part in parts),
+    "false_positive_rate": false_positive_rate,
+  }
+
+
+async def run_reconciliation(bloom_filter, redis_client, interval, chunk_bytes=RECONCILE_CHUNK_BYTES):
+  """
+  background loop for lifespan, recounts bits_set every interval seconds starting now
+
+  with several workers only the one that takes the SET NX lock does the pass. the
+  lock expires after interval, so a worker that dies mid pass doesn't stop the others
+  """
+  lock_key = f"{stats_key(bloom_filter.redis_key)}:lock"
+  while True:
+    try:
+      if await redis_client.set(lock_key, 1, nx=True, ex=max(1, math.ceil(interval))):
+        await bloom_filter.reconcile_stats(chunk_bytes)
+    except asyncio.CancelledError:
+      raise
+    except Exception as e:
+      logger.warning(f"Stats reconciliation failed: {e}")
+    await asyncio.sleep(interval)
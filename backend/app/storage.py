@@ -0,0 +1,315 @@
+"""
+where a filter's bits live when they aren't in redis (BLOOM_STORAGE=memory or mmap),
+behind one small interface so the same filter code runs on either engine
+
+  MemoryBitStorage  a bytearray, gone when the process exits
+  MmapBitStorage    a file mapped read-write, so it survives restarts and every
+                    process mapping it shares one copy in the page cache
+
+positions are bit offsets in the redis layout (MSB first, see app.bitmap) so a
+bitmap can move between an engine and a redis string byte for byte. every call
+takes a whole batch
+
+StorageBloomFilter is BloomFilter with the pipeline plumbing swapped for a
+storage engine. BLOOM_STORAGE=redis is BloomFilter itself, its pipelines, scripts,
+changelog and <key>:stats hash are all redis specific, so it doesn't go through here
+"""
+import fcntl
+import mmap
+import os
+from abc import ABC, abstractmethod
+
+from app.BloomFilter import BloomFilter, BlockedBloomFilter, _chunks
+from app.bitmap import bitmap_bytes, get_bit, count_set_bits
+from app.metrics import POSITIONS_SECONDS
+from app.stats import filter_stats, RECONCILE_CHUNK_BYTES
+
+STORAGE_KINDS = ("memory", "mmap")
+
+
+class BitStorage(ABC):
+  """
+  the interface, allocate() once with the filter's size and then batched reads and writes
+  """
+
+  size_bytes = None
+  # other processes write to it too, so a count kept from this process's adds is wrong
+  shared = False
+
+  @abstractmethod
+  def allocate(self, bit_size):
+    """
+    make room for bit_size bits, or raise if this storage already holds a filter of another size
+    """
+
+  @abstractmethod
+  def get_bits(self, positions):
+    """
+    the bit at every position, 0 or 1, in order
+    """
+
+  @abstractmethod
+  def set_bits(self, positions):
+    """
+    set every position to 1, returns what each bit was before (the SETBIT replies)
+    """
+
+  @abstractmethod
+  def count_bits(self, chunk_bytes=RECONCILE_CHUNK_BYTES):
+    """
+    bits set in the whole bitmap, chunk_bytes at a time
+    """
+
+  def flush(self):
+    pass
+
+  def close(self):
+    pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+class LocalBitStorage(BitStorage):
+  """
+  bits in a buffer in this process, memory speed and no round-trips
+  """
+
+  bits = None
+
+  def get_bits(self, positions):
+    return [get_bit(self.bits, pos) for pos in positions]
+
+  def set_bits(self, positions):
+    bits = self.bits
+    old = []
+    for pos in positions:
+      mask = 0x80 >> (pos & 7)
+      old.append(1 if bits[pos >> 3] & mask else 0)
+      bits[pos >> 3] |= mask
+    return old
+
+  def count_bits(self, chunk_bytes=RECONCILE_CHUNK_BYTES):
+    return count_set_bits(self.bits, chunk_bytes)
+
+  def _check_size(self, bit_size, source):
+    if self.size_bytes != bitmap_bytes(bit_size):
+      raise ValueError(
+        f"{source} holds {self.size_bytes:,} bytes of bits, a filter of {bit_size:,} bits needs "
+        f"{bitmap_bytes(bit_size):,}. a filter of another size puts items at other bits"
+      )
+
+
+class MemoryBitStorage(LocalBitStorage):
+  """
+  a bytearray, for tests and for filters that are loaded at startup anyway
+  """
+
+  def __init__(self, bits=None):
+    # bits to start from, e.g. a copy of the redis string
+    self.bits = bytearray(bits) if bits is not None else None
+    self.size_bytes = len(self.bits) if bits is not None else None
+
+  def allocate(self, bit_size):
+    if self.bits is None:
+      self.bits = bytearray(bitmap_bytes(bit_size))
+      self.size_bytes = len(self.bits)
+    self._check_size(bit_size, "The bitmap")
+
+
+class MmapBitStorage(LocalBitStorage):
+  """
+  a file of raw bits mapped read-write, created (sparse, all 0) on first use
+
+  writes go to the page cache and reach the file whenever the OS writes them back,
+  flush() forces that. every process that maps the file sees every add at once.
+  the file is the bare bitmap, the same bytes as GET on the key, so it can be
+  SETRANGEd into redis as is
+
+  setting a bit ORs its byte, a read-modify-write, so two processes adding to the
+  same byte at once would lose one of the bits. set_bits holds an exclusive flock
+  on the file for the whole batch, reads don't take it
+  """
+
+  shared = True
+
+  def __init__(self, path):
+    self.path = path
+    self._mmap = None
+    self._fd = None
+
+  def allocate(self, bit_size):
+    if self._mmap is not None:
+      self._check_size(bit_size, self.path)
+      return
+    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+      self.size_bytes = os.fstat(fd).st_size
+      if not self.size_bytes:
+        os.ftruncate(fd, bitmap_bytes(bit_size))
+        self.size_bytes = bitmap_bytes(bit_size)
+      self._check_size(bit_size, self.path)
+      self._mmap = mmap.mmap(fd, self.size_bytes)
+    except BaseException:
+      os.close(fd)
+      raise
+    # kept open for the writers' lock, the mapping has its own reference to the file
+    self._fd = fd
+    self.bits = self._mmap
+
+  def set_bits(self, positions):
+    fcntl.flock(self._fd, fcntl.LOCK_EX)
+    try:
+      return super().set_bits(positions)
+    finally:
+      fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+  def flush(self):
+    if self._mmap is not None:
+      self._mmap.flush()
+
+  def close(self):
+    if self._mmap is not None:
+      self._mmap.flush()
+      self._mmap.close()
+      self._mmap = self.bits = None
+      os.close(self._fd)
+      self._fd = None
+
+
+def open_storage(kind, path=None):
+  """
+  the engine for BLOOM_STORAGE=memory or mmap, not allocated yet
+  """
+  if kind == "memory":
+    return MemoryBitStorage()
+  if kind == "mmap":
+    if not path:
+      raise ValueError("mmap storage needs a file path (BLOOM_STORAGE_PATH)")
+    return MmapBitStorage(path)
+  raise ValueError(f"Unknown storage {kind}, expected one of {STORAGE_KINDS}")
+
+
+class StorageBloomFilter(BloomFilter):
+  """
+  the filter on a storage engine instead of a redis client
+
+  sizing and positions are BloomFilter's, so a bitmap written here reads the same
+  through BloomFilter and back. on a private bitmap bits_set is counted once and
+  then kept up to date from what set_bits reports. a shared one (mmap) takes adds
+  from every worker, so it's counted again from the bitmap on every stats().
+  items isn't known for a bitmap that outlives the process
+  """
+
+  def __init__(self, storage, **kwargs):
+    super().__init__(None, **kwargs)
+    self.storage = storage
+    self.storage.allocate(self.bit_size)
+    self._bits_set = None
+
+  def allocate(self):
+    # the engine was sized when the filter was made
+    self.storage.allocate(self.bit_size)
+
+  def load_scripts(self):
+    # nothing runs inside redis
+    pass
+
+  def count_bits(self):
+    return self.storage.count_bits()
+
+  def stats(self):
+    if self._bits_set is None or self.storage.shared:
+      self._bits_set = self.storage.count_bits()
+    return filter_stats(self.bit_size, self.num_hashes, self._bits_set, None)
+
+  def reconcile_stats(self, chunk_bytes=RECONCILE_CHUNK_BYTES):
+    self._bits_set = self.storage.count_bits(chunk_bytes)
+    return self._bits_set
+
+  def _set_positions(self, positions):
+    old_bits = self.storage.set_bits([pos for item_positions in positions for pos in item_positions])
+    if self._bits_set is not None:
+      self._bits_set += old_bits.count(0)
+
+  def _get_positions(self, positions):
+    bits = self.storage.get_bits([pos for item_positions in positions for pos in item_positions])
+    return self._split_results(bits, [len(item_positions) for item_positions in positions])
+
+  def add(self, password_hash):
+    with POSITIONS_SECONDS.time():
+      positions = self._get_bit_positions(password_hash)
+    self._set_positions([positions])
+
+  def add_many(self, password_hashes, chunk_size=5000):
+    for chunk in _chunks(password_hashes, chunk_size):
+      with POSITIONS_SECONDS.time():
+        positions = self._get_bit_positions_many(chunk)
+      self._set_positions(positions)
+
+  def check(self, password_hash):
+    with POSITIONS_SECONDS.time():
+      positions = self._get_bit_positions(password_hash)
+    return self._get_positions([positions])[0]
+
+  def check_many(self, password_hashes, chunk_size=5000):
+    results = []
+    for chunk in _chunks(password_hashes, chunk_size):
+      with POSITIONS_SECONDS.time():
+        positions = self._get_bit_positions_many(chunk)
+      results.extend(self._get_positions(positions))
+    return results
+
+  def _split_results(self, bits, reply_counts):
+    # BlockedBloomFilter's version reads GETRANGE blocks, these are always single bits
+    return BloomFilter._split_results(self, bits, reply_counts)
+
+
+class StorageBlockedBloomFilter(StorageBloomFilter, BlockedBloomFilter):
+  """
+  blocked layout on a storage engine, an item's k bits are still in one 64 byte block
+  """
+
+
+class AsyncStorageBloomFilter(StorageBloomFilter):
+  """
+  the interface main.py awaits, for the in-process engines
+
+  memory and mmap calls never wait on the network, so they run right on the event loop
+  """
+
+  async def allocate(self):
+    super().allocate()
+
+  async def load_scripts(self):
+    pass
+
+  async def count_bits(self):
+    return super().count_bits()
+
+  async def stats(self):
+    return super().stats()
+
+  async def reconcile_stats(self, chunk_bytes=RECONCILE_CHUNK_BYTES):
+    return super().reconcile_stats(chunk_bytes)
+
+  async def add(self, password_hash):
+    super().add(password_hash)
+
+  async def add_many(self, password_hashes, chunk_size=5000):
+    super().add_many(password_hashes, chunk_size)
+
+  async def check(self, password_hash):
+    return super().check(password_hash)
+
+  async def check_many(self, password_hashes, chunk_size=5000):
+    return super().check_many(password_hashes, chunk_size)
+
+
+class AsyncStorageBlockedBloomFilter(AsyncStorageBloomFilter, BlockedBloomFilter):
+  """
+  blocked layout on an in-process engine
+  """
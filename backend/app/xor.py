@@ -0,0 +1,526 @@
+"""
+static binary fuse filter (Graf & Lemire 2022) for a breach corpus that never takes adds
+
+    python -m app.xor build rockyou.txt.gz --output corpus.xor --upload
+    python -m app.xor upload corpus.xor
+    python -m app.xor info corpus.xor
+
+a binary fuse filter stores one fingerprint per slot in an array about 1.13x the
+item count. an item is in the set when the xor of its fingerprint and the three
+slots it hashes to is 0, so a check is exactly 3 probes however low the false
+positive rate. with 8 bit fingerprints that's ~9 bits per item at 1/256, with 16
+bit ones ~18 bits at 1/65536. a bloom filter needs ~11.5 and ~23 bits for the same
+rates, and k probes. the catch is it can only be built from the whole set at once,
+so adding a password means building it again
+
+items are the same sha digests the bloom filter takes (hex or raw bytes, either
+hash scheme), the first 8 bytes of the digest are the 64 bit key
+
+file layout, little endian:
+
+  0   8s  magic b"BLOOMXOR"
+  8   H   format version
+  10  B   fingerprint bits, 8 or 16
+  11  B   arity, always 3
+  12  I   segment length
+  16  Q   seed
+  24  Q   items
+  32  I   segment count length
+  36  I   array length (slots)
+  40  I   crc32 of the fingerprints
+  44      zero padding
+  64      the fingerprints, array length slots of fingerprint bits / 8 bytes
+
+the redis string at <BLOOM_REDIS_KEY>:xor holds the same bytes as the file, so a
+check there is 3 GETRANGEs in one pipeline, plus one for the header so a filter
+uploaded while servers run is picked up
+"""
+import argparse
+import logging
+import math
+import mmap
+import os
+import struct
+import time
+import zlib
+from array import array
+
+from app.BloomFilter import _digest_bytes, _chunks
+from app.bitmap import count_set_bits
+from app.metrics import POSITIONS_SECONDS
+from app.stats import filter_stats, RECONCILE_CHUNK_BYTES
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"BLOOMXOR"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sHBBIQQIII20x")
+ARITY = 3
+FINGERPRINT_BITS = (8, 16)
+MAX_SEGMENT_LENGTH = 262144
+MAX_ATTEMPTS = 100
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+def _murmur64(h):
+  """
+  murmur3's 64 bit finalizer, the mixer the reference implementation uses
+  """
+  h ^= h >> 33
+  h = (h * 0xFF51AFD7ED558CCD) & MASK64
+  h ^= h >> 33
+  h = (h * 0xC4CEB9FE1A85EC53) & MASK64
+  return h ^ (h >> 33)
+
+
+def item_key(item):
+  """
+  64 bit key for a digest item, the digest is already uniform so 8 of its bytes do
+  """
+  return int.from_bytes(_digest_bytes(item)[:8], "little")
+
+
+def layout(size):
+  """
+  (segment length, segment count length, array length) for size items, the
+  sizing from the reference binary_fuse allocate(). small sets get proportionally
+  more slack, from ~1.125x up, or peeling would fail too often
+  """
+  size = max(size, 2)
+  segment_length = min(1 << int(math.floor(math.log(size) / math.log(3.33) + 2.25)), MAX_SEGMENT_LENGTH)
+  size_factor = max(1.125, 0.875 + 0.25 * math.log(1_000_000) / math.log(size))
+  capacity = round(size * size_factor)
+  segment_count = max(1, -(-capacity // segment_length) - (ARITY - 1))
+  array_length = (segment_count + ARITY - 1) * segment_length
+  return segment_length, segment_count * segment_length, array_length
+
+
+class BinaryFuseFilter:
+  """
+  the filter itself, fingerprints in any buffer (bytearray after a build, a
+  mapped file, or nothing at all when the slots live in redis)
+  """
+
+  def __init__(self, fingerprint_bits, seed, items, segment_length, segment_count_length, array_length, fingerprints=None):
+    if fingerprint_bits not in FINGERPRINT_BITS:
+      raise ValueError(f"Fingerprints must be one of {FINGERPRINT_BITS} bits, not {fingerprint_bits}")
+    self.fingerprint_bits = fingerprint_bits
+    self.fingerprint_bytes = fingerprint_bits // 8
+    self.fingerprint_mask = (1 << fingerprint_bits) - 1
+    self.seed = seed
+    self.items = items
+    self.segment_length = segment_length
+    self.segment_length_mask = segment_length - 1
+    self.segment_count_length = segment_count_length
+    self.array_length = array_length
+    self.fingerprints = fingerprints
+
+  @classmethod
+  def build(cls, keys, fingerprint_bits=8, seed=0x726F636B796F75):
+    """
+    build from 64 bit keys (see item_key), duplicates are dropped first
+
+    peeling: every slot tracks how many keys hash to it and the xor of their
+    hashes. a slot with a single key tells us that key, which is then removed from
+    its other two slots, until every key has been peeled off. if some are left the
+    hash graph had a cycle and we go again with the next seed
+    """
+    keys = list(set(keys))
+    segment_length, segment_count_length, array_length = layout(len(keys))
+    fuse = cls(fingerprint_bits, seed, len(keys), segment_length, segment_count_length, array_length)
+
+    for _ in range(MAX_ATTEMPTS):
+      order = fuse._peel(keys)
+      if order is not None:
+        fuse._assign(order)
+        return fuse
+      fuse.seed = (fuse.seed + 0x9E3779B97F4A7C15) & MASK64
+    raise Exception(f"Couldn't build a binary fuse filter for {len(keys):,} keys in {MAX_ATTEMPTS} attempts")
+
+  def _hash(self, key):
+    return _murmur64((key + self.seed) & MASK64)
+
+  def _slots(self, h):
+    """
+    the item's 3 slots, one in each of 3 consecutive segments
+    """
+    h0 = (h * self.segment_count_length) >> 64
+    h1 = (h0 + self.segment_length) ^ ((h >> 18) & self.segment_length_mask)
+    h2 = (h0 + 2 * self.segment_length) ^ (h & self.segment_length_mask)
+    return h0, h1, h2
+
+  def _fingerprint(self, h):
+    return (h ^ (h >> 32)) & self.fingerprint_mask
+
+  def _peel(self, keys):
+    """
+    -> [(hash, which of its 3 slots it owns)] in peeling order, or None on a cycle
+
+    count holds (keys in the slot) << 2 with the xor of the slot indexes (0, 1, 2)
+    of those keys in the low 2 bits, so once a single key is left it says which
+    of that key's slots this is
+    """
+    count = array("I", bytes(4 * self.array_length))
+    xor_hash = array("Q", bytes(8 * self.array_length))
+    for key in keys:
+      h = self._hash(key)
+      for index, slot in enumerate(self._slots(h)):
+        count[slot] += 4
+        count[slot] ^= index
+        xor_hash[slot] ^= h
+
+    queue = [slot for slot in range(self.array_length) if count[slot] >> 2 == 1]
+    order = []
+    while queue:
+      slot = queue.pop()
+      if count[slot] >> 2 != 1:
+        continue
+      h = xor_hash[slot]
+      order.append((h, count[slot] & 3))
+      for index, other in enumerate(self._slots(h)):
+        count[other] -= 4
+        count[other] ^= index
+        xor_hash[other] ^= h
+        if count[other] >> 2 == 1:
+          queue.append(other)
+
+    return order if len(order) == len(keys) else None
+
+  def _assign(self, order):
+    """
+    last peeled first, each key's own slot is set so its 3 slots xor to its fingerprint
+    """
+    fingerprints = array("B" if self.fingerprint_bits == 8 else "H", bytes(self.fingerprint_bytes * self.array_length))
+    for h, owned in reversed(order):
+      slots = self._slots(h)
+      fingerprints[slots[owned]] = (
+        self._fingerprint(h) ^ fingerprints[slots[(owned + 1) % 3]] ^ fingerprints[slots[(owned + 2) % 3]]
+      )
+    if fingerprints.itemsize == 2 and struct.pack("=H", 1) != struct.pack("<H", 1):
+      fingerprints.byteswap()
+    self.fingerprints = bytearray(fingerprints.tobytes())
+
+  def probes(self, item):
+    """
+    (fingerprint, byte offsets of the 3 slots within the fingerprints)
+    """
+    h = self._hash(item_key(item))
+    return self._fingerprint(h), [slot * self.fingerprint_bytes for slot in self._slots(h)]
+
+  def _slot_value(self, data):
+    return int.from_bytes(data, "little")
+
+  def is_member(self, fingerprint, slot_values):
+    return fingerprint ^ slot_values[0] ^ slot_values[1] ^ slot_values[2] == 0
+
+  def contains(self, item):
+    fingerprint, offsets = self.probes(item)
+    width = self.fingerprint_bytes
+    return self.is_member(fingerprint, [self._slot_value(self.fingerprints[offset:offset + width]) for offset in offsets])
+
+  @property
+  def checksum(self):
+    return zlib.crc32(self.fingerprints)
+
+  def header(self):
+    return HEADER.pack(
+      MAGIC, FORMAT_VERSION, self.fingerprint_bits, ARITY, self.segment_length, self.seed,
+      self.items, self.segment_count_length, self.array_length, self.checksum
+    )
+
+  @classmethod
+  def from_header(cls, data, source):
+    """
+    filter params from the first HEADER.size bytes of a file or redis string, no fingerprints
+    """
+    if len(data) < HEADER.size:
+      raise ValueError(f"{source} is too short to be a binary fuse filter")
+    (magic, version, fingerprint_bits, arity, segment_length, seed,
+     items, segment_count_length, array_length, checksum) = HEADER.unpack_from(data)
+    if magic != MAGIC:
+      raise ValueError(f"{source} is not a binary fuse filter")
+    if version != FORMAT_VERSION or arity != ARITY:
+      raise ValueError(f"{source} is format version {version} with arity {arity}, this build reads version {FORMAT_VERSION} with arity {ARITY}")
+    fuse = cls(fingerprint_bits, seed, items, segment_length, segment_count_length, array_length)
+    fuse.expected_checksum = checksum
+    return fuse
+
+  @property
+  def data_bytes(self):
+    return self.array_length * self.fingerprint_bytes
+
+
+def write_filter(path, fuse):
+  """
+  header + fingerprints, through a temp file so a reader never maps half a filter
+  """
+  tmp_path = f"{path}.tmp"
+  with open(tmp_path, "wb") as f:
+    f.write(fuse.header())
+    f.write(fuse.fingerprints)
+  os.replace(tmp_path, path)
+
+
+def upload_filter(redis_client, data_key, data, chunk_bytes=4 * 1024 * 1024):
+  """
+  SETRANGE header + fingerprints into <data_key>:staging, then RENAME it over data_key
+
+  the same swap as build.upload_and_swap, running servers see the new header on
+  their next check and switch over
+  """
+  staging_key = f"{data_key}:staging"
+  redis_client.delete(staging_key)
+  for start in range(0, len(data), chunk_bytes):
+    redis_client.setrange(staging_key, start, bytes(data[start:start + chunk_bytes]))
+  redis_client.rename(staging_key, data_key)
+
+
+class XorFilter:
+  """
+  what main.py serves checks from, the same interface as the async bloom filters
+
+  bit_size / num_hashes / expected_items / fp_rate are the binary fuse numbers, so
+  /stats shows the real size, 3 probes and the fingerprint false positive rate
+  """
+
+  def __init__(self, fuse, redis_key="bloom:passwords"):
+    self.fuse = fuse
+    self.redis_key = redis_key
+    self._bits_set = None
+
+  @property
+  def data_key(self):
+    return f"{self.redis_key}:xor"
+
+  @property
+  def bit_size(self):
+    return self.fuse.data_bytes * 8
+
+  @property
+  def num_hashes(self):
+    return ARITY
+
+  @property
+  def expected_items(self):
+    return self.fuse.items
+
+  @property
+  def fp_rate(self):
+    return 2 ** -self.fuse.fingerprint_bits
+
+  async def load_scripts(self):
+    pass
+
+  async def add(self, password_hash):
+    raise Exception("A binary fuse filter is static, rebuild it with python -m app.xor build")
+
+  async def add_many(self, password_hashes, chunk_size=5000):
+    raise Exception("A binary fuse filter is static, rebuild it with python -m app.xor build")
+
+  async def count_bits(self):
+    if self._bits_set is None:
+      await self.reconcile_stats()
+    return self._bits_set
+
+  async def stats(self):
+    # nothing changes until the next build, the item count is exact
+    return {
+      **filter_stats(self.bit_size, ARITY, await self.count_bits(), self.fuse.items),
+      "estimated_items": self.fuse.items,
+      "false_positive_rate": self.fp_rate,
+    }
+
+
+class FileXorFilter(XorFilter):
+  """
+  checks straight from a mapped filter file, shared by every worker on the host
+  """
+
+  def __init__(self, path, verify=True, **kwargs):
+    self.path = path
+    with open(path, "rb") as f:
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      fuse = BinaryFuseFilter.from_header(self._mmap, path)
+      if len(self._mmap) != HEADER.size + fuse.data_bytes:
+        raise ValueError(f"{path} should hold {fuse.data_bytes:,} bytes of fingerprints, it is truncated or padded")
+    except ValueError:
+      self._mmap.close()
+      raise
+
+    fuse.fingerprints = memoryview(self._mmap)[HEADER.size:]
+    checksum = fuse.checksum if verify else fuse.expected_checksum
+    if checksum != fuse.expected_checksum:
+      fuse.fingerprints.release()
+      self._mmap.close()
+      raise ValueError(f"{path} is corrupt, checksum {checksum:#010x} != {fuse.expected_checksum:#010x} in the header")
+    super().__init__(fuse, **kwargs)
+
+  async def reconcile_stats(self, chunk_bytes=RECONCILE_CHUNK_BYTES):
+    self._bits_set = count_set_bits(self.fuse.fingerprints, chunk_bytes)
+    return self._bits_set
+
+  async def check(self, password_hash):
+    return self.fuse.contains(password_hash)
+
+  async def check_many(self, password_hashes, chunk_size=5000):
+    return [self.fuse.contains(password_hash) for password_hash in password_hashes]
+
+  def close(self):
+    self.fuse.fingerprints.release()
+    self._mmap.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+class RedisXorFilter(XorFilter):
+  """
+  checks against the filter uploaded to <redis_key>:xor, 3 GETRANGEs per item
+
+  python -m app.xor upload RENAMEs a new filter over the key while servers are
+  running, so every check pipeline reads the header back along with the slots and
+  a header that changed (new seed, sizes, crc32) reloads it and checks the chunk again
+  """
+
+  def __init__(self, redis_client, redis_key="bloom:passwords"):
+    super().__init__(None, redis_key)
+    self.redis_client = redis_client
+    self._header = None
+
+  async def load(self):
+    self._load_header(await self.redis_client.getrange(self.data_key, 0, HEADER.size - 1))
+
+  def _load_header(self, header):
+    self.fuse = BinaryFuseFilter.from_header(header, self.data_key)
+    self._header = bytes(header)
+    self._bits_set = None
+
+  async def reconcile_stats(self, chunk_bytes=RECONCILE_CHUNK_BYTES):
+    bits_set = 0
+    for start in range(HEADER.size, HEADER.size + self.fuse.data_bytes, chunk_bytes):
+      end = min(start + chunk_bytes, HEADER.size + self.fuse.data_bytes) - 1
+      bits_set += await self.redis_client.bitcount(self.data_key, start, end)
+    self._bits_set = bits_set
+    return bits_set
+
+  def _queue_check(self, pipe, offsets):
+    width = self.fuse.fingerprint_bytes
+    for offset in offsets:
+      pipe.getrange(self.data_key, HEADER.size + offset, HEADER.size + offset + width - 1)
+
+  async def _read_slots(self, chunk):
+    """
+    (probes, slot replies) for chunk, against whatever filter is in redis right now
+    """
+    while True:
+      with POSITIONS_SECONDS.time():
+        probes = [self.fuse.probes(password_hash) for password_hash in chunk]
+      # MULTI so the header and the slots come from the same filter even if a RENAME lands mid-pipeline
+      pipe = self.redis_client.pipeline(transaction=True)
+      pipe.getrange(self.data_key, 0, HEADER.size - 1)
+      for _, offsets in probes:
+        self._queue_check(pipe, offsets)
+      replies = await pipe.execute()
+      if replies[0] == self._header:
+        return probes, replies[1:]
+      logger.info(f"The filter at {self.data_key} was replaced, reloading its header")
+      self._load_header(replies[0])
+
+  async def check(self, password_hash):
+    return (await self.check_many([password_hash]))[0]
+
+  async def check_many(self, password_hashes, chunk_size=5000):
+    results = []
+    for chunk in _chunks(password_hashes, chunk_size):
+      probes, replies = await self._read_slots(chunk)
+      for i, (fingerprint, _) in enumerate(probes):
+        slot_values = [self.fuse._slot_value(reply) for reply in replies[ARITY * i:ARITY * i + ARITY]]
+        results.append(self.fuse.is_member(fingerprint, slot_values))
+    return results
+
+
+def read_keys(path, fmt="plain", algorithm="sha256", report_interval=10.0):
+  """
+  every key in a corpus file, as a set so a dump full of repeats stays small
+  """
+  # the key is the first 8 digest bytes either way, so the hash scheme doesn't matter here
+  from app.ingest import open_corpus, hash_line
+  from app.BloomFilter import HASH_SCHEME_DIGEST
+
+  keys = set()
+  skipped = 0
+  last_report = time.monotonic()
+  with open_corpus(path) as corpus:
+    for line in corpus:
+      item = hash_line(line, fmt, algorithm, HASH_SCHEME_DIGEST)
+      if item is None:
+        skipped += 1
+        continue
+      keys.add(item_key(item))
+      if time.monotonic() - last_report >= report_interval:
+        logger.info(f"{len(keys):,} distinct keys read")
+        last_report = time.monotonic()
+  return keys, skipped
+
+
+def main(argv=None):
+  from app.config import settings
+  from app.ingest import connect
+
+  parser = argparse.ArgumentParser(prog="python -m app.xor", description="Build, upload or inspect a static binary fuse filter")
+  commands = parser.add_subparsers(dest="command", required=True)
+
+  build_parser = commands.add_parser("build", help="build a filter from a corpus file")
+  build_parser.add_argument("corpus", help="plain or gzipped corpus, as for app.ingest")
+  build_parser.add_argument("--format", choices=["plain", "hash"], default="plain", help="plaintext passwords or hex digests")
+  build_parser.add_argument("--fingerprint-bits", type=int, choices=FINGERPRINT_BITS, default=settings.bloom_xor_fingerprint_bits)
+  build_parser.add_argument("--output", help="write the filter to this file")
+  build_parser.add_argument("--upload", action="store_true", help="swap the filter into <BLOOM_REDIS_KEY>:xor")
+
+  upload_parser = commands.add_parser("upload", help="swap a filter file into <BLOOM_REDIS_KEY>:xor")
+  upload_parser.add_argument("path")
+
+  info_parser = commands.add_parser("info", help="print a filter file's header")
+  info_parser.add_argument("path")
+  args = parser.parse_args(argv)
+
+  logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+  data_key = f"{settings.bloom_redis_key}:xor"
+
+  if args.command == "build":
+    if not args.output and not args.upload:
+      parser.error("nowhere to put the filter, pass --output and/or --upload")
+    started = time.monotonic()
+    keys, skipped = read_keys(args.corpus, args.format, settings.bloom_password_hash)
+    logger.info(f"Read {len(keys):,} distinct keys ({skipped:,} lines skipped) in {time.monotonic() - started:.1f}s")
+    fuse = BinaryFuseFilter.build(keys, args.fingerprint_bits)
+    logger.info(
+      f"Built {fuse.data_bytes:,} bytes ({fuse.data_bytes * 8 / max(fuse.items, 1):.2f} bits per item) "
+      f"in {time.monotonic() - started:.1f}s"
+    )
+    if args.output:
+      write_filter(args.output, fuse)
+      logger.info(f"Wrote {args.output}")
+    if args.upload:
+      upload_filter(connect(), data_key, fuse.header() + fuse.fingerprints)
+      logger.info(f"Swapped the filter into {data_key}")
+    return
+
+  with FileXorFilter(args.path) as xor_filter:
+    fuse = xor_filter.fuse
+    if args.command == "info":
+      print(f"{args.path}: {fuse.items:,} items, {fuse.fingerprint_bits} bit fingerprints, {fuse.array_length:,} slots, "
+            f"{fuse.data_bytes * 8 / max(fuse.items, 1):.2f} bits per item, false positive rate {xor_filter.fp_rate:.3g}, "
+            f"crc32 {fuse.expected_checksum:#010x}")
+    else:
+      upload_filter(connect(), data_key, xor_filter._mmap)
+      logger.info(f"Uploaded {args.path} to {data_key}")
+
+
+if __name__ == "__main__":
+  main()
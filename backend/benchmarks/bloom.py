@@ -0,0 +1,259 @@
+"""
+Microbenchmarks for the BloomFilter hot paths.
+
+    python -m benchmarks.bloom run --output before.json
+    python -m benchmarks.bloom run --output after.json --redis-url redis://localhost:6379/15
+    python -m benchmarks.bloom compare before.json after.json
+
+Times position computation (one item at a time and batched), add/check and
+add_many/check_many for each layout and hash scheme across filter sizes.
+
+Redis is an in-memory stand-in by default (benchmarks.memory_redis), so the
+add/check numbers are our own queueing and reply handling with almost nothing
+underneath. --backend fakeredis adds redis-py's command encoding and a full
+command parser. --backend bytearray skips Redis and the pipeline altogether
+and runs StorageBloomFilter on app.storage.MemoryBitStorage. With --redis-url the same cases also run against a real
+server, in plain and Lua script mode. Use a throwaway database, keys under
+bloom:bench are overwritten and deleted.
+
+Every case runs --repeat times. The median time per item is what compare
+looks at, the minimum is recorded too since it is the least noisy number on a
+busy machine.
+"""
+import argparse
+import hashlib
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import redis
+
+from app.BloomFilter import BloomFilter, BlockedBloomFilter, HASH_SCHEMES, HASH_SCHEME_DIGEST, np
+from app.storage import StorageBloomFilter, StorageBlockedBloomFilter, MemoryBitStorage
+from benchmarks.memory_redis import MemoryRedis
+
+LAYOUTS = {"standard": BloomFilter, "blocked": BlockedBloomFilter}
+STORAGE_LAYOUTS = {"standard": StorageBloomFilter, "blocked": StorageBlockedBloomFilter}
+KEY_PREFIX = "bloom:bench"
+
+
+def make_items(count, hash_scheme, seed=0):
+    """Random SHA-256 digests in the form the filter takes them for hash_scheme"""
+    rng = random.Random(seed)
+    digests = [hashlib.sha256(rng.randbytes(16)).digest() for _ in range(count)]
+    return digests if hash_scheme == HASH_SCHEME_DIGEST else [digest.hex() for digest in digests]
+
+
+def time_case(fn, repeat):
+    """Wall time of fn() for each of repeat runs"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def cases(bloom_filter, items, fresh, single_ops, batch_size):
+    """
+    (case name, items per run, fn) for every benchmarked operation.
+
+    The add cases come before the check cases, so checks see a filter that holds
+    half the items they ask about.
+    """
+    single = items[:single_ops]
+    checked = items[:len(items) // 2] + fresh[:len(items) - len(items) // 2]
+    checked_single = single[:single_ops // 2] + fresh[:single_ops - single_ops // 2]
+    chunks = [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+
+    yield "positions", len(items), lambda: [bloom_filter._get_bit_positions(item) for item in items]
+    yield "positions_many", len(items), lambda: [bloom_filter._get_bit_positions_many(chunk) for chunk in chunks]
+    if np is not None:
+        yield "positions_array", len(items), lambda: [bloom_filter._get_bit_positions_array(chunk) for chunk in chunks]
+    yield "add", len(single), lambda: [bloom_filter.add(item) for item in single]
+    yield "add_many", len(items), lambda: bloom_filter.add_many(items, batch_size)
+    yield "check", len(checked_single), lambda: [bloom_filter.check(item) for item in checked_single]
+    yield "check_many", len(checked), lambda: bloom_filter.check_many(checked, batch_size)
+
+
+def run_filter(bloom_filter, items, fresh, single_ops, batch_size, repeat):
+    """Time every case on one filter, returns {case: stats}"""
+    results = {}
+    for case, count, fn in cases(bloom_filter, items, fresh, single_ops, batch_size):
+        per_item = [timing / count for timing in time_case(fn, repeat)]
+        results[case] = {
+            "items": count,
+            "us_per_item": statistics.median(per_item) * 1e6,
+            "us_per_item_min": min(per_item) * 1e6,
+            "items_per_s": 1 / statistics.median(per_item),
+        }
+    return results
+
+
+def connect(backend, redis_url=None):
+    if backend == "bytearray":
+        # Every filter gets its own bitmap, see make_filter
+        return None
+    if backend == "memory":
+        return MemoryRedis()
+    if backend == "fakeredis":
+        import fakeredis
+        return fakeredis.FakeRedis()
+    redis_client = redis.Redis.from_url(redis_url)
+    redis_client.ping()
+    return redis_client
+
+
+def make_filter(backend, redis_client, layout, **filter_kwargs):
+    if backend == "bytearray":
+        return STORAGE_LAYOUTS[layout](MemoryBitStorage(), **filter_kwargs)
+    return LAYOUTS[layout](redis_client, **filter_kwargs)
+
+
+def run(sizes, backends, redis_url=None, fp_rate=0.001, items=20_000, single_ops=2_000, batch_size=5000, repeat=5):
+    """Every case for every backend, size, layout, hash scheme (and script mode on real Redis)"""
+    results = []
+    for backend in backends:
+        redis_client = connect(backend, redis_url)
+        # neither stand-in runs Lua
+        script_modes = [False, True] if backend == "redis" else [False]
+        for hash_scheme in HASH_SCHEMES:
+            sample = make_items(items, hash_scheme)
+            fresh = make_items(items, hash_scheme, seed=1)
+            for size in sizes:
+                for layout in LAYOUTS:
+                    for use_scripts in script_modes:
+                        bloom_filter = make_filter(backend, redis_client, layout, expected_items=size, fp_rate=fp_rate,
+                                                   use_scripts=use_scripts, hash_scheme=hash_scheme)
+                        bloom_filter.redis_key = f"{KEY_PREFIX}:{layout}:{hash_scheme}:{size}"
+                        if redis_client is not None:
+                            redis_client.delete(bloom_filter.redis_key, bloom_filter.stats_key)
+                        if use_scripts:
+                            bloom_filter.load_scripts()
+
+                        timings = run_filter(bloom_filter, sample, fresh, single_ops, batch_size, repeat)
+                        if redis_client is not None:
+                            redis_client.delete(bloom_filter.redis_key, bloom_filter.stats_key)
+
+                        for case, stats in timings.items():
+                            results.append({
+                                "case": case,
+                                "backend": backend,
+                                "layout": layout,
+                                "hash_scheme": hash_scheme,
+                                "scripts": use_scripts,
+                                "expected_items": size,
+                                "bit_size": bloom_filter.bit_size,
+                                **stats,
+                            })
+                            print(f"{backend:9} {layout:8} scheme {hash_scheme} {'lua ' if use_scripts else ''}"
+                                  f"{size:>12,} {case:16} {stats['us_per_item']:9.2f} us/item", file=sys.stderr)
+    return results
+
+
+def environment():
+    """What the numbers were measured on, so two files can be told apart"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__ if np is not None else None,
+        "redis_py": redis.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+def result_key(result):
+    return (result["backend"], result["case"], result["layout"], result["hash_scheme"], result["scripts"], result["expected_items"])
+
+
+def compare(before, after, threshold=0.1):
+    """
+    Line up two result files case by case.
+
+    Returns (rows, regressions), a regression being a case whose median time per
+    item grew by more than threshold (0.1 = 10%).
+    """
+    before_results = {result_key(result): result for result in before["results"]}
+    rows = []
+    regressions = []
+    for result in after["results"]:
+        old = before_results.get(result_key(result))
+        if old is None:
+            continue
+        change = result["us_per_item"] / old["us_per_item"] - 1
+        row = (result_key(result), old["us_per_item"], result["us_per_item"], change)
+        rows.append(row)
+        if change > threshold:
+            regressions.append(row)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bloom", description="Benchmark the BloomFilter hot paths")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and write the results as JSON")
+    run_parser.add_argument("--output", help="results file (default: stdout)")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[1_000_000, 10_000_000], help="expected_items of the filters")
+    run_parser.add_argument("--fp-rate", type=float, default=0.001)
+    run_parser.add_argument("--backend", nargs="*", choices=["memory", "fakeredis", "bytearray"], default=["memory"],
+                            help="in-process Redis stand-ins, or bytearray for no Redis at all (default: memory)")
+    run_parser.add_argument("--redis-url", help="also run against this Redis server")
+    run_parser.add_argument("--items", type=int, default=20_000, help="items per run of the position and batch cases")
+    run_parser.add_argument("--single-ops", type=int, default=2_000, help="items per run of the one-at-a-time add/check cases")
+    run_parser.add_argument("--batch-size", type=int, default=5000, help="chunk size for the batch cases")
+    run_parser.add_argument("--repeat", type=int, default=5)
+
+    compare_parser = commands.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="slowdown that counts as a regression (default: 0.1 = 10%%)")
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        rows, regressions = compare(before, after, args.threshold)
+        for key, old, new, change in rows:
+            flag = "  REGRESSION" if change > args.threshold else ""
+            print(f"{' '.join(map(str, key)):60} {old:9.2f} -> {new:9.2f} us/item {change:+7.1%}{flag}")
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%} in {len(rows)} matching case(s)")
+        sys.exit(1 if regressions else 0)
+
+    backends = args.backend + (["redis"] if args.redis_url else [])
+    if not backends:
+        parser.error("nothing to run, pass --backend and/or --redis-url")
+
+    results = run(
+        args.sizes,
+        backends,
+        redis_url=args.redis_url,
+        fp_rate=args.fp_rate,
+        items=args.items,
+        single_ops=args.single_ops,
+        batch_size=args.batch_size,
+        repeat=args.repeat,
+    )
+    output = json.dumps({"environment": environment(), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+End-to-end HTTP load test: real uvicorn workers, real HTTP, real Redis protocol.
+
+    python -m benchmarks.load --output load.json
+    python -m benchmarks.load --redis-url redis://localhost:6379/15 --workers 1 2 4 --concurrency 16 64 256
+
+For every --workers value uvicorn is started with that many workers, the
+filter is seeded, and then for every --concurrency value that many requests
+are kept in flight for --duration seconds, after a --warmup that isn't
+recorded. Each request is a POST /check, or a POST /add with probability
+--add-ratio.
+
+Passwords follow a Zipf distribution over a vocabulary of --passwords ranks,
+so a few weak passwords make up most of the traffic, as in real breach
+checks. The top --seed ranks are added before measuring, so checks see a
+realistic share of positives.
+
+Without --redis-url the app talks to fakeredis' TCP server, started in a
+process of its own. That is enough to compare our own code between commits, but the
+stand-in is far slower than redis-server, so use a real server for capacity
+numbers. Every BLOOM_* / REDIS_* variable in the environment is passed to the
+app, so the same tool covers every filter mode.
+
+One Python client process tops out at a few thousand requests/s. Use
+--client-processes when the app might be faster than that.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from bisect import bisect_left
+from itertools import accumulate
+from urllib.parse import urlparse
+
+import httpx
+
+PERCENTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99, "p999": 0.999}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve_fake_redis(port):
+    from fakeredis import TcpFakeServer
+
+    # socketserver listens with a backlog of 5, redis-server with 511. A worker
+    # opening its pool's connections all at once would otherwise see resets
+    TcpFakeServer.request_queue_size = 511
+    TcpFakeServer(("127.0.0.1", port), server_type="redis").serve_forever()
+
+
+def start_fake_redis():
+    """
+    fakeredis' TCP server on a free port, in a process of its own so it doesn't
+    share a GIL with the load generator. Returns (process, port)
+    """
+    port = free_port()
+    process = multiprocessing.Process(target=_serve_fake_redis, args=(port,), daemon=True)
+    process.start()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise Exception("fakeredis server didn't start within 10s")
+
+
+def password(rank):
+    return f"load-test-password-{rank}"
+
+
+def zipf_sample(vocabulary, size, exponent=1.0, seed=0):
+    """size ranks drawn from Zipf(exponent) over 0..vocabulary-1, rank 0 the most common"""
+    rng = random.Random(seed)
+    cum_weights = list(accumulate(1 / (rank + 1) ** exponent for rank in range(vocabulary)))
+    total = cum_weights[-1]
+    return [bisect_left(cum_weights, rng.random() * total) for _ in range(size)]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def summarize(latencies, errors, duration):
+    """Throughput and latency percentiles (ms) for one operation"""
+    latencies = sorted(latencies)
+    summary = {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / duration,
+    }
+    for name, q in PERCENTILES.items():
+        value = percentile(latencies, q)
+        summary[f"{name}_ms"] = value * 1000 if value is not None else None
+    summary["max_ms"] = latencies[-1] * 1000 if latencies else None
+    return summary
+
+
+async def drive(url, concurrency, duration, warmup, add_ratio, sample, seed):
+    """
+    Keep concurrency requests in flight for warmup + duration seconds.
+
+    Returns ({op: [latency, ...]}, {op: errors}) for requests started after the warmup.
+    """
+    latencies = {"check": [], "add": []}
+    errors = {"check": 0, "add": 0}
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    async def user(index, client):
+        rng = random.Random(seed * 100_003 + index)
+        position = rng.randrange(len(sample))
+        while True:
+            start = time.perf_counter()
+            if start >= stop_at:
+                return
+            op = "add" if rng.random() < add_ratio else "check"
+            position = (position + 1) % len(sample)
+            try:
+                response = await client.post(f"/{op}", json={"password": password(sample[position])})
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if start >= measure_from:
+                if ok:
+                    latencies[op].append(time.perf_counter() - start)
+                else:
+                    errors[op] += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        await asyncio.gather(*(user(index, client) for index in range(concurrency)))
+    return latencies, errors
+
+
+def _drive_process(args):
+    return asyncio.run(drive(*args))
+
+
+def measure(url, concurrency, duration, warmup, add_ratio, sample, client_processes=1):
+    """drive() split over client_processes processes, results merged"""
+    if client_processes == 1:
+        results = [asyncio.run(drive(url, concurrency, duration, warmup, add_ratio, sample, 0))]
+    else:
+        shares = [concurrency // client_processes + (i < concurrency % client_processes) for i in range(client_processes)]
+        jobs = [(url, share, duration, warmup, add_ratio, sample, i) for i, share in enumerate(shares) if share]
+        with multiprocessing.Pool(len(jobs)) as pool:
+            results = pool.map(_drive_process, jobs)
+
+    summary = {}
+    for op in ["check", "add"]:
+        op_latencies = [latency for latencies, _ in results for latency in latencies[op]]
+        summary[op] = summarize(op_latencies, sum(errors[op] for _, errors in results), duration)
+    summary["total_rps"] = summary["check"]["rps"] + summary["add"]["rps"]
+    return summary
+
+
+def start_app(port, env):
+    """app.serve the way the Dockerfile runs it, returns the process once /health answers"""
+    env = {**env, "API_HOST": "127.0.0.1", "API_PORT": str(port), "API_ACCESS_LOG": "false"}
+    process = subprocess.Popen([sys.executable, "-m", "app.serve"], env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise Exception(f"app.serve exited with {process.returncode} before it was ready")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    stop_app(process)
+    raise Exception("uvicorn didn't become healthy within 30s")
+
+
+def stop_app(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def seed(url, ranks, concurrency=64):
+    """POST /add the given ranks, so the hot passwords are already in the filter"""
+    queue = list(ranks)
+
+    async def user(client):
+        while queue:
+            await client.post("/add", json={"password": password(queue.pop())})
+
+    async with httpx.AsyncClient(base_url=url, timeout=30) as client:
+        await asyncio.gather(*(user(client) for _ in range(concurrency)))
+
+
+def app_env(redis_url, workers):
+    env = dict(os.environ)
+    parsed = urlparse(redis_url)
+    env.update({
+        "REDIS_HOST": parsed.hostname or "localhost",
+        "REDIS_PORT": str(parsed.port or 6379),
+        "REDIS_DB": parsed.path.lstrip("/") or "0",
+        "REDIS_PASSWORD": parsed.password or "",
+        "REDIS_SSL": str(parsed.scheme == "rediss").lower(),
+        "API_WORKERS": str(workers),
+        "DEBUG": "false",
+    })
+    return env
+
+
+def run(workers_levels, concurrency_levels, redis_url=None, duration=10.0, warmup=2.0, add_ratio=0.01,
+        vocabulary=100_000, seed_count=10_000, exponent=1.0, client_processes=1):
+    fake_redis = None
+    if redis_url is None:
+        fake_redis, port = start_fake_redis()
+        redis_url = f"redis://127.0.0.1:{port}/0"
+    sample = zipf_sample(vocabulary, 200_000, exponent)
+
+    results = []
+    seeded = False
+    for workers in workers_levels:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        process = start_app(port, app_env(redis_url, workers))
+        try:
+            # the filter lives in Redis, so seeding once covers every later run
+            if not seeded:
+                asyncio.run(seed(url, range(min(seed_count, vocabulary))))
+                seeded = True
+            for concurrency in concurrency_levels:
+                summary = measure(url, concurrency, duration, warmup, add_ratio, sample, client_processes)
+                results.append({"workers": workers, "concurrency": concurrency, **summary})
+                check = summary["check"]
+                print(f"workers {workers:2} concurrency {concurrency:4}: {summary['total_rps']:9,.0f} req/s, "
+                      f"check p50 {check['p50_ms'] or 0:.2f}ms p99 {check['p99_ms'] or 0:.2f}ms "
+                      f"p999 {check['p999_ms'] or 0:.2f}ms, "
+                      f"{check['errors'] + summary['add']['errors']} errors", file=sys.stderr)
+        finally:
+            stop_app(process)
+
+    if fake_redis is not None:
+        fake_redis.terminate()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load", description="HTTP load test of /check and /add through uvicorn")
+    parser.add_argument("--redis-url", help="Redis for the app (default: fakeredis TCP server in this process)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2], help="API_WORKERS values to sweep")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64], help="requests in flight to sweep")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per run")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before each run")
+    parser.add_argument("--add-ratio", type=float, default=0.01, help="share of requests that are POST /add")
+    parser.add_argument("--passwords", type=int, default=100_000, help="size of the password vocabulary")
+    parser.add_argument("--seed", type=int, default=10_000, help="most common passwords added before measuring")
+    parser.add_argument("--zipf", type=float, default=1.0, help="Zipf exponent of password popularity")
+    parser.add_argument("--client-processes", type=int, default=1, help="processes generating load")
+    parser.add_argument("--output", help="results file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.workers,
+        args.concurrency,
+        redis_url=args.redis_url,
+        duration=args.duration,
+        warmup=args.warmup,
+        add_ratio=args.add_ratio,
+        vocabulary=args.passwords,
+        seed_count=args.seed,
+        exponent=args.zipf,
+        client_processes=args.client_processes,
+    )
+    output = json.dumps({"settings": vars(args), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
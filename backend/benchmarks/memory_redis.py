@@ -0,0 +1,105 @@
+"""
+Just enough of a redis client for the benchmarks, on top of plain bytearrays.
+
+Only the commands BloomFilter and BlockedBloomFilter send (without Lua
+scripts) are here. They cost next to nothing, so a benchmark run against this
+measures our own position math, command queueing and reply handling.
+fakeredis parses every command like a server would and is ~100x slower per
+command, which would drown all of that out.
+"""
+
+
+class MemoryBitField:
+    def __init__(self, pipeline, key):
+        self.pipeline = pipeline
+        self.key = key
+        self.offsets = []
+
+    def set(self, fmt, offset, value):
+        self.offsets.append(offset)
+        return self
+
+    def execute(self):
+        self.pipeline._queue(self.pipeline.client._bitfield_set, self.key, self.offsets)
+
+
+class MemoryPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def _queue(self, command, *args):
+        self.commands.append((command, args))
+
+    def getbit(self, key, offset):
+        self._queue(self.client.getbit, key, offset)
+
+    def setbit(self, key, offset, value):
+        self._queue(self.client.setbit, key, offset, value)
+
+    def getrange(self, key, start, end):
+        self._queue(self.client.getrange, key, start, end)
+
+    def bitfield(self, key):
+        return MemoryBitField(self, key)
+
+    def hincrby(self, key, field, amount=1):
+        self._queue(self.client.hincrby, key, field, amount)
+
+    def xadd(self, *args, **kwargs):
+        self._queue(lambda: b"0-0")
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [command(*args) for command, args in commands]
+
+
+class MemoryRedis:
+    def __init__(self):
+        self.strings = {}
+        self.hashes = {}
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    def delete(self, *keys):
+        return sum((self.strings.pop(key, None), self.hashes.pop(key, None)) != (None, None) for key in keys)
+
+    def _string(self, key, size):
+        # grows like a redis string, zero filled up to the highest byte written
+        string = self.strings.setdefault(key, bytearray())
+        if len(string) < size:
+            string.extend(bytes(size - len(string)))
+        return string
+
+    def getbit(self, key, offset):
+        string = self.strings.get(key, b"")
+        if offset >> 3 >= len(string):
+            return 0
+        return (string[offset >> 3] >> (7 - (offset & 7))) & 1
+
+    def setbit(self, key, offset, value):
+        string = self._string(key, (offset >> 3) + 1)
+        old = (string[offset >> 3] >> (7 - (offset & 7))) & 1
+        if value:
+            string[offset >> 3] |= 0x80 >> (offset & 7)
+        else:
+            string[offset >> 3] &= ~(0x80 >> (offset & 7)) & 0xFF
+        return old
+
+    def _bitfield_set(self, key, offsets):
+        return [self.setbit(key, offset, 1) for offset in offsets]
+
+    def getrange(self, key, start, end):
+        return bytes(self.strings.get(key, b"")[start:end + 1])
+
+    def bitcount(self, key):
+        return sum(bin(byte).count("1") for byte in self.strings.get(key, b""))
+
+    def hincrby(self, key, field, amount=1):
+        fields = self.hashes.setdefault(key, {})
+        fields[field] = fields.get(field, 0) + amount
+        return fields[field]
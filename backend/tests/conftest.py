@@ -1,10 +1,39 @@
+import hashlib
 import pytest
 import redis
 import os
-from unittest.mock import Mock, MagicMock, patch
-from app.BloomFilter import BloomFilter
+from unittest.mock import Mock, MagicMock, AsyncMock, patch
+from app.BloomFilter import BloomFilter, AsyncBloomFilter
 from fastapi.testclient import TestClient
 
+class FakePipeline:
+    """Records queued commands and answers them from a list of canned reply batches"""
+
+    def __init__(self, reply_batches):
+        self.commands = []
+        self.reply_batches = reply_batches
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args))
+            return self
+        return queue
+
+    def bitfield(self, key):
+        # like redis-py's BitFieldOperation, the command is queued by its execute()
+        operation = Mock()
+        operation.incrby.return_value = operation
+        operation.execute.side_effect = lambda: self.commands.append(("bitfield", (key,)))
+        return operation
+
+    def execute(self):
+        replies = self.reply_batches.pop(0)
+        # a callable reply batch builds the replies from what was queued
+        return replies(self.commands) if callable(replies) else replies
+
 @pytest.fixture(scope="session", autouse=True)
 def setup_test_env():
     """Set up test environment variables"""
@@ -41,7 +70,7 @@ def mock_settings():
     with patch.dict(os.environ, test_env):
         settings = Settings()
         with patch('app.config.settings', settings):
-            with patch('app.main.settings', settings):
+            with patch('app.main.settings', settings), patch('app.ingest.settings', settings), patch('app.build.settings', settings):
                 yield settings
 
 @pytest.fixture
@@ -74,6 +103,163 @@ def bloom_filter(mock_redis):
         fp_rate=0.01
     )
 
+@pytest.fixture
+def mock_async_redis():
+    """Mock redis.asyncio client for testing"""
+    mock_client = Mock()
+    mock_client.ping = AsyncMock(return_value=True)
+    mock_client.bitcount = AsyncMock(return_value=100)
+    mock_client.aclose = AsyncMock(return_value=None)
+    
+    # Queueing on an asyncio pipeline is synchronous, only execute() is awaited
+    mock_pipeline = Mock()
+    mock_pipeline.setbit.return_value = None
+    mock_pipeline.getbit.return_value = None
+    mock_pipeline.execute = AsyncMock(return_value=[1, 1, 1, 1, 1])
+    
+    mock_client.pipeline.return_value = mock_pipeline
+    return mock_client
+
+@pytest.fixture
+def async_bloom_filter(mock_async_redis):
+    """Create an AsyncBloomFilter instance with mocked asyncio Redis"""
+    return AsyncBloomFilter(
+        redis_client=mock_async_redis,
+        expected_items=1000,
+        fp_rate=0.01
+    )
+
+@pytest.fixture
+def digests():
+    """Factory for distinct SHA-256 hex digests, the items the filters are fed"""
+    def make(prefix, count):
+        return [hashlib.sha256(f"{prefix}{i}".encode()).hexdigest() for i in range(count)]
+    return make
+
+@pytest.fixture
+def string_redis():
+    """Factory for mock sync Redis clients that serve GETRANGE from a bitmap and keep SETRANGE writes"""
+    def make(bitmap=b""):
+        mock_client = Mock()
+        mock_client.strings = {}
+        mock_client.getrange.side_effect = lambda key, start, end: bytes(bitmap[start:end + 1])
+        
+        def setrange(key, offset, value):
+            string = mock_client.strings.setdefault(key, bytearray())
+            string.extend(b"\x00" * max(0, offset + len(value) - len(string)))
+            string[offset:offset + len(value)] = value
+        
+        def rename(src, dst):
+            mock_client.strings[dst] = mock_client.strings.pop(src)
+        
+        mock_client.setrange.side_effect = setrange
+        mock_client.rename.side_effect = rename
+        # MULTI/EXEC pipelines apply their commands to the same strings
+        mock_client.pipeline.return_value = mock_client
+        return mock_client
+    return make
+
+@pytest.fixture
+def batch_redis():
+    """Factory for mock Redis clients whose pipelines answer from canned reply batches, one per execute"""
+    def make(*reply_batches, is_async=False):
+        mock_client = Mock()
+        batches = list(reply_batches)
+
+        def pipeline(transaction=True):
+            pipe = FakePipeline(batches)
+            if is_async:
+                pipe.execute = AsyncMock(side_effect=lambda: FakePipeline.execute(pipe))
+            return pipe
+
+        mock_client.pipeline.side_effect = pipeline
+        return mock_client
+    return make
+
+@pytest.fixture
+def getbit_redis():
+    """Factory for mock Redis clients whose pipelines answer every GETBIT with the same bit"""
+    def make(bit=1):
+        mock_client = Mock()
+        mock_pipeline = Mock()
+        mock_pipeline.execute.side_effect = lambda: [bit] * len(mock_pipeline.getbit.call_args_list)
+        mock_client.pipeline.return_value = mock_pipeline
+        mock_client.bitcount.return_value = 10
+        return mock_client
+    return make
+
+@pytest.fixture
+def pubsub_redis():
+    """Factory for mock redis.asyncio clients with a version key and a pub/sub that replays messages"""
+    def make(version=None, messages=()):
+        mock_client = Mock()
+        mock_client.incr = AsyncMock(return_value=1)
+        mock_client.publish = AsyncMock()
+        mock_client.get = AsyncMock(return_value=version)
+
+        async def listen():
+            for message in messages:
+                yield message
+
+        pubsub = Mock()
+        pubsub.subscribe = AsyncMock()
+        pubsub.listen = listen
+        pubsub.__aenter__ = AsyncMock(return_value=pubsub)
+        pubsub.__aexit__ = AsyncMock(return_value=None)
+        mock_client.pubsub.return_value = pubsub
+        return mock_client
+    return make
+
+@pytest.fixture
+def stream_redis():
+    """Factory for mock redis.asyncio clients holding a bitmap and a changelog stream"""
+    def make(bitmap=b"", stream_entries=None, last_id=b"5-0", entries_added=5, length=5):
+        mock_client = Mock()
+        mock_client.getrange = AsyncMock(side_effect=lambda key, start, end: bytes(bitmap[start:end + 1]))
+        mock_client.xinfo_stream = AsyncMock(return_value={
+            "last-generated-id": last_id, "entries-added": entries_added, "length": length
+        })
+        mock_client.xread = AsyncMock(side_effect=[[[b"changelog", stream_entries]], []] if stream_entries else [[]])
+
+        mock_pipeline = Mock()
+        mock_pipeline.execute = AsyncMock(return_value=[])
+        mock_client.pipeline.return_value = mock_pipeline
+        return mock_client
+    return make
+
+@pytest.fixture
+def bitmap_redis():
+    """Factory for mock redis.asyncio clients that serve GETRANGE, BITCOUNT, SETBIT and HINCRBY from one bytearray"""
+    def make(bits):
+        mock_client = Mock()
+        mock_client.publish = AsyncMock()
+        mock_client.getranges = []
+        mock_client.getrange = AsyncMock(side_effect=lambda key, start, end: bytes(bits[start:end + 1]))
+        mock_client.bitcount = AsyncMock(side_effect=lambda key, start, end: sum(bin(b).count("1") for b in bits[start:end + 1]))
+
+        def pipeline(transaction=True):
+            pipe = Mock()
+            queued = []
+
+            def getrange(key, start, end):
+                mock_client.getranges.append(start)
+                queued.append(bytes(bits[start:end + 1]))
+
+            def setbit(key, pos, value):
+                old = (bits[pos >> 3] >> (7 - (pos & 7))) & 1
+                bits[pos >> 3] |= 0x80 >> (pos & 7)
+                queued.append(old)
+
+            pipe.getrange.side_effect = getrange
+            pipe.setbit.side_effect = setbit
+            pipe.hincrby.side_effect = lambda *args: queued.append(1)
+            pipe.execute = AsyncMock(side_effect=lambda: list(queued))
+            return pipe
+
+        mock_client.pipeline = Mock(side_effect=pipeline)
+        return mock_client
+    return make
+
 @pytest.fixture
 def client(mock_settings):
     """FastAPI test client with mocked settings"""
@@ -1,6 +1,8 @@
 import pytest
-from unittest.mock import patch, Mock
+import hashlib
+from unittest.mock import patch, Mock, AsyncMock
 from fastapi.testclient import TestClient
+from app.binary import encode_batch
 
 class TestAPI:
     """Integration tests for FastAPI endpoints"""
@@ -16,7 +18,7 @@ class TestAPI:
     
     def test_health_endpoint_healthy(self, client):
         """Test health endpoint when service is healthy"""
-        with patch('app.main.redis_client') as mock_redis:
+        with patch('app.main.redis_client', new_callable=AsyncMock) as mock_redis:
             mock_redis.ping.return_value = True
             
             response = client.get("/health")
@@ -28,7 +30,7 @@ class TestAPI:
     
     def test_health_endpoint_unhealthy(self, client):
         """Test health endpoint when Redis is down"""
-        with patch('app.main.redis_client') as mock_redis:
+        with patch('app.main.redis_client', new_callable=AsyncMock) as mock_redis:
             mock_redis.ping.side_effect = Exception("Redis connection failed")
             
             response = client.get("/health")
@@ -37,8 +39,8 @@ class TestAPI:
             data = response.json()
             assert "Service unhealthy" in data["detail"]
     
-    @patch('app.main.bloom_filter')
-    @patch('app.main.redis_client')
+    @patch('app.main.bloom_filter', new_callable=AsyncMock)
+    @patch('app.main.redis_client', new_callable=AsyncMock)
     def test_check_password_safe(self, mock_redis, mock_bloom_filter, client):
         """Test checking a safe password"""
         # Mock bloom filter to return False (password not compromised)
@@ -51,8 +53,8 @@ class TestAPI:
         assert data["compromised"] is False
         assert "safe" in data["message"].lower()
     
-    @patch('app.main.bloom_filter')
-    @patch('app.main.redis_client')
+    @patch('app.main.bloom_filter', new_callable=AsyncMock)
+    @patch('app.main.redis_client', new_callable=AsyncMock)
     def test_check_password_compromised(self, mock_redis, mock_bloom_filter, client):
         """Test checking a compromised password"""
         # Mock bloom filter to return True (password is compromised)
@@ -65,8 +67,97 @@ class TestAPI:
         assert data["compromised"] is True
         assert "compromised" in data["message"].lower()
     
-    @patch('app.main.bloom_filter')
-    @patch('app.main.redis_client')
+    @patch('app.main.bloom_filter', new_callable=AsyncMock)
+    @patch('app.main.redis_client', new_callable=AsyncMock)
+    def test_check_passwords_batch(self, mock_redis, mock_bloom_filter, client):
+        """Test checking a batch of passwords"""
+        mock_bloom_filter.check_many.return_value = [True, False, True]
+        
+        response = client.post("/check/batch", json={"passwords": ["123456", "safe_password_123", "password"]})
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["results"] == [True, False, True]
+        assert data["compromised_count"] == 2
+        # Passwords are hashed before reaching the filter, in input order
+        hashes = mock_bloom_filter.check_many.call_args[0][0]
+        assert len(hashes) == 3
+        assert all(len(h) == 64 for h in hashes)
+    
+    @patch('app.main.bloom_filter', new_callable=AsyncMock)
+    @patch('app.main.redis_client', new_callable=AsyncMock)
+    def test_check_passwords_batch_too_large(self, mock_redis, mock_bloom_filter, client, mock_settings):
+        """Test batch check rejects batches over the configured maximum"""
+        mock_settings.api_batch_max_size = 2
+        
+        response = client.post("/check/batch", json={"passwords": ["a", "b", "c"]})
+        
+        assert response.status_code == 413
+        mock_bloom_filter.check_many.assert_not_called()
+    
+    def test_check_passwords_batch_empty(self, client):
+        """Test batch check with an empty list"""
+        response = client.post("/check/batch", json={"passwords": []})
+        
+        assert response.status_code == 422  # Validation error
+    
+    @patch('app.main.bloom_filter', new_callable=AsyncMock)
+    @patch('app.main.redis_client', new_callable=AsyncMock)
+    def test_check_digests_binary(self, mock_redis, mock_bloom_filter, client):
+        """Test raw digests in and a packed bitset out, no JSON"""
+        mock_bloom_filter.check_many.return_value = [True, False, True]
+        digests = [hashlib.sha256(p).digest() for p in [b"123456", b"safe_password_123", b"password"]]
+        
+        response = client.post(
+            "/check/binary",
+            content=encode_batch(digests),
+            headers={"Content-Type": "application/octet-stream"}
+        )
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/octet-stream"
+        assert response.content == bytes([0b10100000])
+        # Same items the filter gets from /check for these passwords
+        assert mock_bloom_filter.check_many.call_args[0][0] == [digest.hex() for digest in digests]
+    
+    @patch('app.main.bloom_filter', new_callable=AsyncMock)
+    @patch('app.main.redis_client', new_callable=AsyncMock)
+    def test_check_digests_binary_rejected(self, mock_redis, mock_bloom_filter, client, mock_settings):
+        """Test a body of the wrong length, too many digests or JSON never reach the filter"""
+        mock_settings.api_batch_max_size = 1
+        digest = hashlib.sha256(b"password").digest()
+        headers = {"Content-Type": "application/octet-stream"}
+        
+        assert client.post("/check/binary", content=encode_batch([digest])[:-1], headers=headers).status_code == 400
+        assert client.post("/check/binary", content=encode_batch([digest, digest]), headers=headers).status_code == 413
+        assert client.post("/check/binary", json={"hashes": [digest.hex()]}).status_code == 415
+        mock_bloom_filter.check_many.assert_not_called()
+    
+    @patch('app.main.bloom_filter', new_callable=AsyncMock)
+    @patch('app.main.redis_client', new_callable=AsyncMock)
+    def test_check_password_hash(self, mock_redis, mock_bloom_filter, client):
+        """Test checking a precomputed SHA-256 digest"""
+        mock_bloom_filter.check.return_value = True
+        digest = hashlib.sha256(b"password").hexdigest()
+        
+        response = client.post("/check/hash", json={"hash": digest.upper()})
+        
+        assert response.status_code == 200
+        assert response.json()["compromised"] is True
+        # Same item the filter gets for the plain password
+        mock_bloom_filter.check.assert_called_once_with(digest)
+    
+    @patch('app.main.bloom_filter', new_callable=AsyncMock)
+    @patch('app.main.redis_client', new_callable=AsyncMock)
+    def test_check_password_hash_wrong_algorithm(self, mock_redis, mock_bloom_filter, client):
+        """Test a SHA-1 digest is rejected when the filter holds SHA-256 hashes"""
+        response = client.post("/check/hash", json={"hash": hashlib.sha1(b"password").hexdigest()})
+        
+        assert response.status_code == 422
+        mock_bloom_filter.check.assert_not_called()
+    
+    @patch('app.main.bloom_filter', new_callable=AsyncMock)
+    @patch('app.main.redis_client', new_callable=AsyncMock)
     def test_add_password(self, mock_redis, mock_bloom_filter, client):
         """Test adding a password to the bloom filter"""
         mock_bloom_filter.add.return_value = None
@@ -79,8 +170,68 @@ class TestAPI:
         assert "added" in data["message"].lower()
         mock_bloom_filter.add.assert_called_once()
     
-    @patch('app.main.bloom_filter')
-    @patch('app.main.redis_client')
+    @patch('app.main.redis_client', new_callable=AsyncMock)
+    def test_add_password_snapshot_read_only(self, mock_redis, client):
+        """Test adds are refused while checks are served from a snapshot file"""
+        from app.snapshot import SnapshotBloomFilter
+        
+        with patch('app.main.bloom_filter', Mock(spec=SnapshotBloomFilter)):
+            response = client.post("/add", json={"password": "new_compromised_password"})
+        
+        assert response.status_code == 409
+        assert "snapshot" in response.json()["detail"]
+    
+    @patch('app.main.bloom_filter', new_callable=AsyncMock)
+    @patch('app.main.redis_client', new_callable=AsyncMock)
+    def test_add_password_xor_read_only(self, mock_redis, mock_bloom_filter, client, mock_settings):
+        """Test adds are refused while checks are served from a binary fuse filter"""
+        mock_settings.bloom_xor = True
+        
+        response = client.post("/add", json={"password": "new_compromised_password"})
+        
+        assert response.status_code == 409
+        assert "binary fuse" in response.json()["detail"]
+        mock_bloom_filter.add.assert_not_called()
+    
+    @patch('app.main.bloom_filter', new_callable=AsyncMock)
+    @patch('app.main.redis_client', new_callable=AsyncMock)
+    def test_metrics_endpoint(self, mock_redis, mock_bloom_filter, client):
+        """Test /metrics exposes the check counters and per-stage histograms"""
+        mock_bloom_filter.check_many.return_value = [True, False, True]
+        client.post("/check/batch", json={"passwords": ["123456", "safe_password_123", "password"]})
+        
+        response = client.get("/metrics")
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert 'bloom_checks_total{endpoint="check_batch"}' in response.text
+        assert 'bloom_request_seconds_count{endpoint="/check/batch"}' in response.text
+        for histogram in ["bloom_password_hash_seconds", "bloom_positions_seconds", "bloom_redis_pipeline_seconds"]:
+            assert f"{histogram}_bucket" in response.text
+    
+    def test_metrics_refused_without_multiprocess_dir(self, mock_settings, client):
+        """Test /metrics with several workers and no shared directory refuses to report one worker's numbers"""
+        mock_settings.api_workers = 2
+        
+        with patch.dict('os.environ', clear=False) as environ:
+            environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+            response = client.get("/metrics")
+        
+        assert response.status_code == 503
+        assert "PROMETHEUS_MULTIPROC_DIR" in response.json()["detail"]
+    
+    def test_metrics_without_pool_internals(self, client):
+        """Test a pool without redis-py's private connection lists still scrapes"""
+        pool = Mock(spec=["max_connections"], max_connections=7)
+        
+        with patch('app.main.redis_pool', pool):
+            response = client.get("/metrics")
+        
+        assert response.status_code == 200
+        assert "bloom_redis_pool_max_connections 7.0" in response.text
+    
+    @patch('app.main.bloom_filter', new_callable=AsyncMock)
+    @patch('app.main.redis_client', new_callable=AsyncMock)
     def test_stats_endpoint(self, mock_redis, mock_bloom_filter, client):
         """Test the stats endpoint"""
         # Mock bloom filter properties
@@ -90,8 +241,13 @@ class TestAPI:
         mock_bloom_filter.fp_rate = 0.01
         mock_bloom_filter.redis_key = "bloom:passwords:test"
         
-        # Mock Redis bitcount
-        mock_redis.bitcount.return_value = 500
+        # Running totals, no BITCOUNT on the request path
+        mock_bloom_filter.stats.return_value = {
+            "bits_set": 500,
+            "items_added": 70,
+            "estimated_items": 73,
+            "false_positive_rate": 0.05 ** 7,
+        }
         
         response = client.get("/stats")
         
@@ -102,14 +258,18 @@ class TestAPI:
         assert data["num_hashes"] == 7
         assert data["expected_items"] == 1000
         assert data["false_positive_rate"] == 0.01
+        assert data["items_added"] == 70
+        assert data["estimated_items"] == 73
+        assert data["current_false_positive_rate"] == pytest.approx(0.05 ** 7)
         assert "memory_usage_mb" in data
+        mock_bloom_filter.count_bits.assert_not_called()
     
-    @patch('app.main.bloom_filter')
-    @patch('app.main.redis_client')
+    @patch('app.main.bloom_filter', new_callable=AsyncMock)
+    @patch('app.main.redis_client', new_callable=AsyncMock)
     def test_stats_endpoint_redis_error(self, mock_redis, mock_bloom_filter, client):
         """Test stats endpoint when Redis fails"""
         mock_bloom_filter.bit_size = 10000
-        mock_redis.bitcount.side_effect = Exception("Redis error")
+        mock_bloom_filter.stats.side_effect = Exception("Redis error")
         
         response = client.get("/stats")
         
@@ -135,6 +295,9 @@ class TestAPI:
         response = client.post("/check", json={"password": "test"})
         assert response.status_code == 503
         
+        response = client.post("/check/batch", json={"passwords": ["test"]})
+        assert response.status_code == 503
+        
         response = client.post("/add", json={"password": "test"})
         assert response.status_code == 503
         
@@ -0,0 +1,61 @@
+import pytest
+from app.BloomFilter import BloomFilter, BlockedBloomFilter
+from benchmarks.bloom import make_items, run, compare
+from benchmarks.memory_redis import MemoryRedis
+from benchmarks.load import zipf_sample, summarize
+
+class TestBenchmarks:
+    """Unit tests for the benchmark suite and its in-memory Redis stand-in"""
+
+    @pytest.mark.parametrize("filter_class", [BloomFilter, BlockedBloomFilter])
+    def test_memory_redis_behaves_like_redis(self, filter_class):
+        """Test filters on the stand-in find what was added and nothing else"""
+        bloom_filter = filter_class(MemoryRedis(), expected_items=1000, fp_rate=0.01)
+        added = make_items(50, 1)
+        bloom_filter.add(added[0])
+        bloom_filter.add_many(added[1:])
+
+        assert bloom_filter.check(added[0]) is True
+        assert bloom_filter.check_many(added) == [True] * 50
+        assert sum(bloom_filter.check_many(make_items(50, 1, seed=1))) <= 5
+
+    def test_run_reports_every_case(self):
+        """Test a small run produces one result per case, layout and hash scheme"""
+        results = run([1000], ["memory"], items=20, single_ops=4, batch_size=8, repeat=1)
+
+        cases = {result["case"] for result in results}
+        assert {"positions", "positions_many", "add", "add_many", "check", "check_many"} <= cases
+        assert {(result["layout"], result["hash_scheme"]) for result in results} == {
+            ("standard", 1), ("standard", 2), ("blocked", 1), ("blocked", 2)
+        }
+        assert all(result["us_per_item"] > 0 for result in results)
+
+    def test_compare_flags_regressions(self):
+        """Test compare matches cases across files and flags slowdowns over the threshold"""
+        result = {"backend": "memory", "case": "check", "layout": "standard", "hash_scheme": 1, "scripts": False, "expected_items": 1000}
+        before = {"results": [{**result, "us_per_item": 10.0}, {**result, "case": "add", "us_per_item": 10.0}]}
+        after = {"results": [{**result, "us_per_item": 12.0}, {**result, "case": "add", "us_per_item": 10.5}]}
+
+        rows, regressions = compare(before, after, threshold=0.1)
+
+        assert len(rows) == 2
+        assert [row[0][1] for row in regressions] == ["check"]
+
+    def test_zipf_sample_is_skewed(self):
+        """Test the load generator's passwords concentrate on the top ranks"""
+        sample = zipf_sample(10_000, 20_000)
+
+        assert all(0 <= rank < 10_000 for rank in sample)
+        assert sample.count(0) > sample.count(10) > sample.count(1000)
+        assert sum(rank < 100 for rank in sample) > len(sample) / 2
+
+    def test_summarize_percentiles(self):
+        """Test latency percentiles are reported in milliseconds"""
+        summary = summarize([i / 1000 for i in range(1, 1001)], errors=2, duration=2.0)
+
+        assert summary["requests"] == 1000
+        assert summary["rps"] == 500
+        assert summary["p50_ms"] == pytest.approx(501)
+        assert summary["p99_ms"] == pytest.approx(991)
+        assert summary["max_ms"] == pytest.approx(1000)
+        assert summarize([], errors=0, duration=1.0)["p99_ms"] is None
@@ -0,0 +1,34 @@
+import pytest
+from app.binary import encode_batch, decode_batch, encode_results, decode_results
+
+class TestBinaryProtocol:
+    """Unit tests for the /check/binary wire format"""
+
+    def test_batch_round_trip(self):
+        """Test digests come back out of a request body in order"""
+        digests = [bytes([i]) * 20 for i in range(3)]
+
+        body = encode_batch(digests)
+
+        assert body[:4] == b"\x00\x00\x00\x03"
+        assert decode_batch(body, 20) == digests
+
+    def test_wrong_length_rejected(self):
+        """Test a body that doesn't hold exactly count digests is refused"""
+        body = encode_batch([b"\x01" * 32])
+
+        with pytest.raises(ValueError):
+            decode_batch(body[:-1], 32)
+        with pytest.raises(ValueError):
+            decode_batch(body, 20)
+        with pytest.raises(ValueError):
+            decode_batch(b"\x00", 32)
+
+    def test_results_round_trip(self):
+        """Test results pack MSB first, 9 results take 2 bytes"""
+        results = [True, False, False, False, False, False, False, True, True]
+
+        packed = encode_results(results)
+
+        assert packed == b"\x81\x80"
+        assert decode_results(packed, 9) == results
@@ -1,7 +1,11 @@
 import pytest
 import math
-from unittest.mock import Mock, patch
-from app.BloomFilter import BloomFilter
+import hashlib
+import fakeredis
+from unittest.mock import Mock, AsyncMock, patch
+from redis.exceptions import NoScriptError, ConnectionError as RedisConnectionError
+from app.metrics import REDIS_ERRORS, REDIS_PIPELINE_SECONDS
+from app.BloomFilter import BloomFilter, AsyncBloomFilter, BlockedBloomFilter, AsyncBlockedBloomFilter, HASH_SCHEME_DIGEST
 
 class TestBloomFilter:
     """Unit tests for BloomFilter class"""
@@ -110,3 +114,426 @@ class TestBloomFilter:
         positions2 = bloom_filter._get_bit_positions(password)
         
         assert positions1 == positions2
+    
+    def test_check_many_preserves_input_order(self, bloom_filter, mock_redis):
+        """Test batch check returns one result per item in input order"""
+        k = bloom_filter.num_hashes
+        pipeline_mock = mock_redis.pipeline.return_value
+        pipeline_mock.execute.return_value = [1] * k + [1] * (k - 1) + [0] + [1] * k
+        
+        results = bloom_filter.check_many(["first", "second", "third"])
+        
+        assert results == [True, False, True]
+        assert pipeline_mock.getbit.call_count == 3 * k
+        pipeline_mock.execute.assert_called_once()
+    
+    def test_check_many_chunks_pipelines(self, bloom_filter, mock_redis):
+        """Test batch check splits large batches into one pipeline per chunk"""
+        k = bloom_filter.num_hashes
+        pipeline_mock = mock_redis.pipeline.return_value
+        pipeline_mock.execute.side_effect = [[1] * (2 * k), [1] * (2 * k), [0] * k]
+        
+        results = bloom_filter.check_many(["a", "b", "c", "d", "e"], chunk_size=2)
+        
+        assert results == [True, True, True, True, False]
+        assert pipeline_mock.execute.call_count == 3
+    
+    def test_check_many_empty(self, bloom_filter, mock_redis):
+        """Test batch check with no items does not touch Redis"""
+        assert bloom_filter.check_many([]) == []
+        mock_redis.pipeline.assert_not_called()
+    
+    def test_script_mode_check_is_single_evalsha(self, mock_redis):
+        """Test script mode sends one EVALSHA per check instead of k GETBITs"""
+        bf = BloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01, use_scripts=True)
+        pipeline_mock = mock_redis.pipeline.return_value
+        pipeline_mock.execute.return_value = [0]
+        
+        assert bf.check("non_existing_password") is False
+        
+        pipeline_mock.getbit.assert_not_called()
+        pipeline_mock.evalsha.assert_called_once()
+        args = pipeline_mock.evalsha.call_args[0]
+        assert args[:3] == (bf._check_sha, 1, bf.redis_key)
+        assert list(args[3:]) == bf._get_bit_positions("non_existing_password")
+    
+    def test_script_mode_add_and_check_many(self, mock_redis):
+        """Test script mode add and batch check queue one EVALSHA per item"""
+        bf = BloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01, use_scripts=True)
+        pipeline_mock = mock_redis.pipeline.return_value
+        
+        bf.add("new_password")
+        pipeline_mock.setbit.assert_not_called()
+        assert pipeline_mock.evalsha.call_args[0][0] == bf._add_sha
+        
+        pipeline_mock.execute.return_value = [1, 0, 1]
+        assert bf.check_many(["a", "b", "c"]) == [True, False, True]
+    
+    def test_script_mode_reloads_scripts_on_noscript(self, mock_redis):
+        """Test scripts are loaded and the pipeline replayed when Redis lost them"""
+        bf = BloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01, use_scripts=True)
+        mock_redis.script_load.side_effect = ["check-sha", "add-sha"]
+        pipeline_mock = mock_redis.pipeline.return_value
+        pipeline_mock.execute.side_effect = [NoScriptError("NOSCRIPT"), [1]]
+        
+        assert bf.check("existing_password") is True
+        
+        assert mock_redis.script_load.call_count == 2
+        assert pipeline_mock.evalsha.call_count == 2
+        assert pipeline_mock.evalsha.call_args[0][0] == "check-sha"
+    
+    def test_pipeline_metrics(self, bloom_filter, mock_redis):
+        """Test pipeline round-trips are timed and failed ones counted"""
+        errors = REDIS_ERRORS._value.get()
+        round_trips = REDIS_PIPELINE_SECONDS._sum.get()
+        bloom_filter.check("existing_password")
+        assert REDIS_PIPELINE_SECONDS._sum.get() > round_trips
+        
+        mock_redis.pipeline.return_value.execute.side_effect = RedisConnectionError("Connection refused")
+        with pytest.raises(RedisConnectionError):
+            bloom_filter.check("existing_password")
+        assert REDIS_ERRORS._value.get() == errors + 1
+    
+    def test_add_writes_changelog_when_enabled(self, bloom_filter, mock_redis):
+        """Test add appends its positions to the changelog stream in the same pipeline"""
+        bloom_filter.changelog_key = "bloom:passwords:changelog"
+        bloom_filter.add("new_password")
+        
+        pipeline_mock = mock_redis.pipeline.return_value
+        args, kwargs = pipeline_mock.xadd.call_args
+        assert args[0] == "bloom:passwords:changelog"
+        positions = [int(p) for p in args[1]["positions"].split(",")]
+        assert positions == bloom_filter._get_bit_positions("new_password")
+        assert kwargs["approximate"] is True
+    
+    def test_add_without_changelog(self, bloom_filter, mock_redis):
+        """Test add does not touch a changelog stream by default"""
+        bloom_filter.add("new_password")
+        mock_redis.pipeline.return_value.xadd.assert_not_called()
+    
+    def test_batched_positions_match_scalar(self, mock_redis):
+        """Test vectorized positions are identical to _get_bit_positions"""
+        items = [f"{i:064x}" for i in range(500)] + ["", "short", "ünïcödé"]
+        for cls, expected_items, fp_rate in [
+            (BloomFilter, 1000, 0.01),
+            (BloomFilter, 10_000_000, 0.0001),
+            (BlockedBloomFilter, 1000, 0.01),
+            (BlockedBloomFilter, 10_000_000, 0.0001),
+        ]:
+            bf = cls(redis_client=mock_redis, expected_items=expected_items, fp_rate=fp_rate)
+            
+            array = bf._get_bit_positions_array(items)
+            assert array.shape == (len(items), bf.num_hashes)
+            assert bf._get_bit_positions_many(items) == [bf._get_bit_positions(item) for item in items]
+    
+    def test_batched_positions_without_numpy(self, bloom_filter):
+        """Test batched positions fall back to the scalar path when numpy is missing"""
+        with patch('app.BloomFilter.np', None):
+            positions = bloom_filter._get_bit_positions_many(["a", "b"])
+        
+        assert positions == [bloom_filter._get_bit_positions("a"), bloom_filter._get_bit_positions("b")]
+    
+    def test_digest_scheme_positions(self, mock_redis):
+        """Test the digest hash scheme reads positions straight from the digest"""
+        items = [hashlib.sha256(f"password{i}".encode()).digest() for i in range(200)]
+        items += [hashlib.sha1(b"password").digest()]
+        for cls in [BloomFilter, BlockedBloomFilter]:
+            bf = cls(redis_client=mock_redis, expected_items=1000, fp_rate=0.01, hash_scheme=HASH_SCHEME_DIGEST)
+            
+            assert bf._get_bit_positions_many(items) == [bf._get_bit_positions(item) for item in items]
+            # hex input is the same item as the raw digest
+            assert bf._get_bit_positions(items[0].hex()) == bf._get_bit_positions(items[0])
+            assert all(0 <= pos < bf.bit_size for pos in bf._get_bit_positions(items[0]))
+    
+    def test_unknown_hash_scheme(self, mock_redis):
+        """Test an unknown hash scheme is rejected"""
+        with pytest.raises(ValueError):
+            BloomFilter(redis_client=mock_redis, hash_scheme=3)
+    
+    def test_add_many_chunks_pipelines(self, bloom_filter, mock_redis):
+        """Test bulk add sends one pipeline per chunk with k SETBITs per item"""
+        pipeline_mock = mock_redis.pipeline.return_value
+        
+        bloom_filter.add_many(["a", "b", "c", "d", "e"], chunk_size=2)
+        
+        assert pipeline_mock.execute.call_count == 3
+        assert pipeline_mock.setbit.call_count == 5 * bloom_filter.num_hashes
+        mock_redis.pipeline.assert_called_with(transaction=False)
+        assert all(isinstance(c[0][1], int) for c in pipeline_mock.setbit.call_args_list)
+
+    
+    def test_add_counts_newly_set_bits(self, bloom_filter, mock_redis):
+        """Test an add that flips bits HINCRBYs them and one item into the stats hash"""
+        k = bloom_filter.num_hashes
+        pipeline_mock = mock_redis.pipeline.return_value
+        # SETBIT replies with the old bit, two of them were 0
+        pipeline_mock.execute.side_effect = [[0, 0] + [1] * (k - 2), [2, 1]]
+        
+        bloom_filter.add("new_password")
+        
+        pipeline_mock.hincrby.assert_any_call("bloom:passwords:stats", "bits_set", 2)
+        pipeline_mock.hincrby.assert_any_call("bloom:passwords:stats", "items", 1)
+    
+    def test_add_of_present_item_skips_stats(self, bloom_filter, mock_redis):
+        """Test an add that flips no bits costs no second round-trip"""
+        pipeline_mock = mock_redis.pipeline.return_value
+        pipeline_mock.execute.return_value = [1] * bloom_filter.num_hashes
+        
+        bloom_filter.add("existing_password")
+        
+        pipeline_mock.hincrby.assert_not_called()
+        assert pipeline_mock.execute.call_count == 1
+    
+    def test_stats_reads_running_totals(self, bloom_filter, mock_redis):
+        """Test stats comes from the stats hash, not a BITCOUNT"""
+        mock_redis.hmget.return_value = [b"500", b"70"]
+        
+        stats = bloom_filter.stats()
+        
+        mock_redis.hmget.assert_called_once_with("bloom:passwords:stats", ["bits_set", "items"])
+        mock_redis.bitcount.assert_not_called()
+        assert stats["bits_set"] == 500
+        assert stats["items_added"] == 70
+        assert stats["false_positive_rate"] == pytest.approx((500 / bloom_filter.bit_size) ** bloom_filter.num_hashes)
+    
+    def test_reconcile_stats_counts_in_ranges(self, bloom_filter, mock_redis):
+        """Test reconciliation BITCOUNTs byte ranges and sets the counter to the recount"""
+        mock_redis.bitcount.return_value = 40
+        size = (bloom_filter.bit_size + 7) // 8
+        
+        assert bloom_filter.reconcile_stats(chunk_bytes=256) == 40 * -(-size // 256)
+        
+        assert mock_redis.bitcount.call_args_list[1][0] == ("bloom:passwords", 256, 511)
+        mock_redis.hset.assert_called_once_with("bloom:passwords:stats", "bits_set", 40 * -(-size // 256))
+        mock_redis.hincrby.assert_not_called()
+    
+    def test_reconcile_stats_not_double_counting_concurrent_adds(self, bloom_filter):
+        """Test an add landing in a range not yet scanned is counted once"""
+        redis_client = fakeredis.FakeRedis()
+        bloom_filter.redis_client = redis_client
+        bloom_filter.add("before_the_pass")
+        bitcount = redis_client.bitcount
+        
+        def bitcount_with_add(key, start, end):
+            # another worker's add lands while the first range is being counted
+            if start == 0:
+                bloom_filter.add("during_the_pass")
+            return bitcount(key, start, end)
+        
+        redis_client.bitcount = bitcount_with_add
+        bloom_filter.reconcile_stats(chunk_bytes=64)
+        
+        assert int(redis_client.hget(bloom_filter.stats_key, "bits_set")) == bitcount(bloom_filter.redis_key)
+
+
+class TestAsyncBloomFilter:
+    """Unit tests for AsyncBloomFilter class"""
+    
+    def test_same_positions_as_sync_filter(self, async_bloom_filter, bloom_filter):
+        """Test async filter uses the same bit layout as the sync filter"""
+        assert async_bloom_filter.bit_size == bloom_filter.bit_size
+        assert async_bloom_filter.num_hashes == bloom_filter.num_hashes
+        assert async_bloom_filter._get_bit_positions("abc") == bloom_filter._get_bit_positions("abc")
+    
+    @pytest.mark.asyncio
+    async def test_add_password(self, async_bloom_filter, mock_async_redis):
+        """Test adding a password awaits the pipeline"""
+        await async_bloom_filter.add("test_password_123")
+        
+        pipeline_mock = mock_async_redis.pipeline.return_value
+        assert pipeline_mock.setbit.call_count == async_bloom_filter.num_hashes
+        pipeline_mock.execute.assert_awaited_once()
+    
+    @pytest.mark.asyncio
+    async def test_check_password(self, async_bloom_filter, mock_async_redis):
+        """Test checking a password that exists and one that doesn't"""
+        pipeline_mock = mock_async_redis.pipeline.return_value
+        
+        pipeline_mock.execute.return_value = [1] * async_bloom_filter.num_hashes
+        assert await async_bloom_filter.check("existing_password") is True
+        
+        pipeline_mock.execute.return_value = [1, 0] + [1] * (async_bloom_filter.num_hashes - 2)
+        assert await async_bloom_filter.check("non_existing_password") is False
+    
+    @pytest.mark.asyncio
+    async def test_check_many(self, async_bloom_filter, mock_async_redis):
+        """Test async batch check returns results in input order"""
+        k = async_bloom_filter.num_hashes
+        pipeline_mock = mock_async_redis.pipeline.return_value
+        pipeline_mock.execute.return_value = [0] * k + [1] * k
+        
+        results = await async_bloom_filter.check_many(["first", "second"])
+        
+        assert results == [False, True]
+        mock_async_redis.pipeline.assert_called_once_with(transaction=False)
+    
+    @pytest.mark.asyncio
+    async def test_script_mode_add_counts_newly_set_bits(self, mock_async_redis):
+        """Test script mode takes the newly set bit count from the add script's reply"""
+        bf = AsyncBloomFilter(redis_client=mock_async_redis, expected_items=1000, fp_rate=0.01, use_scripts=True)
+        pipeline_mock = mock_async_redis.pipeline.return_value
+        pipeline_mock.execute.side_effect = [[3], [3, 1]]
+        
+        await bf.add("new_password")
+        
+        pipeline_mock.hincrby.assert_any_call("bloom:passwords:stats", "bits_set", 3)
+    
+    @pytest.mark.asyncio
+    async def test_script_mode_reloads_scripts_on_noscript(self, mock_async_redis):
+        """Test async script mode loads scripts and replays the pipeline once"""
+        bf = AsyncBloomFilter(redis_client=mock_async_redis, expected_items=1000, fp_rate=0.01, use_scripts=True)
+        mock_async_redis.script_load = AsyncMock(side_effect=["check-sha", "add-sha"])
+        pipeline_mock = mock_async_redis.pipeline.return_value
+        pipeline_mock.execute.side_effect = [NoScriptError("NOSCRIPT"), [0]]
+        
+        assert await bf.check("non_existing_password") is False
+        assert pipeline_mock.evalsha.call_args[0][0] == "check-sha"
+
+
+class TestBlockedBloomFilter:
+    """Unit tests for the cache-line blocked layout"""
+    
+    def test_bit_size_is_whole_blocks_and_larger(self, mock_redis):
+        """Test blocked sizing rounds to 512-bit blocks and compensates for uneven fill"""
+        standard = BloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01)
+        blocked = BlockedBloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01)
+        
+        assert blocked.bit_size % 512 == 0
+        assert blocked.bit_size > standard.bit_size
+        assert blocked._blocked_fp_rate(blocked.bit_size, blocked.num_hashes) <= 0.01
+    
+    def test_scripts_rejected(self, mock_redis):
+        """Test use_scripts fails loudly instead of being ignored by the blocked check/add"""
+        with pytest.raises(ValueError, match="standard layout"):
+            BlockedBloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01, use_scripts=True)
+    
+    def test_positions_stay_in_one_block(self, mock_redis):
+        """Test all k positions of an item fall inside the same block"""
+        bf = BlockedBloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01)
+        
+        for item in ["a", "password123", "x" * 64]:
+            positions = bf._get_bit_positions(item)
+            assert len(positions) == bf.num_hashes
+            assert len({pos // 512 for pos in positions}) == 1
+            assert all(0 <= pos < bf.bit_size for pos in positions)
+    
+    def test_check_is_single_getrange(self, mock_redis):
+        """Test a check fetches the item's 64-byte block and tests it locally"""
+        bf = BlockedBloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01)
+        block, offsets = bf._get_block_offsets("existing_password")
+        block_bytes = bytearray(64)
+        for offset in offsets:
+            block_bytes[offset >> 3] |= 0x80 >> (offset & 7)
+        pipeline_mock = mock_redis.pipeline.return_value
+        pipeline_mock.execute.return_value = [bytes(block_bytes)]
+        
+        assert bf.check("existing_password") is True
+        pipeline_mock.getrange.assert_called_once_with(bf.redis_key, block * 64, block * 64 + 63)
+        pipeline_mock.getbit.assert_not_called()
+    
+    def test_check_short_block(self, mock_redis):
+        """Test a block past the end of the Redis string reads as all zeros"""
+        bf = BlockedBloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01)
+        pipeline_mock = mock_redis.pipeline.return_value
+        pipeline_mock.execute.return_value = [b"", b"\xff" * 64]
+        
+        assert bf.check_many(["missing", "everything_set"]) == [False, True]
+    
+    def test_add_is_single_bitfield(self, mock_redis):
+        """Test an add sets all k bits with one BITFIELD command"""
+        bf = BlockedBloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01)
+        pipeline_mock = mock_redis.pipeline.return_value
+        # BITFIELD replies with the old value of every bit it set
+        pipeline_mock.execute.return_value = [[1] * bf.num_hashes]
+        
+        bf.add("new_password")
+        
+        pipeline_mock.bitfield.assert_called_once_with(bf.redis_key)
+        bitfield_mock = pipeline_mock.bitfield.return_value
+        offsets = [c[0][1] for c in bitfield_mock.set.call_args_list]
+        assert offsets == bf._get_bit_positions("new_password")
+        bitfield_mock.execute.assert_called_once()
+        pipeline_mock.setbit.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_async_blocked_check(self, mock_async_redis):
+        """Test the asyncio variant uses the blocked layout"""
+        bf = AsyncBlockedBloomFilter(redis_client=mock_async_redis, expected_items=1000, fp_rate=0.01)
+        pipeline_mock = mock_async_redis.pipeline.return_value
+        pipeline_mock.execute.return_value = [b"\xff" * 64]
+        
+        assert await bf.check("existing_password") is True
+        pipeline_mock.getrange.assert_called_once()
+
+
+class TestAllocate:
+    """Unit tests for recording filter params and pre-sizing the bitmap"""
+    
+    def stored_params(self, bf):
+        """HGETALL reply for params written by bf"""
+        return {field.encode(): str(value).encode() for field, value in bf.params().items()}
+    
+    def test_fresh_key_records_params_and_presizes(self, mock_redis):
+        """Test a new key gets its params recorded and is grown to bit_size in one BITFIELD"""
+        bf = BloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01)
+        pipeline_mock = mock_redis.pipeline.return_value
+        pipeline_mock.execute.side_effect = [[{}, 0], [1, 1, 1, 1, self.stored_params(bf)], [[0]]]
+        
+        bf.allocate()
+        
+        fields = {c[0][1] for c in pipeline_mock.hsetnx.call_args_list}
+        assert fields == {"layout", "bit_size", "num_hashes", "hash_scheme"}
+        pipeline_mock.bitfield.assert_called_once_with(bf.redis_key)
+        pipeline_mock.bitfield.return_value.incrby.assert_called_once_with("u1", bf.bit_size - 1, 0)
+    
+    def test_matching_params_only_presize(self, mock_redis):
+        """Test a key that already holds this filter's params isn't written again"""
+        bf = BloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01)
+        pipeline_mock = mock_redis.pipeline.return_value
+        pipeline_mock.execute.side_effect = [[self.stored_params(bf), bf.bit_size // 8], [[0]]]
+        
+        bf.allocate()
+        
+        pipeline_mock.hsetnx.assert_not_called()
+        assert pipeline_mock.execute.call_count == 2
+    
+    def test_mismatched_params_rejected(self, mock_redis):
+        """Test a key written with another sizing fails before anything is written"""
+        bf = BloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01)
+        other = BloomFilter(redis_client=mock_redis, expected_items=2000, fp_rate=0.01)
+        pipeline_mock = mock_redis.pipeline.return_value
+        pipeline_mock.execute.side_effect = [[self.stored_params(other), 0]]
+        
+        with pytest.raises(ValueError, match="bit_size"):
+            bf.allocate()
+        
+        pipeline_mock.bitfield.assert_not_called()
+    
+    def test_oversized_legacy_key_rejected(self, mock_redis):
+        """Test a key without params that is longer than this filter's bitmap is refused"""
+        bf = BloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01)
+        pipeline_mock = mock_redis.pipeline.return_value
+        pipeline_mock.execute.side_effect = [[{}, bf.bit_size // 8 + 100]]
+        
+        with pytest.raises(ValueError, match="more than"):
+            bf.allocate()
+        
+        pipeline_mock.hsetnx.assert_not_called()
+    
+    def test_layout_is_a_param(self, mock_redis):
+        """Test standard and blocked filters of the same sizing don't accept each other's keys"""
+        bf = BlockedBloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01)
+        
+        assert bf.params()["layout"] == "blocked"
+        assert BloomFilter(redis_client=mock_redis, expected_items=1000, fp_rate=0.01).params()["layout"] == "standard"
+    
+    @pytest.mark.asyncio
+    async def test_async_allocate(self, mock_async_redis):
+        """Test the asyncio variant runs the same round-trips"""
+        bf = AsyncBloomFilter(redis_client=mock_async_redis, expected_items=1000, fp_rate=0.01)
+        pipeline_mock = mock_async_redis.pipeline.return_value
+        pipeline_mock.execute.side_effect = [[{}, 0], [1, 1, 1, 1, self.stored_params(bf)], [[0]]]
+        
+        await bf.allocate()
+        
+        pipeline_mock.bitfield.return_value.incrby.assert_called_once_with("u1", bf.bit_size - 1, 0)
@@ -0,0 +1,99 @@
+import gzip
+import hashlib
+import pytest
+from unittest.mock import Mock, patch
+from app.BloomFilter import BloomFilter
+from app.bitmap import bitmap_bytes, all_bits_set
+from app.scalable import ScalableBloomFilter
+from app.build import split_ranges, read_range, read_stride, set_positions, merge_chunks, upload_and_swap, filter_targets, build
+
+class TestBuild:
+    """Unit tests for the offline filter builder"""
+
+    def test_ranges_cover_every_line_once(self, tmp_path):
+        """Test byte ranges that cut lines in half still hand each line to exactly one worker"""
+        corpus = tmp_path / "corpus.txt"
+        lines = [f"password{i}\n".encode() for i in range(100)]
+        corpus.write_bytes(b"".join(lines))
+
+        for workers in [1, 3, 7, 64]:
+            read = [line for start, end in split_ranges(corpus.stat().st_size, workers) for line in read_range(str(corpus), start, end)]
+            assert read == lines
+
+    def test_gzip_stride_covers_every_line_once(self, tmp_path):
+        """Test gzip workers split the decompressed lines between them"""
+        corpus = tmp_path / "corpus.txt.gz"
+        lines = [f"password{i}\n".encode() for i in range(25_000)]
+        corpus.write_bytes(gzip.compress(b"".join(lines)))
+
+        read = [line for worker in range(3) for line in read_stride(str(corpus), worker, 3)]
+        assert sorted(read) == sorted(lines)
+
+    def test_set_positions_without_numpy(self):
+        """Test the pure python bit setting matches the numpy path"""
+        positions = [[0, 9, 15], [3, 9, 100]]
+        with_numpy = bytearray(16)
+        set_positions(with_numpy, positions)
+        with patch('app.build.np', None):
+            without_numpy = bytearray(16)
+            set_positions(without_numpy, positions)
+
+        assert with_numpy == without_numpy
+        assert with_numpy[0] == 0x80 | 0x10
+
+    @pytest.mark.parametrize("numpy_available", [True, False])
+    def test_merge_chunks_ors_parts(self, tmp_path, numpy_available):
+        """Test partial bitmaps are OR-merged chunk by chunk"""
+        part_a, part_b = tmp_path / "a", tmp_path / "b"
+        part_a.write_bytes(bytes([0x01, 0x00, 0xF0]))
+        part_b.write_bytes(bytes([0x80, 0x00, 0x0F]))
+
+        with patch('app.build.np', __import__('numpy') if numpy_available else None):
+            chunks = list(merge_chunks([str(part_a), str(part_b)], 3, 2))
+
+        assert chunks == [(0, bytes([0x81, 0x00])), (2, bytes([0xFF]))]
+
+    def test_upload_skips_zero_chunks_and_renames(self, string_redis):
+        """Test the bitmap goes to a staging key, skips empty chunks and is swapped in with RENAME"""
+        target = Mock(redis_key="bloom:passwords:test", redis_client=string_redis())
+        chunks = [(0, b"\x01\x00"), (2, b"\x00\x00"), (4, b"\x00")]
+
+        upload_and_swap(target, chunks, 5)
+
+        redis_client = target.redis_client
+        assert [c[0][1] for c in redis_client.setrange.call_args_list] == [0, 4]
+        redis_client.rename.assert_called_once_with("bloom:passwords:test:staging", "bloom:passwords:test")
+        assert redis_client.strings["bloom:passwords:test"] == b"\x01\x00\x00\x00\x00"
+
+    def test_swap_and_metadata_in_one_transaction(self, string_redis):
+        """Test RENAME and the stats and params writes go out in a single MULTI/EXEC"""
+        target = BloomFilter(string_redis(), expected_items=1000, fp_rate=0.01)
+        target.redis_key = "bloom:passwords:test"
+
+        upload_and_swap(target, [(0, b"\x01")], 1)
+
+        redis_client = target.redis_client
+        redis_client.pipeline.assert_called_once_with(transaction=True)
+        redis_client.hset.assert_any_call(target.params_key, mapping=target.params())
+        assert redis_client.execute.call_count == 1
+
+    def test_scalable_filter_rejected(self):
+        """Test scalable filters can't be built offline"""
+        with pytest.raises(Exception):
+            filter_targets(ScalableBloomFilter(Mock(), expected_items=1000, fp_rate=0.01))
+
+    def test_build_matches_filter_positions(self, string_redis, tmp_path, mock_settings):
+        """Test the swapped-in bitmap has every item's bits and the right length"""
+        corpus = tmp_path / "corpus.txt"
+        corpus.write_bytes(b"".join(f"password{i}\n".encode() for i in range(500)))
+        redis_client = string_redis()
+
+        items, skipped = build(str(corpus), workers=1, redis_client=redis_client, upload_chunk_bytes=64)
+
+        bloom_filter = BloomFilter(Mock(), expected_items=1000, fp_rate=0.01)
+        bitmap = redis_client.strings["bloom:passwords:test"]
+        assert (items, skipped) == (500, 0)
+        assert len(bitmap) == bitmap_bytes(bloom_filter.bit_size)
+        for i in range(500):
+            positions = bloom_filter._get_bit_positions(hashlib.sha256(f"password{i}".encode()).hexdigest())
+            assert all_bits_set(bitmap, positions)
@@ -0,0 +1,126 @@
+import pytest
+from unittest.mock import Mock, AsyncMock, patch
+from app.cache import CheckCache, CachedBloomFilter, publish_invalidation
+
+def make_filter(results=None):
+    """Mock async filter whose check_many answers from a dict (missing means not found)"""
+    results = results or {}
+    mock_filter = Mock()
+    mock_filter.redis_key = "bloom:passwords:test"
+    mock_filter.bit_size = 9585
+    mock_filter.check = AsyncMock(side_effect=lambda item: results.get(item, False))
+    mock_filter.check_many = AsyncMock(side_effect=lambda items, chunk_size=5000: [results.get(item, False) for item in items])
+    mock_filter.add = AsyncMock()
+    mock_filter.add_many = AsyncMock()
+    return mock_filter
+
+class TestCheckCache:
+    """Unit tests for the LRU check result cache"""
+
+    def test_lru_eviction(self):
+        """Test the least recently used entry is evicted first"""
+        cache = CheckCache(max_size=2)
+        cache.put("a", True, 0)
+        cache.put("b", True, 0)
+        cache.get("a")
+        cache.put("c", True, 0)
+
+        assert cache.get("b") is None
+        assert cache.get("a") is True
+        assert cache.get("c") is True
+        assert len(cache) == 2
+
+    def test_negatives_expire_and_positives_do_not(self):
+        """Test only negatives are subject to the ttl"""
+        cache = CheckCache(ttl=10)
+        with patch('app.cache.time.monotonic', return_value=100):
+            cache.put("found", True, 0)
+            cache.put("missing", False, 0)
+        with patch('app.cache.time.monotonic', return_value=105):
+            assert cache.get("missing") is False
+        with patch('app.cache.time.monotonic', return_value=1_000_000):
+            assert cache.get("missing") is None
+            assert cache.get("found") is True
+
+    def test_invalidate_negatives(self):
+        """Test invalidation drops negatives and refuses negatives looked up before it"""
+        cache = CheckCache()
+        cache.put("found", True, 0)
+        cache.put("missing", False, 0)
+        cache.invalidate_negatives()
+
+        assert cache.get("missing") is None
+        assert cache.get("found") is True
+        # a lookup that went out before the invalidation may have raced an add
+        cache.put("in_flight", False, 0)
+        assert cache.get("in_flight") is None
+
+class TestCachedBloomFilter:
+    """Unit tests for the caching filter wrapper"""
+
+    @pytest.mark.asyncio
+    async def test_repeated_checks_hit_cache(self, pubsub_redis):
+        """Test a repeated check doesn't reach the wrapped filter"""
+        mock_filter = make_filter({"weak": True})
+        cached = CachedBloomFilter(mock_filter, pubsub_redis())
+
+        assert await cached.check("weak") is True
+        assert await cached.check("weak") is True
+        assert await cached.check("strong") is False
+        assert await cached.check("strong") is False
+        assert mock_filter.check.await_count == 2
+        assert cached.bit_size == 9585
+
+    @pytest.mark.asyncio
+    async def test_check_many_only_sends_misses(self, pubsub_redis):
+        """Test check_many keeps input order and only looks up uncached items"""
+        mock_filter = make_filter({"weak": True})
+        cached = CachedBloomFilter(mock_filter, pubsub_redis())
+        await cached.check("weak")
+
+        assert await cached.check_many(["strong", "weak", "other"]) == [False, True, False]
+        mock_filter.check_many.assert_awaited_once_with(["strong", "other"], 5000)
+
+    @pytest.mark.asyncio
+    async def test_add_invalidates_and_publishes(self, pubsub_redis):
+        """Test add drops cached negatives and publishes the version bump"""
+        mock_filter = make_filter()
+        mock_redis = pubsub_redis()
+        cached = CachedBloomFilter(mock_filter, mock_redis)
+        assert await cached.check("new") is False
+
+        await cached.add("new")
+
+        mock_redis.incr.assert_awaited_once_with("bloom:passwords:test:version")
+        mock_redis.publish.assert_awaited_once_with("bloom:passwords:test:invalidate", 1)
+        assert await cached.check("new") is True
+        assert mock_filter.check.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_listener_invalidates_on_version_change(self, pubsub_redis):
+        """Test another worker's version bump drops this worker's negatives"""
+        mock_redis = pubsub_redis(version=b"3", messages=[
+            {"type": "subscribe", "data": 1},
+            {"type": "message", "data": b"4"},
+        ])
+        cached = CachedBloomFilter(make_filter(), mock_redis)
+        cached._version = 3
+        generation = cached.cache.generation
+
+        with patch('app.cache.asyncio.sleep', AsyncMock(side_effect=Exception("stop"))):
+            with pytest.raises(Exception, match="stop"):
+                await cached.run_invalidation_listener()
+
+        assert cached._version == 4
+        assert cached.cache.generation == generation + 1
+
+def test_publish_invalidation_sync():
+    """Test the CLI helper bumps the version and publishes it, and drops every cached page"""
+    mock_redis = Mock()
+    mock_redis.incr.return_value = 7
+    publish_invalidation(mock_redis, "bloom:passwords")
+
+    mock_redis.incr.assert_called_once_with("bloom:passwords:version")
+    assert [c.args for c in mock_redis.publish.call_args_list] == [
+        ("bloom:passwords:invalidate", 7), ("bloom:passwords:pages", "*")
+    ]
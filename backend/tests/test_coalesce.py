@@ -0,0 +1,71 @@
+import asyncio
+import pytest
+from unittest.mock import Mock, AsyncMock
+from app.coalesce import CoalescingBloomFilter
+
+def make_filter(found=("weak",)):
+    """Mock async filter whose check_many finds the given items"""
+    mock_filter = Mock()
+    mock_filter.bit_size = 9585
+    mock_filter.check_many = AsyncMock(side_effect=lambda items, chunk_size=5000: [item in found for item in items])
+    return mock_filter
+
+class TestCoalescingBloomFilter:
+    """Unit tests for the check request coalescer"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_checks_share_one_batch(self):
+        """Test checks arriving inside the window go out as one check_many"""
+        mock_filter = make_filter()
+        coalescer = CoalescingBloomFilter(mock_filter, window=0.01, max_batch=100)
+
+        results = await asyncio.gather(*(coalescer.check(item) for item in ["weak", "strong", "weak", "other"]))
+
+        assert results == [True, False, True, False]
+        mock_filter.check_many.assert_awaited_once_with(["weak", "strong", "weak", "other"], 5000)
+        assert coalescer.bit_size == 9585
+
+    @pytest.mark.asyncio
+    async def test_full_batch_goes_out_before_window(self):
+        """Test max_batch waiting checks are sent without waiting for the timer"""
+        mock_filter = make_filter()
+        coalescer = CoalescingBloomFilter(mock_filter, window=60, max_batch=2)
+
+        results = await asyncio.wait_for(asyncio.gather(coalescer.check("weak"), coalescer.check("strong")), timeout=1)
+
+        assert results == [True, False]
+        assert coalescer._timer is None
+
+    @pytest.mark.asyncio
+    async def test_batches_split_at_max_batch(self):
+        """Test more concurrent checks than max_batch are split over several batches"""
+        mock_filter = make_filter()
+        coalescer = CoalescingBloomFilter(mock_filter, window=0.01, max_batch=3)
+
+        results = await asyncio.gather(*(coalescer.check(f"item{i}") for i in range(7)))
+
+        assert results == [False] * 7
+        assert [len(call.args[0]) for call in mock_filter.check_many.await_args_list] == [3, 3, 1]
+
+    @pytest.mark.asyncio
+    async def test_batch_error_reaches_every_caller(self):
+        """Test a failed batch raises in every waiting check"""
+        mock_filter = make_filter()
+        mock_filter.check_many.side_effect = Exception("Redis connection failed")
+        coalescer = CoalescingBloomFilter(mock_filter, window=0.01)
+
+        results = await asyncio.gather(coalescer.check("a"), coalescer.check("b"), return_exceptions=True)
+
+        assert [str(result) for result in results] == ["Redis connection failed"] * 2
+
+    @pytest.mark.asyncio
+    async def test_cancelled_caller_does_not_break_batch(self):
+        """Test a caller that gave up doesn't stop the others getting results"""
+        coalescer = CoalescingBloomFilter(make_filter(), window=0.01)
+
+        abandoned = asyncio.ensure_future(coalescer.check("strong"))
+        waiting = asyncio.ensure_future(coalescer.check("weak"))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+
+        assert await waiting is True
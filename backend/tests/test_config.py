@@ -120,3 +120,30 @@ class TestSettings:
         assert settings.api_port == 8000
         assert settings.api_workers == 1
         assert settings.api_key is None
+    
+    def test_redis_pool_size_split_across_workers(self):
+        """Test REDIS_MAX_CONNECTIONS is a budget shared by all workers"""
+        with patch.dict(os.environ, {"REDIS_MAX_CONNECTIONS": "200", "API_WORKERS": "4"}):
+            assert Settings().redis_pool_size == 50
+        
+        with patch.dict(os.environ, {"REDIS_MAX_CONNECTIONS": "2", "API_WORKERS": "4"}):
+            assert Settings().redis_pool_size == 1
+    
+    def test_redis_pool_size_split_across_pools(self):
+        """Test each worker's share pays for its listeners first and the rest is split over the primary, shard node and replica pools"""
+        env = {
+            "REDIS_MAX_CONNECTIONS": "100", "API_WORKERS": "2",
+            "REDIS_REPLICAS": '["redis://replica-1:6379/0", "redis://replica-2:6379/0"]',
+            "BLOOM_CACHE_SIZE": "1000", "BLOOM_PAGE_CACHE_PAGES": "64",
+        }
+        with patch.dict(os.environ, env):
+            settings = Settings()
+            assert settings.redis_worker_connections == 50
+            assert settings.redis_listener_connections == 2
+            assert settings.redis_pool_count == 3
+            assert settings.redis_pool_size == 16
+        
+        with patch.dict(os.environ, {"BLOOM_SHARDS": "4", "BLOOM_SHARD_NODES": '["redis://a:6379", "redis://b:6379"]'}):
+            settings = Settings()
+            assert settings.redis_listener_connections == 0
+            assert settings.redis_pool_count == 3
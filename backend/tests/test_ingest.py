@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import json
+import pytest
+from unittest.mock import Mock
+from app.BloomFilter import HASH_SCHEME_DIGEST
+from app.ingest import hash_line, ingest
+
+def make_filter():
+    """Mock filter recording every item passed to add_many"""
+    bloom_filter = Mock()
+    bloom_filter.redis_key = "bloom:passwords:test"
+    bloom_filter.added = []
+    bloom_filter.add_many.side_effect = lambda items, chunk_size: bloom_filter.added.extend(items)
+    return bloom_filter
+
+class TestHashLine:
+    """Unit tests for turning corpus lines into filter items"""
+
+    def test_plain_line_matches_api_hashing(self):
+        """Test plaintext lines hash the same way the API hashes passwords"""
+        assert hash_line(b"password\r\n", "plain", "sha256", 1) == hashlib.sha256(b"password").hexdigest()
+        assert hash_line(b"password\n", "plain", "sha256", HASH_SCHEME_DIGEST) == hashlib.sha256(b"password").digest()
+
+    def test_hash_line_with_count_suffix(self):
+        """Test Pwned Passwords style lines keep only the digest"""
+        digest = hashlib.sha1(b"password").hexdigest()
+        assert hash_line(digest.upper().encode() + b":3861493\n", "hash", "sha1", 1) == digest
+
+    def test_invalid_lines_skipped(self):
+        """Test empty, wrong length and non-hex lines are skipped"""
+        assert hash_line(b"\n", "plain", "sha256", 1) is None
+        assert hash_line(b"abcd\n", "hash", "sha256", 1) is None
+        assert hash_line(b"z" * 64 + b"\n", "hash", "sha256", 1) is None
+
+class TestIngest:
+    """Unit tests for the streaming bulk loader"""
+
+    def test_ingest_chunks_and_checkpoints(self, tmp_path):
+        """Test every line is added in chunks and the checkpoint ends at EOF"""
+        corpus = tmp_path / "corpus.txt"
+        corpus.write_bytes(b"".join(f"password{i}\n".encode() for i in range(25)) + b"\n")
+        checkpoint = tmp_path / "corpus.checkpoint"
+        bloom_filter = make_filter()
+
+        progress = ingest(bloom_filter, str(corpus), chunk_size=10, checkpoint_path=str(checkpoint))
+
+        assert bloom_filter.add_many.call_count == 3
+        assert bloom_filter.added == [hashlib.sha256(f"password{i}".encode()).hexdigest() for i in range(25)]
+        assert progress == {"offset": corpus.stat().st_size, "items": 25, "skipped": 1}
+        assert json.loads(checkpoint.read_text())["offset"] == corpus.stat().st_size
+
+    def test_ingest_gzip(self, tmp_path):
+        """Test gzip corpora are detected and decompressed"""
+        corpus = tmp_path / "corpus.txt.gz"
+        with gzip.open(corpus, "wb") as f:
+            f.write(b"a\nb\nc\n")
+        bloom_filter = make_filter()
+
+        ingest(bloom_filter, str(corpus))
+
+        assert bloom_filter.added == [hashlib.sha256(p).hexdigest() for p in [b"a", b"b", b"c"]]
+
+    @pytest.mark.parametrize("compress", [False, True])
+    def test_ingest_resumes_from_checkpoint(self, tmp_path, compress):
+        """Test an interrupted run picks up after the last checkpointed chunk"""
+        lines = b"".join(f"password{i}\n".encode() for i in range(30))
+        corpus = tmp_path / ("corpus.txt.gz" if compress else "corpus.txt")
+        corpus.write_bytes(gzip.compress(lines) if compress else lines)
+        checkpoint = str(tmp_path / "corpus.checkpoint")
+
+        failing_filter = make_filter()
+        def add_then_fail(items, chunk_size):
+            if failing_filter.add_many.call_count == 2:
+                raise ConnectionError("Redis went away")
+            failing_filter.added.extend(items)
+        failing_filter.add_many.side_effect = add_then_fail
+        with pytest.raises(ConnectionError):
+            ingest(failing_filter, str(corpus), chunk_size=10, checkpoint_path=checkpoint)
+
+        bloom_filter = make_filter()
+        progress = ingest(bloom_filter, str(corpus), chunk_size=10, checkpoint_path=checkpoint)
+
+        assert failing_filter.added + bloom_filter.added == [hashlib.sha256(f"password{i}".encode()).hexdigest() for i in range(30)]
+        assert progress["items"] == 30
+
+    def test_checkpoint_for_other_key_ignored(self, tmp_path):
+        """Test a checkpoint written for a different filter key is not resumed"""
+        corpus = tmp_path / "corpus.txt"
+        corpus.write_bytes(b"a\nb\n")
+        checkpoint = tmp_path / "corpus.checkpoint"
+        checkpoint.write_text(json.dumps({"path": str(corpus), "redis_key": "other", "offset": 2, "items": 1, "skipped": 0}))
+        bloom_filter = make_filter()
+
+        ingest(bloom_filter, str(corpus), checkpoint_path=str(checkpoint))
+
+        assert len(bloom_filter.added) == 2
+
+    def test_ingest_into_mmap_storage(self, tmp_path):
+        """Test a corpus loads into a mapped file with no Redis, and reads back after reopening"""
+        from app.storage import StorageBloomFilter, MmapBitStorage
+
+        corpus = tmp_path / "corpus.txt"
+        corpus.write_bytes(b"".join(f"password{i}\n".encode() for i in range(50)))
+        path = str(tmp_path / "bloom.bits")
+        bloom_filter = StorageBloomFilter(MmapBitStorage(path), expected_items=1000, fp_rate=0.01)
+
+        ingest(bloom_filter, str(corpus), chunk_size=20)
+        bloom_filter.storage.close()
+
+        bloom_filter = StorageBloomFilter(MmapBitStorage(path), expected_items=1000, fp_rate=0.01)
+        hashes = [hashlib.sha256(f"password{i}".encode()).hexdigest() for i in range(50)]
+        assert bloom_filter.check_many(hashes) == [True] * 50
+        bloom_filter.storage.close()
@@ -2,7 +2,10 @@ import pytest
 from pydantic import ValidationError
 from app.models import (
     PasswordRequest,
+    BatchPasswordRequest,
+    HashRequest,
     CheckResponse,
+    BatchCheckResponse,
     AddResponse,
     StatsResponse,
     StatusResponse
@@ -26,6 +29,38 @@ class TestModels:
         with pytest.raises(ValidationError):
             PasswordRequest()
     
+    def test_batch_password_request_valid(self):
+        """Test valid BatchPasswordRequest"""
+        request = BatchPasswordRequest(passwords=["first", "second"])
+        assert request.passwords == ["first", "second"]
+    
+    def test_batch_password_request_empty(self):
+        """Test BatchPasswordRequest with no passwords or an empty password"""
+        with pytest.raises(ValidationError):
+            BatchPasswordRequest(passwords=[])
+        
+        with pytest.raises(ValidationError):
+            BatchPasswordRequest(passwords=["ok", ""])
+    
+    def test_hash_request_valid(self):
+        """Test HashRequest accepts SHA-1 and SHA-256 hex digests"""
+        assert HashRequest(hash="a" * 40).hash == "a" * 40
+        assert HashRequest(hash="AB" * 32).hash == "AB" * 32
+    
+    def test_hash_request_invalid(self):
+        """Test HashRequest rejects non-hex and wrong length digests"""
+        with pytest.raises(ValidationError):
+            HashRequest(hash="z" * 64)
+        
+        with pytest.raises(ValidationError):
+            HashRequest(hash="a" * 10)
+    
+    def test_batch_check_response_valid(self):
+        """Test valid BatchCheckResponse"""
+        response = BatchCheckResponse(results=[True, False], compromised_count=1)
+        assert response.results == [True, False]
+        assert response.compromised_count == 1
+    
     def test_check_response_valid(self):
         """Test valid CheckResponse"""
         response = CheckResponse(
@@ -64,9 +99,13 @@ class TestModels:
             num_hashes=7,
             expected_items=1000,
             false_positive_rate=0.01,
-            memory_usage_mb=1.25
+            memory_usage_mb=1.25,
+            estimated_items=73,
+            current_false_positive_rate=0.0000001
         )
         
+        assert response.items_added is None
+        assert response.estimated_items == 73
         assert response.bit_size == 10000
         assert response.bits_set == 500
         assert response.num_hashes == 7
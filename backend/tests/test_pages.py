@@ -0,0 +1,107 @@
+import pytest
+from app.BloomFilter import BloomFilter
+from app.bitmap import bitmap_bytes
+from app.pages import PageCache, PagedBloomFilter
+from benchmarks.memory_redis import MemoryRedis
+
+class TestPageCache:
+    """Unit tests for the page LRU"""
+
+    def test_lru_eviction(self):
+        """Test the least recently used page goes first"""
+        cache = PageCache(max_pages=2)
+        cache.start_fetch([1, 2])
+        cache.finish_fetch([1, 2], [b"a", b"b"])
+        cache.get(1)
+        cache.start_fetch([3])
+        cache.finish_fetch([3], [b"c"])
+
+        assert cache.get(2) is None
+        assert cache.get(1) == b"a"
+        assert len(cache) == 2
+
+    def test_expired_page_is_a_miss(self):
+        """Test a page older than ttl is fetched again"""
+        cache = PageCache(ttl=0)
+        cache.start_fetch([1])
+        cache.finish_fetch([1], [b"a"])
+
+        assert cache.get(1) is None
+
+    def test_invalidated_during_fetch_not_stored(self):
+        """Test a reply for a page invalidated while it was being fetched is dropped"""
+        cache = PageCache()
+        cache.start_fetch([1, 2])
+        cache.invalidate([1])
+        cache.finish_fetch([1, 2], [b"old", b"b"])
+
+        assert cache.get(1) is None
+        assert cache.get(2) == b"b"
+
+class TestPagedBloomFilter:
+    """Unit tests for checks answered from cached pages"""
+
+    @pytest.fixture
+    def filled(self, digests):
+        """Bitmap written by the plain filter, and the items in it"""
+        redis_client = MemoryRedis()
+        bloom_filter = BloomFilter(redis_client, expected_items=1000, fp_rate=0.01)
+        added = digests("member", 100)
+        bloom_filter.add_many(added)
+        bits = bytearray(bitmap_bytes(bloom_filter.bit_size))
+        stored = redis_client.strings[bloom_filter.redis_key]
+        bits[:len(stored)] = stored
+        return bits, added
+
+    @pytest.mark.asyncio
+    async def test_same_answers_as_redis(self, digests, filled, bitmap_redis):
+        """Test answers from pages match the bitmap"""
+        bits, added = filled
+        paged = PagedBloomFilter(bitmap_redis(bits), expected_items=1000, fp_rate=0.01, page_bytes=64)
+
+        assert await paged.check(added[0]) is True
+        assert await paged.check_many(added, chunk_size=32) == [True] * 100
+        assert sum(await paged.check_many(digests("other", 100))) <= 5
+
+    @pytest.mark.asyncio
+    async def test_cached_pages_not_fetched_again(self, filled, bitmap_redis):
+        """Test a repeated check is answered without a GETRANGE, the first one sends one pipeline"""
+        bits, added = filled
+        redis_client = bitmap_redis(bits)
+        paged = PagedBloomFilter(redis_client, expected_items=1000, fp_rate=0.01, page_bytes=64)
+
+        await paged.check(added[0])
+        fetched = len(redis_client.getranges)
+        await paged.check(added[0])
+
+        assert redis_client.pipeline.call_count == 1
+        assert len(redis_client.getranges) == fetched
+        assert paged.pages.hits == len(paged.pages)
+
+    @pytest.mark.asyncio
+    async def test_add_invalidates_touched_pages(self, filled, bitmap_redis):
+        """Test an add drops its pages here and publishes them for the other workers"""
+        bits, _ = filled
+        redis_client = bitmap_redis(bits)
+        paged = PagedBloomFilter(redis_client, expected_items=1000, fp_rate=0.01, page_bytes=64)
+        assert await paged.check("new") is False
+
+        await paged.add("new")
+
+        assert await paged.check("new") is True
+        pages = sorted({pos // paged.page_bits for pos in paged._get_bit_positions("new")})
+        redis_client.publish.assert_awaited_once_with(paged.page_channel, " ".join(map(str, pages)))
+
+    @pytest.mark.asyncio
+    async def test_messages_drop_pages(self, filled, bitmap_redis):
+        """Test published page numbers drop those pages and * drops them all"""
+        bits, added = filled
+        paged = PagedBloomFilter(bitmap_redis(bits), expected_items=1000, fp_rate=0.01, page_bytes=64)
+        await paged.check_many(added)
+        cached = len(paged.pages)
+
+        paged._seen_message(b"0 1")
+        assert len(paged.pages) == cached - 2
+
+        paged._seen_message(b"*")
+        assert len(paged.pages) == 0
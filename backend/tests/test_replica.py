@@ -0,0 +1,124 @@
+import pytest
+import fakeredis
+from redis.exceptions import ResponseError
+from app.replica import ReplicatedBloomFilter
+from app.bitmap import bitmap_bytes, set_bit
+
+def make_replica(mock_client, **kwargs):
+    replica = ReplicatedBloomFilter(
+        redis_client=mock_client,
+        expected_items=1000,
+        fp_rate=0.01,
+        **kwargs
+    )
+    replica.changelog_key = "bloom:passwords:changelog"
+    return replica
+
+class TestReplicatedBloomFilter:
+    """Unit tests for the in-process bitmap replica"""
+
+    @pytest.mark.asyncio
+    async def test_load_copies_bitmap_in_chunks(self, stream_redis):
+        """Test load pulls the bitmap with GETRANGE and answers checks locally"""
+        probe = make_replica(stream_redis())
+        bitmap = bytearray(bitmap_bytes(probe.bit_size))
+        for pos in probe._get_bit_positions("existing_password"):
+            set_bit(bitmap, pos)
+
+        mock_client = stream_redis(bitmap)
+        replica = make_replica(mock_client, load_chunk_bytes=256)
+        await replica.load()
+
+        assert replica.bitmap == bitmap
+        assert mock_client.getrange.await_count == -(-len(bitmap) // 256)
+        assert await replica.check("existing_password") is True
+        assert await replica.check("non_existing_password") is False
+        mock_client.pipeline.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_load_short_redis_string(self, stream_redis):
+        """Test load when Redis only stores the string up to the highest set bit"""
+        mock_client = stream_redis(b"\x80")
+        replica = make_replica(mock_client, load_chunk_bytes=64)
+        await replica.load()
+
+        assert len(replica.bitmap) == bitmap_bytes(replica.bit_size)
+        assert replica.bitmap[0] == 0x80
+        assert mock_client.getrange.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_refresh_applies_changelog(self, stream_redis):
+        """Test refresh sets bits written by other workers"""
+        replica = make_replica(stream_redis())
+        await replica.load()
+        positions = replica._get_bit_positions("remote_password")
+
+        replica.redis_client = stream_redis(
+            stream_entries=[(b"6-0", {b"positions": ",".join(map(str, positions)).encode()})],
+            # the 5 entries seen at load were trimmed, the one we haven't read is still there
+            last_id=b"6-0", entries_added=6, length=1
+        )
+        assert await replica.check("remote_password") is False
+
+        assert await replica.refresh() == 1
+        assert await replica.check("remote_password") is True
+        assert replica._last_id == "6-0"
+
+    @pytest.mark.asyncio
+    async def test_refresh_reloads_when_changelog_trimmed(self, stream_redis):
+        """Test refresh falls back to a full reload when entries were trimmed"""
+        replica = make_replica(stream_redis())
+        await replica.load()
+
+        # 4 entries added since load, only the newest 2 are left
+        replica.redis_client = stream_redis(last_id=b"9-0", entries_added=9, length=2)
+        assert await replica.refresh() == 0
+        replica.redis_client.getrange.assert_awaited()
+        assert replica._last_id == "9-0"
+
+    @pytest.mark.asyncio
+    async def test_refresh_reloads_when_trimmed_after_empty_load(self, stream_redis):
+        """Test a stream that was empty at load time still notices entries trimmed before we read them"""
+        mock_client = stream_redis()
+        mock_client.xinfo_stream.side_effect = ResponseError("ERR no such key")
+        replica = make_replica(mock_client)
+        await replica.load()
+        assert replica._last_id == "0-0"
+
+        replica.redis_client = stream_redis(last_id=b"3-0", entries_added=3, length=1)
+        assert await replica.refresh() == 0
+        replica.redis_client.getrange.assert_awaited()
+
+    @pytest.mark.asyncio
+    async def test_refresh_reloads_after_maxlen_trim(self, digests):
+        """Test a replica that fell more than changelog_maxlen entries behind reloads and sees every add"""
+        redis_client = fakeredis.FakeAsyncRedis()
+        writer = make_replica(redis_client)
+        reader = make_replica(redis_client)
+        writer.changelog_maxlen = 3
+        await writer.load()
+        await reader.load()
+
+        added = digests("remote", 50)
+        for password_hash in added:
+            await writer.add(password_hash)
+        # XADD MAXLEN ~ only drops whole macro nodes, trim exactly like a long stream would be
+        await redis_client.xtrim(writer.changelog_key, maxlen=3, approximate=False)
+
+        assert await reader.refresh() == 0
+        assert await reader.check_many(added) == [True] * 50
+        assert reader._entries_seen == 50
+
+    @pytest.mark.asyncio
+    async def test_add_writes_redis_and_local_bitmap(self, stream_redis):
+        """Test add goes to Redis with a changelog entry and is visible locally"""
+        mock_client = stream_redis()
+        replica = make_replica(mock_client)
+        await replica.load()
+
+        await replica.add("new_password")
+
+        pipeline_mock = mock_client.pipeline.return_value
+        assert pipeline_mock.setbit.call_count == replica.num_hashes
+        pipeline_mock.xadd.assert_called_once()
+        assert await replica.check_many(["new_password", "other_password"]) == [True, False]
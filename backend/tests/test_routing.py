@@ -0,0 +1,81 @@
+import pytest
+from unittest.mock import AsyncMock
+from redis.exceptions import ConnectionError
+from app.routing import ReplicaRoutedBloomFilter
+
+class RecordingFilter:
+    """Async filter stand-in that answers with the name of the client it was asked on"""
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.bit_size = 9585
+
+    async def check(self, password_hash):
+        return await self.redis_client.name()
+
+    async def check_many(self, password_hashes, chunk_size=5000):
+        return [await self.redis_client.name()] * len(password_hashes)
+
+    async def stats(self):
+        return {"client": await self.redis_client.name()}
+
+    async def add(self, password_hash):
+        return await self.redis_client.name()
+
+def make_client(name, role="slave", link="up"):
+    mock_client = AsyncMock()
+    mock_client.name.return_value = name
+    mock_client.info.return_value = {"role": role, "master_link_status": link}
+    return mock_client
+
+class TestReplicaRoutedBloomFilter:
+    """Unit tests for routing reads to replicas and writes to the primary"""
+
+    @pytest.fixture
+    def routed(self):
+        return ReplicaRoutedBloomFilter(
+            RecordingFilter(make_client("primary")),
+            [make_client("replica-0"), make_client("replica-1")]
+        )
+
+    @pytest.mark.asyncio
+    async def test_reads_round_robin(self, routed):
+        """Test checks and stats take turns over the replicas"""
+        assert await routed.check("hash") == "replica-0"
+        assert await routed.check_many(["a", "b"]) == ["replica-1", "replica-1"]
+        assert await routed.stats() == {"client": "replica-0"}
+
+    @pytest.mark.asyncio
+    async def test_writes_go_to_primary(self, routed):
+        """Test adds and attributes come from the wrapped filter"""
+        assert await routed.add("hash") == "primary"
+        assert routed.bit_size == 9585
+
+    @pytest.mark.asyncio
+    async def test_failed_read_retried_on_primary(self, routed):
+        """Test a replica that errors is dropped and the check still answers"""
+        routed.replica_clients[0].name.side_effect = ConnectionError("gone")
+
+        assert await routed.check("hash") == "primary"
+        assert routed.healthy == [False, True]
+        assert [await routed.check("hash") for _ in range(2)] == ["replica-1", "replica-1"]
+
+    @pytest.mark.asyncio
+    async def test_no_healthy_replica_reads_primary(self, routed):
+        """Test reads fall back to the primary with every replica out of rotation"""
+        routed.healthy = [False, False]
+
+        assert await routed.check("hash") == "primary"
+
+    @pytest.mark.asyncio
+    async def test_health_check(self, routed):
+        """Test a replica is out while unreachable or out of sync and back once it passes"""
+        routed.replica_clients[0].ping.side_effect = ConnectionError("gone")
+        routed.replica_clients[1].info.return_value = {"role": "slave", "master_link_status": "down"}
+
+        assert await routed.check_replica(0) is False
+        assert await routed.check_replica(1) is False
+
+        routed.replica_clients[0].ping.side_effect = None
+        assert await routed.check_replica(0) is True
+        assert await ReplicaRoutedBloomFilter(RecordingFilter(None), [make_client("primary", role="master", link=None)]).check_replica(0) is True
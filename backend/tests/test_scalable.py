@@ -0,0 +1,190 @@
+import pytest
+from unittest.mock import Mock, AsyncMock
+from app.scalable import ScalableBloomFilter, AsyncScalableBloomFilter, GROW_SCRIPT
+
+def allocate_answers():
+    """Reply batches for allocating a new generation: a fresh key, the params it records, the resize"""
+    def record(commands):
+        params = {args[1]: args[2] for name, args in commands if name == "hsetnx"}
+        return [1] * len(params) + [params]
+    return [{}, 0], record, [[0]]
+
+def getbits_answer(generations, bit):
+    """Reply batch: generation count first, then the same bit for every GETBIT (or old bit for every SETBIT)"""
+    return lambda commands: [generations] + [bit] * (len(commands) - 1)
+
+def recorded_answer(items, counted=None):
+    """Reply batch for the stats and item count written after adds, the items counted go on counted"""
+    def answer(commands):
+        if counted is not None:
+            counted.append(commands[-1][1][2])
+        return [0] * (len(commands) - 1) + [items]
+    return answer
+
+class TestScalableBloomFilter:
+    """Unit tests for ScalableBloomFilter"""
+
+    def test_generation_sizing_holds_fp_target(self):
+        """Test each generation is larger and tighter, and the compound rate stays under fp_rate"""
+        sbf = ScalableBloomFilter(Mock(), expected_items=1000, fp_rate=0.01)
+        sbf._sync_generations(4)
+
+        assert [g.expected_items for g in sbf.generations] == [1000, 2000, 4000, 8000]
+        assert [g.fp_rate for g in sbf.generations] == pytest.approx([0.005, 0.0025, 0.00125, 0.000625])
+        assert sum(g.fp_rate for g in sbf.generations) < 0.01
+        assert sbf.capacity == 15000
+
+    def test_redis_key_sets_generation_keys(self):
+        """Test generation and meta keys follow redis_key"""
+        sbf = ScalableBloomFilter(Mock(), expected_items=1000, fp_rate=0.01)
+        sbf._sync_generations(2)
+        sbf.redis_key = "bloom:passwords:test"
+
+        assert [g.redis_key for g in sbf.generations] == ["bloom:passwords:test:0", "bloom:passwords:test:1"]
+        assert sbf.meta_key == "bloom:passwords:test:meta"
+
+    def test_check_pipelines_every_generation(self, batch_redis):
+        """Test one check reads the generation count and all generations in one round-trip"""
+        mock_client = batch_redis(getbits_answer(b"3", 1))
+        sbf = ScalableBloomFilter(mock_client, expected_items=1000, fp_rate=0.01)
+        sbf._sync_generations(3)
+
+        assert sbf.check("existing_password") is True
+        assert mock_client.pipeline.call_count == 1
+
+    def test_check_any_generation_matches(self, batch_redis):
+        """Test an item is found when only one generation has all its bits"""
+        probe = ScalableBloomFilter(Mock(), expected_items=1000, fp_rate=0.01)
+        probe._sync_generations(2)
+        k0, k1 = probe.generations[0].num_hashes, probe.generations[1].num_hashes
+        sbf = ScalableBloomFilter(batch_redis([b"2"] + [0] * k0 + [1] * k1), expected_items=1000, fp_rate=0.01)
+        sbf._sync_generations(2)
+
+        assert sbf.check("existing_password") is True
+
+    def test_check_picks_up_new_generation(self, batch_redis):
+        """Test misses are re-checked when another worker opened a generation"""
+        mock_client = batch_redis(getbits_answer(b"2", 0), getbits_answer(b"2", 1))
+        sbf = ScalableBloomFilter(mock_client, expected_items=1000, fp_rate=0.01)
+
+        assert sbf.check("existing_password") is True
+        assert len(sbf.generations) == 2
+        assert mock_client.pipeline.call_count == 2
+
+    def test_add_grows_when_full(self, batch_redis):
+        """Test the generation that reaches capacity opens the next one"""
+        mock_client = batch_redis(getbits_answer(None, 0), recorded_answer(1000), *allocate_answers())
+        mock_client.eval.return_value = [1, 2]
+        mock_client.hget.return_value = None
+        sbf = ScalableBloomFilter(mock_client, expected_items=1000, fp_rate=0.01)
+
+        sbf.add("new_password")
+
+        mock_client.eval.assert_called_once_with(GROW_SCRIPT, 1, sbf.meta_key, "grown:0")
+        assert len(sbf.generations) == 2
+
+    def test_lost_grow_does_not_allocate(self, batch_redis):
+        """Test a worker that loses the race picks up the new generation without allocating it"""
+        mock_client = batch_redis(getbits_answer(None, 0), recorded_answer(1000))
+        mock_client.eval.return_value = [0, 2]
+        mock_client.hget.return_value = None
+        sbf = ScalableBloomFilter(mock_client, expected_items=1000, fp_rate=0.01)
+
+        sbf.add("new_password")
+
+        assert len(sbf.generations) == 2
+        assert mock_client.pipeline.call_count == 2
+
+    def test_add_does_not_grow_below_capacity(self, batch_redis):
+        """Test adds below capacity stay in the active generation"""
+        mock_client = batch_redis(getbits_answer(None, 0), recorded_answer(10))
+        sbf = ScalableBloomFilter(mock_client, expected_items=1000, fp_rate=0.01)
+
+        sbf.add("new_password")
+
+        mock_client.eval.assert_not_called()
+        assert len(sbf.generations) == 1
+
+    def test_add_many_splits_at_capacity(self, batch_redis):
+        """Test bulk adds never overfill the active generation"""
+        mock_client = batch_redis(
+            getbits_answer(None, 0), recorded_answer(100), *allocate_answers(), getbits_answer(b"2", 0), recorded_answer(50)
+        )
+        mock_client.eval.return_value = [1, 2]
+        mock_client.hget.return_value = None
+        sbf = ScalableBloomFilter(mock_client, expected_items=100, fp_rate=0.01)
+
+        sbf.add_many([f"item{i}" for i in range(150)])
+
+        # two chunks of adds and their counts, with the new generation's allocation in between
+        assert mock_client.pipeline.call_count == 7
+        assert len(sbf.generations) == 2
+
+    def test_readding_items_not_counted(self, batch_redis):
+        """Test only adds that set a new bit count towards the generation's capacity"""
+        k = ScalableBloomFilter(Mock(), expected_items=1000, fp_rate=0.01).num_hashes
+        counted = []
+        mock_client = batch_redis(lambda commands: [None] + [0] * k + [1] * (len(commands) - 1 - k), recorded_answer(10, counted))
+        mock_client.hget.return_value = None
+        sbf = ScalableBloomFilter(mock_client, expected_items=1000, fp_rate=0.01)
+
+        sbf.add_many(["new", "old_1", "old_2"])
+
+        assert counted == [1]
+
+    def test_readding_only_known_items_writes_nothing(self, batch_redis):
+        """Test a chunk of items already in the filter leaves the counts alone"""
+        mock_client = batch_redis(getbits_answer(None, 1))
+        mock_client.hget.return_value = None
+        sbf = ScalableBloomFilter(mock_client, expected_items=1000, fp_rate=0.01)
+
+        sbf.add_many(["old_1", "old_2"])
+
+        assert mock_client.pipeline.call_count == 1
+        mock_client.eval.assert_not_called()
+
+    def test_add_many_first_chunk_fits_stored_count(self, batch_redis):
+        """Test the first chunk only fills what is left of the active generation"""
+        chunks = []
+        mock_client = batch_redis(
+            getbits_answer(None, 0), recorded_answer(100, chunks), *allocate_answers(), getbits_answer(b"2", 0), recorded_answer(10, chunks)
+        )
+        mock_client.eval.return_value = [1, 2]
+        mock_client.hget.side_effect = lambda key, field: b"60" if field == "items:0" else None
+        sbf = ScalableBloomFilter(mock_client, expected_items=100, fp_rate=0.01)
+
+        sbf.add_many([f"item{i}" for i in range(50)])
+
+        assert chunks == [40, 10]
+
+class TestAsyncScalableBloomFilter:
+    """Unit tests for AsyncScalableBloomFilter"""
+
+    @pytest.mark.asyncio
+    async def test_check_and_load_generations(self, batch_redis):
+        """Test the async variant loads the generation count and checks all generations"""
+        mock_client = batch_redis(getbits_answer(b"2", 1), is_async=True)
+        mock_client.hget = AsyncMock(return_value=b"2")
+
+        sbf = AsyncScalableBloomFilter(mock_client, expected_items=1000, fp_rate=0.01)
+        await sbf.load_generations()
+
+        assert len(sbf.generations) == 2
+        assert await sbf.check_many(["a", "b"]) == [True, True]
+
+    @pytest.mark.asyncio
+    async def test_add_many_first_chunk_fits_stored_count(self, batch_redis):
+        """Test the async variant sizes its first chunk from the stored count and grows atomically"""
+        chunks = []
+        mock_client = batch_redis(
+            getbits_answer(None, 0), recorded_answer(100, chunks), *allocate_answers(), getbits_answer(b"2", 0), recorded_answer(10, chunks),
+            is_async=True
+        )
+        mock_client.eval = AsyncMock(return_value=[1, 2])
+        mock_client.hget = AsyncMock(side_effect=lambda key, field: b"60" if field == "items:0" else None)
+        sbf = AsyncScalableBloomFilter(mock_client, expected_items=100, fp_rate=0.01)
+
+        await sbf.add_many([f"item{i}" for i in range(50)])
+
+        assert chunks == [40, 10]
+        mock_client.eval.assert_awaited_once_with(GROW_SCRIPT, 1, sbf.meta_key, "grown:0")
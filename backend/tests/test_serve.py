@@ -0,0 +1,81 @@
+import pytest
+import os
+from unittest.mock import patch
+from app.config import Settings
+from app import serve
+
+def make_settings(**env):
+    with patch.dict(os.environ, env):
+        return Settings()
+
+class TestServe:
+    """Tests for the multi-worker launcher"""
+    
+    def test_runs_configured_workers(self, tmp_path):
+        """Test uvicorn gets API_WORKERS, host, port and the access log setting"""
+        settings = make_settings(API_WORKERS="4", API_PORT="8080", API_ACCESS_LOG="false", DEBUG="false")
+        
+        with patch('app.serve.settings', settings), patch('app.serve.uvicorn.run') as mock_run, \
+             patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}):
+            serve.main()
+        
+        mock_run.assert_called_once_with(
+            "app.main:app", host="0.0.0.0", port=8080, uds=None, workers=4, access_log=False, log_level="info"
+        )
+    
+    def test_listens_on_unix_socket(self):
+        """Test API_UDS is handed to uvicorn for same-host callers"""
+        settings = make_settings(API_UDS="/run/bloom/api.sock")
+        
+        with patch('app.serve.settings', settings), patch('app.serve.uvicorn.run') as mock_run:
+            serve.main()
+        
+        assert mock_run.call_args.kwargs["uds"] == "/run/bloom/api.sock"
+    
+    def test_exports_snapshot_before_workers_start(self, tmp_path):
+        """Test BLOOM_SNAPSHOT_EXPORT writes the shared snapshot before uvicorn runs"""
+        path = str(tmp_path / "bloom.snap")
+        settings = make_settings(BLOOM_SNAPSHOT_PATH=path, BLOOM_SNAPSHOT_EXPORT="true", API_WORKERS="2")
+        calls = []
+        
+        with patch('app.serve.settings', settings), \
+             patch('app.serve.export_shared_snapshot', side_effect=lambda: calls.append("export")), \
+             patch('app.serve.uvicorn.run', side_effect=lambda *args, **kwargs: calls.append("run")), \
+             patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": str(tmp_path / "metrics")}):
+            serve.main()
+        
+        assert calls == ["export", "run"]
+    
+    def test_workers_share_metrics_dir(self, tmp_path):
+        """Test several workers get a shared PROMETHEUS_MULTIPROC_DIR, emptied of an earlier run's files"""
+        settings = make_settings(API_WORKERS="2")
+        (tmp_path / "counter_123.db").write_bytes(b"stale")
+        environ = {}
+        
+        with patch('app.serve.settings', settings), \
+             patch('app.serve.uvicorn.run', side_effect=lambda *args, **kwargs: environ.update(os.environ)), \
+             patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}):
+            serve.main()
+        
+        assert environ["PROMETHEUS_MULTIPROC_DIR"] == str(tmp_path)
+        assert list(tmp_path.iterdir()) == []
+    
+    def test_single_worker_keeps_process_metrics(self):
+        """Test one worker leaves prometheus_client in its default single process mode"""
+        settings = make_settings(API_WORKERS="1")
+        
+        with patch('app.serve.settings', settings), patch('app.serve.uvicorn.run'), patch.dict(os.environ) as environ:
+            environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+            serve.main()
+            
+            assert "PROMETHEUS_MULTIPROC_DIR" not in os.environ
+    
+    def test_export_needs_snapshot_path(self):
+        """Test BLOOM_SNAPSHOT_EXPORT without BLOOM_SNAPSHOT_PATH fails before starting workers"""
+        settings = make_settings(BLOOM_SNAPSHOT_EXPORT="true")
+        
+        with patch('app.serve.settings', settings), patch('app.serve.uvicorn.run') as mock_run:
+            with pytest.raises(Exception, match="BLOOM_SNAPSHOT_PATH"):
+                serve.main()
+        
+        mock_run.assert_not_called()
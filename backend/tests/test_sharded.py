@@ -0,0 +1,98 @@
+import pytest
+from unittest.mock import Mock, AsyncMock
+from app.BloomFilter import BloomFilter, AsyncBlockedBloomFilter, HASH_SCHEME_DIGEST
+from app.sharded import ShardedBloomFilter, AsyncShardedBloomFilter
+
+class TestShardedBloomFilter:
+    """Unit tests for ShardedBloomFilter"""
+
+    def test_shards_sized_for_their_share(self):
+        """Test every shard is sized for expected_items / num_shards"""
+        sharded = ShardedBloomFilter(Mock(), 4, expected_items=1000, fp_rate=0.01)
+        single_shard = BloomFilter(Mock(), expected_items=250, fp_rate=0.01)
+
+        assert len(sharded.shards) == 4
+        assert sharded.shard_bit_size == single_shard.bit_size
+        assert sharded.bit_size == 4 * single_shard.bit_size
+        assert sharded.num_hashes == single_shard.num_hashes
+
+    def test_redis_key_sets_shard_keys(self):
+        """Test setting redis_key names every shard with a cluster hash tag"""
+        sharded = ShardedBloomFilter(Mock(), 3, expected_items=1000, fp_rate=0.01)
+        sharded.redis_key = "bloom:passwords:test"
+
+        assert [shard.redis_key for shard in sharded.shards] == [
+            "bloom:passwords:test:{0}",
+            "bloom:passwords:test:{1}",
+            "bloom:passwords:test:{2}",
+        ]
+
+    def test_shards_spread_over_clients(self):
+        """Test shards are assigned to Redis nodes round-robin"""
+        clients = [Mock(), Mock()]
+        sharded = ShardedBloomFilter(clients, 4, expected_items=1000, fp_rate=0.01)
+
+        assert [shard.redis_client for shard in sharded.shards] == [clients[0], clients[1], clients[0], clients[1]]
+
+    def test_item_routed_to_one_shard(self, getbit_redis):
+        """Test add and check for an item only touch its own shard"""
+        clients = [getbit_redis() for _ in range(4)]
+        sharded = ShardedBloomFilter(clients, 4, expected_items=1000, fp_rate=0.01)
+        shard = sharded._shard_for("password_hash")
+
+        sharded.add("password_hash")
+        assert sharded.check("password_hash") is True
+
+        for i, client in enumerate(clients):
+            assert client.pipeline.called == (i == shard)
+
+    def test_check_many_keeps_input_order(self, getbit_redis):
+        """Test batch results across shards come back in input order"""
+        clients = [getbit_redis(bit=i % 2) for i in range(2)]
+        sharded = ShardedBloomFilter(clients, 2, expected_items=1000, fp_rate=0.01)
+        items = [f"item{i}" for i in range(20)]
+
+        results = sharded.check_many(items)
+
+        assert results == [sharded._shard_for(item) == 1 for item in items]
+
+    def test_digest_scheme_routing(self):
+        """Test raw and hex digests route to the same shard with the digest hash scheme"""
+        sharded = ShardedBloomFilter(Mock(), 4, expected_items=1000, fp_rate=0.01, hash_scheme=HASH_SCHEME_DIGEST)
+        digests = [bytes([i]) * 32 for i in range(32)]
+
+        assert [sharded._shard_for(d) for d in digests] == [sharded._shard_for(d.hex()) for d in digests]
+        assert len({sharded._shard_for(d) for d in digests}) == 4
+
+    def test_count_bits_sums_shards(self, getbit_redis):
+        """Test the bit count covers every shard"""
+        sharded = ShardedBloomFilter([getbit_redis(), getbit_redis()], 4, expected_items=1000, fp_rate=0.01)
+        assert sharded.count_bits() == 40
+
+class TestAsyncShardedBloomFilter:
+    """Unit tests for AsyncShardedBloomFilter"""
+
+    @pytest.mark.asyncio
+    async def test_check_many_concurrent_shards(self):
+        """Test the async variant checks every shard and keeps input order"""
+        shard_results = {}
+
+        def make_async_redis(bit):
+            mock_client = Mock()
+            mock_pipeline = Mock()
+            mock_pipeline.execute = AsyncMock(side_effect=lambda: [bit] * len(mock_pipeline.getbit.call_args_list))
+            mock_client.pipeline.return_value = mock_pipeline
+            return mock_client
+
+        clients = [make_async_redis(0), make_async_redis(1)]
+        sharded = AsyncShardedBloomFilter(clients, 2, expected_items=1000, fp_rate=0.01)
+        items = [f"item{i}" for i in range(20)]
+
+        results = await sharded.check_many(items)
+
+        assert results == [sharded._shard_for(item) == 1 for item in items]
+
+    def test_shard_filter_class(self):
+        """Test the shard type can be any filter variant"""
+        sharded = AsyncShardedBloomFilter(Mock(), 2, expected_items=1000, fp_rate=0.01, filter_class=AsyncBlockedBloomFilter)
+        assert all(isinstance(shard, AsyncBlockedBloomFilter) for shard in sharded.shards)
@@ -0,0 +1,128 @@
+import pytest
+from unittest.mock import Mock
+from app.BloomFilter import BloomFilter, BlockedBloomFilter, HASH_SCHEME_DIGEST
+from app.sharded import ShardedBloomFilter
+from app.bitmap import bitmap_bytes, set_bit
+from app.snapshot import (
+    Snapshot, SnapshotBloomFilter, SnapshotBlockedBloomFilter, HEADER,
+    export_snapshot, import_snapshot, open_snapshot_filter
+)
+
+def filled_bitmap(bloom_filter, items):
+    bitmap = bytearray(bitmap_bytes(bloom_filter.bit_size))
+    for item in items:
+        for pos in bloom_filter._get_bit_positions(item):
+            set_bit(bitmap, pos)
+    return bitmap
+
+class TestSnapshot:
+    """Unit tests for snapshot export, import and mmap loading"""
+
+    def test_export_round_trip(self, string_redis, tmp_path):
+        """Test a filter exported from Redis reads back with the same header and bits"""
+        probe = BloomFilter(Mock(), expected_items=1000, fp_rate=0.01)
+        bitmap = filled_bitmap(probe, ["password1", "password2"])
+        bloom_filter = BloomFilter(string_redis(bitmap), expected_items=1000, fp_rate=0.01)
+
+        path = tmp_path / "bloom.snap"
+        export_snapshot(bloom_filter, str(path), chunk_bytes=100)
+
+        with Snapshot(str(path)) as snapshot:
+            assert snapshot.bits == bitmap
+            assert (snapshot.bit_size, snapshot.num_hashes) == (bloom_filter.bit_size, bloom_filter.num_hashes)
+            assert (snapshot.expected_items, snapshot.fp_rate) == (1000, 0.01)
+        assert path.stat().st_size == HEADER.size + len(bitmap)
+
+    def test_export_short_redis_string(self, string_redis, tmp_path):
+        """Test the bits are zero filled past the end of the Redis string"""
+        bloom_filter = BloomFilter(string_redis(b"\x80"), expected_items=1000, fp_rate=0.01)
+        path = tmp_path / "bloom.snap"
+        export_snapshot(bloom_filter, str(path), chunk_bytes=64)
+
+        with Snapshot(str(path)) as snapshot:
+            assert len(snapshot.bits) == bitmap_bytes(bloom_filter.bit_size)
+            assert snapshot.bits[0] == 0x80
+
+    def test_corrupt_snapshot_rejected(self, string_redis, tmp_path):
+        """Test a flipped bit fails the checksum, and a truncated file fails the size check"""
+        bloom_filter = BloomFilter(string_redis(b"\x80"), expected_items=1000, fp_rate=0.01)
+        path = tmp_path / "bloom.snap"
+        export_snapshot(bloom_filter, str(path))
+
+        data = bytearray(path.read_bytes())
+        data[HEADER.size + 10] ^= 0x01
+        path.write_bytes(data)
+        with pytest.raises(ValueError, match="corrupt"):
+            Snapshot(str(path))
+        Snapshot(str(path), verify=False).close()
+
+        path.write_bytes(data[:-1])
+        with pytest.raises(ValueError, match="truncated"):
+            Snapshot(str(path), verify=False)
+
+    def test_sharded_filter_rejected(self, tmp_path):
+        """Test only single bitmap filters can be snapshotted"""
+        sharded = ShardedBloomFilter(Mock(), 2, expected_items=1000, fp_rate=0.01)
+        with pytest.raises(ValueError):
+            export_snapshot(sharded, str(tmp_path / "bloom.snap"))
+
+    def test_import_swaps_into_redis(self, string_redis, tmp_path):
+        """Test import uploads through a staging key and RENAMEs it over the live key"""
+        source = BloomFilter(Mock(), expected_items=1000, fp_rate=0.01)
+        bitmap = filled_bitmap(source, ["password1"])
+        source.redis_client = string_redis(bitmap)
+        path = tmp_path / "bloom.snap"
+        export_snapshot(source, str(path))
+
+        target = BloomFilter(string_redis(), expected_items=1000, fp_rate=0.01)
+        target.redis_key = "bloom:passwords:test"
+        import_snapshot(str(path), target, chunk_bytes=64)
+
+        target.redis_client.rename.assert_called_once_with("bloom:passwords:test:staging", "bloom:passwords:test")
+        assert target.redis_client.strings["bloom:passwords:test"] == bitmap
+
+    def test_import_rejects_other_sizing(self, string_redis, tmp_path):
+        """Test a snapshot can't be loaded into a filter that places bits differently"""
+        source = BloomFilter(string_redis(), expected_items=1000, fp_rate=0.01)
+        path = tmp_path / "bloom.snap"
+        export_snapshot(source, str(path))
+
+        for target in [
+            BloomFilter(string_redis(), expected_items=2000, fp_rate=0.01),
+            BloomFilter(string_redis(), expected_items=1000, fp_rate=0.01, hash_scheme=HASH_SCHEME_DIGEST),
+        ]:
+            with pytest.raises(ValueError):
+                import_snapshot(str(path), target)
+            target.redis_client.setrange.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_serve_checks_from_snapshot(self, string_redis, tmp_path):
+        """Test a mapped snapshot answers checks without Redis and refuses adds"""
+        source = BloomFilter(Mock(), expected_items=1000, fp_rate=0.01)
+        bitmap = filled_bitmap(source, ["existing_password"])
+        source.redis_client = string_redis(bitmap)
+        path = tmp_path / "bloom.snap"
+        export_snapshot(source, str(path))
+
+        bloom_filter = open_snapshot_filter(str(path))
+        assert type(bloom_filter) is SnapshotBloomFilter
+        assert await bloom_filter.check("existing_password") is True
+        assert await bloom_filter.check_many(["existing_password", "non_existing_password"]) == [True, False]
+        assert await bloom_filter.count_bits() == sum(bin(byte).count("1") for byte in bitmap)
+        with pytest.raises(Exception):
+            await bloom_filter.add("new_password")
+        bloom_filter.snapshot.close()
+
+    @pytest.mark.asyncio
+    async def test_serve_blocked_layout(self, string_redis, tmp_path):
+        """Test the header picks the blocked filter class and its positions"""
+        source = BlockedBloomFilter(Mock(), expected_items=1000, fp_rate=0.01)
+        source.redis_client = string_redis(filled_bitmap(source, ["existing_password"]))
+        path = tmp_path / "bloom.snap"
+        export_snapshot(source, str(path))
+
+        bloom_filter = open_snapshot_filter(str(path))
+        assert type(bloom_filter) is SnapshotBlockedBloomFilter
+        assert bloom_filter.bit_size == source.bit_size
+        assert await bloom_filter.check_many(["existing_password", "non_existing_password"]) == [True, False]
+        bloom_filter.snapshot.close()
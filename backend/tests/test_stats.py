@@ -0,0 +1,53 @@
+import asyncio
+import random
+import pytest
+from unittest.mock import Mock, AsyncMock
+from app.stats import estimate_items, fill_fp_rate, combine_stats, run_reconciliation
+
+class TestStats:
+    """Tests for the /stats estimates and the reconciliation loop"""
+    
+    def test_estimate_items_from_fill(self):
+        """Test the fill ratio estimate lands near the real item count"""
+        bit_size, num_hashes, items = 100_000, 7, 5_000
+        rng = random.Random(0)
+        bits = set()
+        for _ in range(items):
+            bits.update(rng.randrange(bit_size) for _ in range(num_hashes))
+        
+        assert estimate_items(bit_size, num_hashes, len(bits)) == pytest.approx(items, rel=0.03)
+        assert estimate_items(bit_size, num_hashes, 0) == 0
+        # a full bitmap still gives a number
+        assert estimate_items(bit_size, num_hashes, bit_size) > 0
+    
+    def test_fill_fp_rate(self):
+        """Test the current false positive rate follows the fill ratio"""
+        assert fill_fp_rate(1000, 3, 0) == 0
+        assert fill_fp_rate(1000, 3, 500) == pytest.approx(0.125)
+        assert fill_fp_rate(1000, 3, 1000) == 1
+    
+    def test_combine_stats(self):
+        """Test totals over shards add up and an unknown item count stays unknown"""
+        parts = [
+            {"bits_set": 10, "items_added": 2, "estimated_items": 3, "false_positive_rate": 0.1},
+            {"bits_set": 20, "items_added": None, "estimated_items": 5, "false_positive_rate": 0.3},
+        ]
+        
+        combined = combine_stats(parts, 0.2)
+        
+        assert combined == {"bits_set": 30, "items_added": None, "estimated_items": 8, "false_positive_rate": 0.2}
+    
+    @pytest.mark.asyncio
+    async def test_reconciliation_only_with_lock(self):
+        """Test only the worker that takes the lock recounts"""
+        bloom_filter = Mock(redis_key="bloom:passwords")
+        bloom_filter.reconcile_stats = AsyncMock()
+        redis_client = Mock()
+        redis_client.set = AsyncMock(side_effect=[True, None])
+        
+        task = asyncio.ensure_future(run_reconciliation(bloom_filter, redis_client, 0.01))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        
+        redis_client.set.assert_any_call("bloom:passwords:stats:lock", 1, nx=True, ex=1)
+        bloom_filter.reconcile_stats.assert_awaited_once()
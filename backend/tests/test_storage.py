@@ -0,0 +1,181 @@
+import multiprocessing
+import pytest
+from app.BloomFilter import BloomFilter, BlockedBloomFilter
+from app.storage import (
+    StorageBloomFilter, StorageBlockedBloomFilter, AsyncStorageBloomFilter,
+    BitStorage, MemoryBitStorage, MmapBitStorage, open_storage
+)
+from benchmarks.memory_redis import MemoryRedis
+
+def set_bit_of_every_byte(path, bit, size_bytes, batch=256):
+    """Worker process: set one bit of every byte of a mapped file, a batch at a time"""
+    with MmapBitStorage(path) as storage:
+        storage.allocate(size_bytes * 8)
+        for start in range(0, size_bytes, batch):
+            storage.set_bits([byte * 8 + bit for byte in range(start, min(start + batch, size_bytes))])
+
+class TestBitStorage:
+    """Unit tests for the storage engines"""
+
+    def test_set_bits_returns_old_bits(self):
+        """Test set_bits answers like SETBIT, a repeated position reads back as already set"""
+        storage = MemoryBitStorage()
+        storage.allocate(64)
+
+        assert storage.set_bits([0, 9, 9]) == [0, 0, 1]
+        assert storage.get_bits([0, 1, 9]) == [1, 0, 1]
+        assert storage.bits[:2] == b"\x80\x40"
+        assert storage.count_bits() == 2
+
+    def test_memory_size_mismatch(self):
+        """Test a bitmap of another size is refused"""
+        storage = MemoryBitStorage(bytes(4))
+
+        with pytest.raises(ValueError):
+            storage.allocate(64)
+
+    def test_mmap_persists(self, tmp_path):
+        """Test bits written to a mapped file are there when it is mapped again"""
+        path = str(tmp_path / "bloom.bits")
+        with MmapBitStorage(path) as storage:
+            storage.allocate(1024)
+            storage.set_bits([3, 1000])
+
+        with MmapBitStorage(path) as storage:
+            storage.allocate(1024)
+            assert storage.get_bits([3, 4, 1000]) == [1, 0, 1]
+        assert (tmp_path / "bloom.bits").stat().st_size == 128
+
+    def test_mmap_concurrent_writers(self, tmp_path):
+        """Test processes adding to the same bytes of one mapped file never lose each other's bits"""
+        path = str(tmp_path / "bloom.bits")
+        size_bytes = 64 * 1024
+        context = multiprocessing.get_context("fork")
+        workers = [context.Process(target=set_bit_of_every_byte, args=(path, bit, size_bytes)) for bit in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        assert [worker.exitcode for worker in workers] == [0] * 8
+        with MmapBitStorage(path) as storage:
+            storage.allocate(size_bytes * 8)
+            assert storage.count_bits() == size_bytes * 8
+
+    def test_mmap_size_mismatch(self, tmp_path):
+        """Test a file sized for another filter is refused"""
+        path = tmp_path / "bloom.bits"
+        path.write_bytes(bytes(100))
+
+        with pytest.raises(ValueError, match="100 bytes"):
+            MmapBitStorage(str(path)).allocate(1024)
+
+    def test_engines_implement_interface(self):
+        """Test an engine has to provide every batched call"""
+        class NoReads(BitStorage):
+            def allocate(self, bit_size):
+                pass
+
+        with pytest.raises(TypeError):
+            NoReads()
+
+    def test_open_storage(self, tmp_path):
+        """Test BLOOM_STORAGE names map to engines, mmap needs a path"""
+        assert isinstance(open_storage("memory"), MemoryBitStorage)
+        assert isinstance(open_storage("mmap", str(tmp_path / "bloom.bits")), MmapBitStorage)
+        with pytest.raises(ValueError):
+            open_storage("mmap")
+        with pytest.raises(ValueError, match="Unknown storage"):
+            open_storage("redis")
+
+class TestStorageBloomFilter:
+    """Unit tests for filters on a storage engine"""
+
+    @pytest.mark.parametrize("filter_class", [StorageBloomFilter, StorageBlockedBloomFilter])
+    def test_add_and_check(self, digests, filter_class):
+        """Test added items are found and others mostly aren't"""
+        bloom_filter = filter_class(MemoryBitStorage(), expected_items=1000, fp_rate=0.01)
+        added = digests("member", 200)
+        bloom_filter.add(added[0])
+        bloom_filter.add_many(added[1:], chunk_size=64)
+
+        assert bloom_filter.check(added[0]) is True
+        assert bloom_filter.check_many(added, chunk_size=64) == [True] * 200
+        assert sum(bloom_filter.check_many(digests("other", 200))) <= 10
+
+    @pytest.mark.parametrize("filter_class,storage_class", [
+        (BloomFilter, StorageBloomFilter), (BlockedBloomFilter, StorageBlockedBloomFilter)
+    ])
+    def test_same_bits_as_redis(self, digests, filter_class, storage_class):
+        """Test a filter on local storage sets exactly the bits the Redis filter does"""
+        redis_client = MemoryRedis()
+        redis_filter = filter_class(redis_client, expected_items=1000, fp_rate=0.01)
+        local_filter = storage_class(MemoryBitStorage(), expected_items=1000, fp_rate=0.01)
+        added = digests("member", 100)
+
+        redis_filter.add_many(added)
+        local_filter.add_many(added)
+
+        bits = bytes(local_filter.storage.bits)
+        assert bits.rstrip(b"\x00") == bytes(redis_client.strings[redis_filter.redis_key]).rstrip(b"\x00")
+
+    def test_reads_redis_bitmap(self, digests):
+        """Test a copy of the Redis string reads back what BloomFilter wrote"""
+        redis_client = MemoryRedis()
+        redis_filter = BloomFilter(redis_client, expected_items=1000, fp_rate=0.01)
+        redis_filter.add_many(digests("member", 50))
+        bits = bytes(redis_client.strings[redis_filter.redis_key]).ljust(-(-redis_filter.bit_size // 8), b"\x00")
+
+        local_filter = StorageBloomFilter(MemoryBitStorage(bits), expected_items=1000, fp_rate=0.01)
+
+        assert local_filter.check_many(digests("member", 50)) == [True] * 50
+
+    def test_stats_follow_adds(self, digests):
+        """Test bits_set is counted once and then kept current by adds"""
+        storage = MemoryBitStorage()
+        bloom_filter = StorageBloomFilter(storage, expected_items=1000, fp_rate=0.01)
+        assert bloom_filter.stats()["bits_set"] == 0
+
+        bloom_filter.add_many(digests("member", 100))
+
+        stats = bloom_filter.stats()
+        assert stats["bits_set"] == storage.count_bits()
+        assert stats["items_added"] is None
+        assert 90 <= stats["estimated_items"] <= 110
+
+    def test_mmap_stats_count_other_processes_adds(self, digests, tmp_path):
+        """Test bits_set on a shared file includes adds made through another mapping"""
+        path = str(tmp_path / "bloom.bits")
+        reader = StorageBloomFilter(MmapBitStorage(path), expected_items=1000, fp_rate=0.01)
+        writer = StorageBloomFilter(MmapBitStorage(path), expected_items=1000, fp_rate=0.01)
+        assert reader.stats()["bits_set"] == 0
+
+        writer.add_many(digests("member", 100))
+
+        assert reader.stats()["bits_set"] == writer.storage.count_bits() > 0
+        reader.storage.close()
+        writer.storage.close()
+
+    def test_mmap_filter_survives_restart(self, digests, tmp_path):
+        """Test a filter on a mapped file answers the same after reopening it"""
+        path = str(tmp_path / "bloom.bits")
+        bloom_filter = StorageBloomFilter(MmapBitStorage(path), expected_items=1000, fp_rate=0.01)
+        bloom_filter.add_many(digests("member", 100))
+        bloom_filter.storage.close()
+
+        bloom_filter = StorageBloomFilter(MmapBitStorage(path), expected_items=1000, fp_rate=0.01)
+
+        assert bloom_filter.check_many(digests("member", 100)) == [True] * 100
+        bloom_filter.storage.close()
+
+    @pytest.mark.asyncio
+    async def test_async_filter(self, digests):
+        """Test the async filter main.py serves from answers without Redis"""
+        bloom_filter = AsyncStorageBloomFilter(MemoryBitStorage(), expected_items=1000, fp_rate=0.01)
+
+        await bloom_filter.add(digests("member", 1)[0])
+        await bloom_filter.add_many(digests("member", 10)[1:])
+
+        assert await bloom_filter.check(digests("member", 1)[0]) is True
+        assert await bloom_filter.check_many(digests("member", 10)) == [True] * 10
+        assert (await bloom_filter.stats())["bits_set"] == await bloom_filter.count_bits()
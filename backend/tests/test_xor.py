@@ -0,0 +1,175 @@
+import hashlib
+import pytest
+from unittest.mock import Mock, AsyncMock
+from app.xor import (
+    BinaryFuseFilter, FileXorFilter, RedisXorFilter, HEADER,
+    item_key, layout, write_filter, upload_filter
+)
+
+class TestBinaryFuseFilter:
+    """Unit tests for building and querying a binary fuse filter"""
+
+    def test_no_false_negatives(self, digests):
+        """Test every item the filter was built from is reported present"""
+        items = digests("member", 5000)
+        fuse = BinaryFuseFilter.build([item_key(item) for item in items])
+
+        assert fuse.items == 5000
+        assert all(fuse.contains(item) for item in items)
+
+    @pytest.mark.parametrize("fingerprint_bits,max_rate", [(8, 2 / 256), (16, 10 / 65536)])
+    def test_false_positive_rate(self, digests, fingerprint_bits, max_rate):
+        """Test the false positive rate is close to 2^-fingerprint_bits"""
+        fuse = BinaryFuseFilter.build([item_key(item) for item in digests("member", 5000)], fingerprint_bits)
+
+        false_positives = sum(fuse.contains(item) for item in digests("other", 20000))
+
+        assert false_positives / 20000 < max_rate
+
+    def test_duplicates_dropped(self, digests):
+        """Test repeated keys are counted once"""
+        keys = [item_key(item) for item in digests("member", 100)]
+
+        fuse = BinaryFuseFilter.build(keys + keys)
+
+        assert fuse.items == 100
+
+    def test_raw_and_hex_items_agree(self):
+        """Test a raw digest and its hex form map to the same key"""
+        digest = hashlib.sha256(b"password").digest()
+
+        assert item_key(digest) == item_key(digest.hex())
+
+    def test_layout_size(self):
+        """Test large sets get close to 1.13 slots per item"""
+        segment_length, segment_count_length, array_length = layout(1_000_000)
+
+        assert array_length == segment_count_length + 2 * segment_length
+        assert 1.12 < array_length / 1_000_000 < 1.16
+
+    def test_bad_fingerprint_bits(self):
+        """Test only 8 and 16 bit fingerprints are accepted"""
+        with pytest.raises(ValueError):
+            BinaryFuseFilter.build([1, 2, 3], fingerprint_bits=12)
+
+class TestXorFilter:
+    """Unit tests for serving checks from a filter file or Redis"""
+
+    @pytest.fixture
+    def fuse(self, digests):
+        return BinaryFuseFilter.build([item_key(item) for item in digests("member", 1000)], 16)
+
+    @pytest.mark.asyncio
+    async def test_file_round_trip(self, digests, fuse, tmp_path):
+        """Test a written filter file maps back with the same header and answers"""
+        path = tmp_path / "corpus.xor"
+        write_filter(path, fuse)
+
+        with FileXorFilter(path) as xor_filter:
+            assert xor_filter.fuse.seed == fuse.seed
+            assert xor_filter.fuse.items == 1000
+            assert await xor_filter.check(digests("member", 1)[0])
+            results = await xor_filter.check_many(digests("member", 1000))
+
+        assert all(results)
+
+    @pytest.mark.asyncio
+    async def test_file_stats(self, fuse, tmp_path):
+        """Test stats report the exact item count and fingerprint false positive rate"""
+        path = tmp_path / "corpus.xor"
+        write_filter(path, fuse)
+
+        with FileXorFilter(path) as xor_filter:
+            stats = await xor_filter.stats()
+
+        assert stats["items_added"] == 1000
+        assert stats["estimated_items"] == 1000
+        assert stats["false_positive_rate"] == 2 ** -16
+        assert stats["bits_set"] == sum(bin(b).count("1") for b in fuse.fingerprints)
+
+    def test_corrupt_file_rejected(self, fuse, tmp_path):
+        """Test a flipped fingerprint byte fails the checksum"""
+        path = tmp_path / "corpus.xor"
+        write_filter(path, fuse)
+        data = bytearray(path.read_bytes())
+        data[HEADER.size] ^= 0xFF
+        path.write_bytes(data)
+
+        with pytest.raises(ValueError, match="corrupt"):
+            FileXorFilter(path)
+
+    def test_truncated_file_rejected(self, fuse, tmp_path):
+        """Test a file shorter than its header says is rejected"""
+        path = tmp_path / "corpus.xor"
+        path.write_bytes(fuse.header() + fuse.fingerprints[:-1])
+
+        with pytest.raises(ValueError, match="truncated"):
+            FileXorFilter(path)
+
+    def test_not_a_filter_rejected(self, tmp_path):
+        """Test a file without the magic is rejected"""
+        path = tmp_path / "corpus.xor"
+        path.write_bytes(b"\x00" * 128)
+
+        with pytest.raises(ValueError, match="not a binary fuse filter"):
+            FileXorFilter(path)
+
+    def test_upload_swaps_into_redis(self, fuse):
+        """Test upload writes the staging key in chunks and renames it over the data key"""
+        mock_client = Mock()
+        data = fuse.header() + fuse.fingerprints
+
+        upload_filter(mock_client, "bloom:passwords:xor", data, chunk_bytes=1024)
+
+        assert mock_client.setrange.call_count == -(-len(data) // 1024)
+        mock_client.rename.assert_called_once_with("bloom:passwords:xor:staging", "bloom:passwords:xor")
+
+    @pytest.mark.asyncio
+    async def test_redis_checks(self, digests, fuse, bitmap_redis):
+        """Test checks against Redis read the header with 3 slots per item in one pipeline each"""
+        mock_client = bitmap_redis(fuse.header() + fuse.fingerprints)
+        xor_filter = RedisXorFilter(mock_client)
+        await xor_filter.load()
+
+        members = await xor_filter.check_many(digests("member", 1000))
+        others = await xor_filter.check_many(digests("other", 1000))
+
+        assert all(members)
+        assert sum(others) < 5
+        assert xor_filter.fuse.array_length == fuse.array_length
+        mock_client.getrange.assert_called_once_with("bloom:passwords:xor", 0, HEADER.size - 1)
+        assert mock_client.pipeline.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_redis_upload_picked_up(self, digests, fuse, bitmap_redis):
+        """Test a filter uploaded over the key while serving is reloaded on the next check"""
+        data = bytearray(fuse.header() + fuse.fingerprints)
+        xor_filter = RedisXorFilter(bitmap_redis(data))
+        await xor_filter.load()
+        assert not any(await xor_filter.check_many(digests("other", 100)))
+
+        rebuilt = BinaryFuseFilter.build([item_key(item) for item in digests("other", 100)], 8)
+        data[:] = rebuilt.header() + rebuilt.fingerprints
+
+        assert await xor_filter.check_many(digests("other", 100)) == [True] * 100
+        assert xor_filter.fuse.fingerprint_bits == 8
+
+    @pytest.mark.asyncio
+    async def test_redis_stats(self, fuse, bitmap_redis):
+        """Test stats count the fingerprint bits in Redis, not the header"""
+        mock_client = bitmap_redis(fuse.header() + fuse.fingerprints)
+        xor_filter = RedisXorFilter(mock_client)
+        await xor_filter.load()
+
+        stats = await xor_filter.stats()
+
+        assert stats["bits_set"] == sum(bin(b).count("1") for b in fuse.fingerprints)
+        assert xor_filter.bit_size == len(fuse.fingerprints) * 8
+
+    @pytest.mark.asyncio
+    async def test_adds_refused(self, digests, fuse):
+        """Test the static filter refuses adds"""
+        xor_filter = RedisXorFilter(AsyncMock())
+
+        with pytest.raises(Exception, match="static"):
+            await xor_filter.add(digests("member", 1)[0])